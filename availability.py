@@ -0,0 +1,192 @@
+"""Свободные столы по слотам: индекс занятости в памяти.
+
+Рабочий день делится на слоты по BOOKING_SLOT_MINUTES; бронь занимает один стол
+наименьшей подходящей вместимости на BOOKING_DURATION_MINUTES. Для каждого дня
+хранится занятость: {вместимость стола: [занято столов в слоте i]}. День
+строится одним запросом по индексу (booking_date, booking_time) и дальше
+обновляется при каждой брони, так что проверки не ходят в БД.
+
+Индекс принадлежит процессу: проверка и резервирование выполняются без
+await между ними, поэтому параллельные апдейты внутри процесса не
+пересекаются. При запуске в нескольких процессах брони другого процесса
+станут видны только после перезагрузки дня (reload_day).
+"""
+import math
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+
+import config
+from database import AsyncSessionLocal, Booking
+
+ACTIVE_STATUSES = ('pending', 'confirmed')
+
+
+def parse_tables(spec):
+    """"2x4,4x6" -> {2: 4, 4: 6}: вместимость стола -> количество столов."""
+    tables = {}
+    for item in spec.split(','):
+        if item.strip():
+            seats, count = item.lower().split('x')
+            tables[int(seats)] = tables.get(int(seats), 0) + int(count)
+    return dict(sorted(tables.items()))
+
+
+def _minutes(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class Availability:
+    def __init__(self, tables, slot_minutes, duration_minutes, open_time, close_time):
+        self.tables = tables
+        self.slot_minutes = slot_minutes
+        self.open_minutes = _minutes(open_time)
+        self.span = math.ceil(duration_minutes / slot_minutes)  # слотов на одну бронь
+        # Последняя бронь начинается за длительность брони до закрытия
+        self.starts = max(0, (_minutes(close_time) - duration_minutes - self.open_minutes) // slot_minutes + 1)
+        self.slot_count = self.starts + self.span - 1
+        self.max_guests = max(tables, default=0)
+        self._days = {}  # date -> {вместимость: list занятых столов по слотам}
+
+    # Время <-> номер слота
+
+    def slot_of(self, value):
+        """Номер слота для времени начала или None, если время вне сетки."""
+        offset = value.hour * 60 + value.minute - self.open_minutes
+        if offset < 0 or offset % self.slot_minutes:
+            return None
+        index = offset // self.slot_minutes
+        return index if index < self.starts else None
+
+    def time_of(self, index):
+        minutes = self.open_minutes + index * self.slot_minutes
+        return time(minutes // 60, minutes % 60)
+
+    def start_times(self):
+        return [self.time_of(index) for index in range(self.starts)]
+
+    # Индекс дней
+
+    def is_loaded(self, day):
+        return day in self._days
+
+    def load(self, day, bookings):
+        """Строит занятость дня по [(booking_time, table_seats, guests)]."""
+        self._days[day] = {seats: [0] * self.slot_count for seats in self.tables}
+        for booking_time, seats, guests in bookings:
+            seats = seats or self.seats_for(guests)
+            index = self._index(booking_time)
+            if seats in self.tables and index is not None:
+                self._occupy(day, index, seats, 1)
+
+    def forget(self, day):
+        self._days.pop(day, None)
+
+    def _index(self, value):
+        # Брони вне текущей сетки (часы работы поменялись) занимают ближайшие слоты
+        offset = value.hour * 60 + value.minute - self.open_minutes
+        if offset < 0:
+            return None
+        return min(offset // self.slot_minutes, self.slot_count - 1)
+
+    def _occupy(self, day, index, seats, delta):
+        occupied = self._days[day][seats]
+        for i in range(index, min(index + self.span, self.slot_count)):
+            occupied[i] += delta
+
+    # Запросы
+
+    def seats_for(self, guests):
+        """Наименьшая вместимость стола, за который поместятся гости."""
+        for seats in self.tables:
+            if seats >= guests:
+                return seats
+        return None
+
+    def table_for(self, day, index, guests):
+        """Вместимость свободного стола для брони в слоте `index` или None. День должен быть загружен."""
+        occupancy = self._days[day]
+        end = index + self.span
+        for seats, count in self.tables.items():
+            if seats >= guests and max(occupancy[seats][index:end]) < count:
+                return seats
+        return None
+
+    def free_slots(self, day, guests, after=None, limit=None):
+        """Начала свободных слотов дня для `guests` гостей (не раньше `after`)."""
+        first = 0
+        if after is not None:
+            offset = after.hour * 60 + after.minute - self.open_minutes
+            first = max(0, -(-offset // self.slot_minutes))
+        free = []
+        for index in range(first, self.starts):
+            if self.table_for(day, index, guests) is not None:
+                free.append(self.time_of(index))
+                if limit and len(free) >= limit:
+                    break
+        return free
+
+    def reserve(self, day, value, guests):
+        """Занимает стол под бронь; возвращает вместимость стола или None, если мест нет."""
+        index = self.slot_of(value)
+        seats = self.table_for(day, index, guests) if index is not None else None
+        if seats is not None:
+            self._occupy(day, index, seats, 1)
+        return seats
+
+    def release(self, day, value, seats):
+        index = self._index(value)
+        if day in self._days and seats in self.tables and index is not None:
+            self._occupy(day, index, seats, -1)
+
+
+availability = Availability(
+    parse_tables(config.BOOKING_TABLES), config.BOOKING_SLOT_MINUTES, config.BOOKING_DURATION_MINUTES,
+    config.BOOKING_OPEN, config.BOOKING_CLOSE,
+)
+
+
+def now():
+    """Текущее время заведения (без tzinfo, как booking_date/booking_time)."""
+    return datetime.now(ZoneInfo(config.TIMEZONE)).replace(tzinfo=None)
+
+
+async def _fetch(first, last):
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            select(Booking.booking_date, Booking.booking_time, Booking.table_seats, Booking.guests)
+            .where(Booking.booking_date.between(first, last), Booking.status.in_(ACTIVE_STATUSES))
+            .order_by(Booking.booking_date, Booking.booking_time)
+        )
+        by_day = {}
+        for booking_date, booking_time, seats, guests in rows:
+            by_day.setdefault(booking_date, []).append((booking_time, seats, guests))
+    return by_day
+
+
+async def preload(days=None):
+    """Загружает все дни, открытые для бронирования, одним запросом по диапазону дат."""
+    first = now().date()
+    last = first + timedelta(days=config.BOOKING_DAYS_AHEAD if days is None else days)
+    by_day = await _fetch(first, last)
+    day = first
+    while day <= last:
+        availability.load(day, by_day.get(day, ()))
+        day += timedelta(days=1)
+
+
+async def ensure_day(day):
+    if not availability.is_loaded(day):
+        await reload_day(day)
+
+
+async def reload_day(day):
+    by_day = await _fetch(day, day)
+    availability.load(day, by_day.get(day, ()))
+
+
+def bookable(day: date):
+    today = now().date()
+    return today <= day <= today + timedelta(days=config.BOOKING_DAYS_AHEAD)
@@ -0,0 +1,144 @@
+"""Заглушки Telegram для бенчмарков: обработчики работают без сети и токена."""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+
+def setup_env(db_name):
+    """Готовит окружение до импорта config: тестовый токен и локальная SQLite."""
+    os.environ.setdefault('BOT_TOKEN', '123456:bench')
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.gettempdir(), db_name))
+    # Лог каждого HTTP-запроса заглушает результаты
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+class FakeBot:
+    """Бот, который вместо HTTP-запроса ждет `latency` секунд и считает вызовы."""
+
+    defaults = None
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def __getattr__(self, name):
+        async def method(*args, **kwargs):
+            self.calls += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return True
+
+        return method
+
+
+class FakeRequest(BaseRequest):
+    """Транспорт Bot API без сети: настоящий ExtBot, ответы формируются локально.
+
+    Подставляется через ApplicationBuilder.request(), так что через него идут
+    все вызовы context.bot.* из обработчиков. С `rate` отправки сверх rate
+    сообщений в секунду получают 429 с retry_after, как от настоящего Bot API.
+    """
+
+    def __init__(self, latency=0.0, rate=None, retry_after=1):
+        self.latency = latency
+        self.rate = rate
+        self.retry_after = retry_after
+        self.calls = {}
+        self.throttled = 0
+        self._window = (0, 0)  # (секунда, отправлено сообщений в ней)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._flooded(endpoint):
+            self.throttled += 1
+            return 429, json.dumps({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }).encode()
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({'ok': True, 'result': self.result(endpoint, params)}).encode()
+
+    def _flooded(self, endpoint):
+        if not self.rate or not endpoint.startswith(('send', 'edit', 'copy')):
+            return False
+        second = int(time.monotonic())
+        current, sent = self._window
+        if current != second:
+            current, sent = second, 0
+        self._window = (current, sent + 1)
+        return sent >= self.rate
+
+    def result(self, endpoint, params):
+        if endpoint == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if endpoint.startswith('send') or endpoint.startswith('edit'):
+            chat_id = params.get('chat_id', 0)
+            return {
+                'message_id': next(_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        return True
+
+
+_ids = itertools.count(1)
+
+
+def message_update(bot, user_id, text):
+    data = {
+        'update_id': next(_ids),
+        'message': {
+            'message_id': next(_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'text': text,
+        },
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        data['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return Update.de_json(data, bot)
+
+
+def callback_update(bot, user_id, callback_data):
+    data = {
+        'update_id': next(_ids),
+        'callback_query': {
+            'id': str(next(_ids)),
+            'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'data': callback_data,
+            'message': {
+                'message_id': next(_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'menu',
+            },
+        },
+    }
+    return Update.de_json(data, bot)
+
+
+def fake_context(bot, user_data=None):
+    return SimpleNamespace(bot=bot, user_data=user_data if user_data is not None else {})
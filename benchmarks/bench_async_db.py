@@ -0,0 +1,117 @@
+"""Пропускная способность /start и /balance: синхронная сессия против асинхронной.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_async_db --users 200 --updates 2000 --latency-ms 5
+
+Без DATABASE_URL используется временная SQLite. Параметр --latency-ms добавляет
+задержку к каждому SQL-выражению в потоке драйвера и тем самым имитирует сетевой
+round-trip до Postgres: в синхронном варианте он блокирует цикл событий,
+в асинхронном выполняется в потоке aiosqlite и перекрывается с другими апдейтами.
+Текущие обработчики к тому же читают профиль из user_cache, так что повторные
+/start и /balance одного пользователя обходятся без БД.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks._fakes import setup_env, FakeBot, message_update, fake_context
+
+setup_env('bench_async_db.db')
+
+from sqlalchemy import event, delete  # noqa: E402
+
+import commands  # noqa: E402
+from database import engine, async_engine, SessionLocal, User, init_db  # noqa: E402
+from handlers import user_handlers  # noqa: E402
+import user_cache  # noqa: E402
+
+
+async def legacy_start(update, context):
+    # Путь до перехода на AsyncSession: блокирующий запрос прямо в корутине
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.telegram_id == update.effective_user.id).first()
+        await update.message.reply_text(f"Добро пожаловать, {user.first_name}!")
+    finally:
+        db.close()
+
+
+async def legacy_balance(update, context):
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.telegram_id == update.effective_user.id).first()
+        await update.message.reply_text(f"Ваш баланс: {user.bonus_balance} бонусных баллов")
+    finally:
+        db.close()
+
+
+def install_latency(latency):
+    if not latency or not engine.url.get_backend_name() == 'sqlite':
+        return
+
+    def delay(statement):
+        time.sleep(latency)
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_conn, record):
+        dbapi_conn.set_trace_callback(delay)
+
+    @event.listens_for(async_engine.sync_engine, 'connect')
+    def on_async_connect(dbapi_conn, record):
+        dbapi_conn.await_(dbapi_conn.driver_connection.set_trace_callback(delay))
+
+
+def seed(users):
+    init_db()
+    db = SessionLocal()
+    try:
+        db.execute(delete(User))
+        db.add_all(
+            User(telegram_id=100000 + i, first_name='Bench', last_name=str(i), phone='+70000000000',
+                 bonus_balance=100, registration_complete=True)
+            for i in range(users)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def run(handlers, users, updates, concurrency):
+    bot = FakeBot()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        start, balance = handlers
+        user_id = 100000 + i % users
+        async with semaphore:
+            if i % 2:
+                await start(message_update(bot, user_id, '/start'), fake_context(bot))
+            else:
+                await balance(message_update(bot, user_id, '/balance'), fake_context(bot))
+
+    began = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(updates)))
+    return updates / (time.perf_counter() - began)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    install_latency(args.latency_ms / 1000)
+    seed(args.users)
+
+    before = asyncio.run(run((legacy_start, legacy_balance), args.users, args.updates, args.concurrency))
+    after = asyncio.run(run((user_handlers.start, commands.balance), args.users, args.updates, args.concurrency))
+    print(f"sync Session:  {before:8.1f} updates/s")
+    print(f"AsyncSession:  {after:8.1f} updates/s  (x{after / before:.1f})")
+    print(f"кэш профилей: {user_cache.cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Индекс свободных столов: построение из БД и время ответа на запросы.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_availability --bookings 20000 --checks 100000
+
+Заполняет bookings случайными бронями на BOOKING_DAYS_AHEAD дней вперед,
+строит индекс availability.preload (один запрос по диапазону дат) и измеряет
+среднее время «свободен ли слот для N гостей» и «ближайшие свободные слоты».
+Для сравнения приводится проверка запросом к БД на каждый вызов.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import timedelta
+
+from benchmarks._fakes import setup_env
+
+setup_env('bench_availability.db')
+
+from sqlalchemy import delete, func, insert, select  # noqa: E402
+
+import availability  # noqa: E402
+import config  # noqa: E402
+from database import AsyncSessionLocal, SessionLocal, Booking, init_db  # noqa: E402
+
+engine = availability.availability
+
+
+def seed(bookings, rng):
+    init_db()
+    today = availability.now().date()
+    starts = engine.start_times()
+    db = SessionLocal()
+    try:
+        db.execute(delete(Booking))
+        rows = []
+        for _ in range(bookings):
+            day = today + timedelta(days=rng.randrange(config.BOOKING_DAYS_AHEAD))
+            slot = rng.choice(starts)
+            guests = rng.randint(1, engine.max_guests)
+            rows.append({'user_id': 1, 'booking_date': day, 'booking_time': slot, 'guests': guests,
+                         'table_seats': engine.seats_for(guests), 'status': 'pending'})
+        db.execute(insert(Booking), rows)
+        db.commit()
+    finally:
+        db.close()
+    return today
+
+
+def per_call(func, args_list):
+    began = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - began) / len(args_list) * 1e6
+
+
+async def db_check(day, slot, guests):
+    # Проверка без индекса в памяти: пересекающиеся брони этого дня из БД
+    index = engine.slot_of(slot)
+    start = engine.time_of(max(0, index - engine.span + 1))
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            select(Booking.table_seats, func.count())
+            .where(Booking.booking_date == day, Booking.booking_time.between(start, slot),
+                   Booking.status.in_(availability.ACTIVE_STATUSES))
+            .group_by(Booking.table_seats)
+        )
+
+
+async def run(args, today, rng):
+    began = time.perf_counter()
+    await availability.preload()
+    build = time.perf_counter() - began
+
+    starts = engine.start_times()
+    checks = [
+        (today + timedelta(days=rng.randrange(config.BOOKING_DAYS_AHEAD)), rng.randrange(engine.starts),
+         rng.randint(1, engine.max_guests))
+        for _ in range(args.checks)
+    ]
+    check_us = per_call(engine.table_for, checks)
+    slots_us = per_call(lambda day, index, guests: engine.free_slots(day, guests, limit=12), checks)
+
+    sample = checks[:args.db_checks]
+    began = time.perf_counter()
+    for day, index, guests in sample:
+        await db_check(day, starts[index], guests)
+    db_us = (time.perf_counter() - began) / len(sample) * 1e6
+    return build, check_us, slots_us, db_us
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--checks', type=int, default=100000)
+    parser.add_argument('--db-checks', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    today = seed(args.bookings, rng)
+    build, check_us, slots_us, db_us = asyncio.run(run(args, today, rng))
+    print(f"построение индекса на {config.BOOKING_DAYS_AHEAD + 1} дней из {args.bookings} броней: {build * 1000:.1f} ms")
+    print(f"свободен ли слот:          {check_us:8.2f} мкс")
+    print(f"ближайшие свободные слоты: {slots_us:8.2f} мкс")
+    print(f"запрос к БД (было бы):     {db_us:8.2f} мкс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Холодный старт вебхука: от запуска процесса до первого обработанного апдейта.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_cold_start --runs 5 --api-latency-ms 50
+
+Бенчмарк поднимает заглушку Bot API (каждый вызов отвечает через
+--api-latency-ms), запускает `uvicorn bot:app` отдельным процессом и сразу
+начинает слать в /webhook апдейт /start. Замеряются два момента: вебхук
+принял апдейт (закончился lifespan) и заглушка получила sendMessage с ответом.
+
+Режимы:
+
+* полная сверка схемы — перед запуском удаляется отпечаток schema_meta,
+  как если бы init_db сверял все таблицы на каждом старте (прежнее поведение);
+* схема актуальна — обычный повторный запуск.
+
+По умолчанию база — SQLite во временном каталоге; чтобы увидеть цену
+запросов к каталогу по сети, передайте --database-url postgresql://...
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qsl
+
+from benchmarks._fakes import setup_env
+
+setup_env('bench_cold_start.db')
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from starlette.applications import Starlette  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from starlette.responses import JSONResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+USER_ID = 700001
+_ids = itertools.count(1)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeBotApi:
+    """HTTP-заглушка Bot API: отвечает на любой метод и отмечает первый sendMessage."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.replied = asyncio.Event()
+
+    async def handle(self, request: Request):
+        method = request.path_params['method']
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method.startswith('send'):
+            body = (await request.body()).decode()
+            form = json.loads(body) if body.startswith('{') else dict(parse_qsl(body))
+            result = {'message_id': next(_ids), 'date': int(time.time()),
+                      'chat': {'id': int(form.get('chat_id', 0)), 'type': 'private'}, 'text': form.get('text', '')}
+            self.replied.set()
+        else:
+            result = True
+        return JSONResponse({'ok': True, 'result': result})
+
+    def app(self):
+        return Starlette(routes=[Route('/bot{token}/{method}', self.handle, methods=['GET', 'POST'])])
+
+
+def start_update():
+    return {
+        'update_id': next(_ids),
+        'message': {
+            'message_id': next(_ids), 'date': int(time.time()),
+            'chat': {'id': USER_ID, 'type': 'private'},
+            'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Bench'},
+            'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+
+def forget_schema():
+    from sqlalchemy import text
+    from database import engine
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS schema_meta"))
+
+
+def count_schema_queries():
+    """Сколько SQL-запросов делает init_db в каждом режиме: по сети каждый — это круг до БД."""
+    from sqlalchemy import event
+    from database import engine, init_db
+    counts = []
+    statements = []
+    listener = lambda *args: statements.append(1)  # noqa: E731
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        for force in (True, False):
+            statements.clear()
+            init_db(force=force)
+            counts.append(len(statements))
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return counts
+
+
+async def run_once(api, api_port, database_url):
+    bot_port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, TELEGRAM_API_URL=f'http://127.0.0.1:{api_port}')
+    env.pop('WEBHOOK_URL', None)
+    api.replied.clear()
+
+    began = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'bot:app', '--port', str(bot_port), '--log-level', 'warning'],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    try:
+        async with httpx.AsyncClient() as client:
+            while True:
+                try:
+                    response = await client.post(f'http://127.0.0.1:{bot_port}/webhook', json=start_update())
+                    if response.status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if process.poll() is not None:
+                    raise RuntimeError(process.stdout.read())
+                await asyncio.sleep(0.005)
+        ready = time.perf_counter() - began
+        await asyncio.wait_for(api.replied.wait(), 30)
+        replied = time.perf_counter() - began
+    finally:
+        process.terminate()
+        output, _ = await asyncio.to_thread(process.communicate)
+    breakdown = re.search(r'Запуск за .*', output)
+    return ready, replied, breakdown.group(0) if breakdown else ''
+
+
+async def run(args):
+    api = FakeBotApi(args.api_latency_ms / 1000)
+    api_port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app(), port=api_port, log_level='warning'))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    database_url = args.database_url or os.environ['DATABASE_URL']
+    await run_once(api, api_port, database_url)  # создание схемы и прогрев файлового кэша
+    for label, before in (('полная сверка схемы', forget_schema), ('схема актуальна', None)):
+        ready, replied, breakdowns = [], [], []
+        for _ in range(args.runs):
+            if before:
+                await asyncio.to_thread(before)
+            result = await run_once(api, api_port, database_url)
+            ready.append(result[0])
+            replied.append(result[1])
+            breakdowns.append(result[2])
+        print(f"{label}: вебхук готов через {statistics.median(ready) * 1000:6.0f} ms, "
+              f"первый ответ через {statistics.median(replied) * 1000:6.0f} ms (медиана из {args.runs})")
+        print(f"  {breakdowns[-1]}")
+
+    full, current = await asyncio.to_thread(count_schema_queries)
+    print(f"запросов к БД при сверке схемы: полная {full}, при актуальной схеме {current}")
+
+    server.should_exit = True
+    await serving
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--api-latency-ms', type=float, default=50)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
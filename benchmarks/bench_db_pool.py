@@ -0,0 +1,186 @@
+"""Пул соединений и обращения к БД на единицу работы.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_db_pool
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_db_pool --pool-sizes 1,2,5,10 --concurrency 20
+
+* запросы — регистрация, /balance (промах и попадание в кэш) и начисление
+  кассиром проходят через настоящие обработчики; считаются выполненные
+  запросы к БД (событие before_cursor_execute), то есть обращения к серверу.
+  Проверка соединения pre-ping сюда не входит — это еще одно обращение на
+  выдачу соединения из пула, если оно простаивало;
+* только на Postgres — горячий запрос пользователя по telegram_id
+  с подготовкой на сервере и без нее (задержка p50/p99), и пропускная
+  способность при --concurrency одновременных запросах на пулах разного
+  размера: запросов в секунду и p99 вместе с ожиданием соединения.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+# Здесь считаются запросы к БД: ответы одному чату подряд не должны ждать лимита Bot API
+os.environ.setdefault('TELEGRAM_CHAT_RATE', '1000')
+
+from benchmarks._fakes import setup_env, FakeRequest, message_update, callback_update, fake_context  # noqa: E402
+
+setup_env('bench_db_pool.db')
+
+from sqlalchemy import delete, event, select  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import config  # noqa: E402
+import database  # noqa: E402
+import user_cache  # noqa: E402
+from database import AsyncSessionLocal, SessionLocal, User, PointsTransaction, OutboxMessage, async_engine  # noqa: E402
+from handlers import admin_handlers  # noqa: E402
+from main import build_application  # noqa: E402
+
+FIRST_USER = 700000
+
+
+class Statements:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def reset_db():
+    database.init_db()
+    db = SessionLocal()
+    try:
+        ids = select(User.id).where(User.telegram_id >= FIRST_USER)
+        db.execute(delete(PointsTransaction).where(PointsTransaction.user_id.in_(ids)))
+        db.execute(delete(OutboxMessage).where(OutboxMessage.chat_id >= FIRST_USER))
+        db.execute(delete(User).where(User.telegram_id >= FIRST_USER))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def count_statements(users):
+    builder = Application.builder().token(config.BOT_TOKEN).request(FakeRequest())
+    application = build_application(builder)
+    statements = Statements(async_engine.sync_engine)
+    steps = {}
+
+    async def measure(name, update):
+        before = statements.count
+        await application.process_update(update)
+        steps.setdefault(name, []).append(statements.count - before)
+
+    async with application:
+        bot = application.bot
+        for telegram_id in range(FIRST_USER, FIRST_USER + users):
+            await measure('/start', message_update(bot, telegram_id, '/start'))
+            await measure('имя', message_update(bot, telegram_id, 'Имя'))
+            await measure('фамилия', message_update(bot, telegram_id, 'Фамилия'))
+            await measure('телефон', message_update(bot, telegram_id, f'+7{telegram_id}'))
+            await measure('подтверждение регистрации', callback_update(bot, telegram_id, 'confirm_registration'))
+            user_cache.cache.invalidate(telegram_id)
+            await measure('/balance, промах кэша', message_update(bot, telegram_id, '/balance'))
+            await measure('/balance, из кэша', message_update(bot, telegram_id, '/balance'))
+
+        async with AsyncSessionLocal() as db:
+            user_ids = (await db.scalars(select(User.id).where(User.telegram_id >= FIRST_USER))).all()
+        context = fake_context(bot)
+        for user_id in user_ids:
+            before = statements.count
+            await admin_handlers.accrue_bonus(context, 0, user_id, 1000)
+            steps.setdefault('начисление кассиром', []).append(statements.count - before)
+
+    for name, counts in steps.items():
+        print(f"{name:<28} запросов к БД: {statistics.mean(counts):.1f}")
+
+
+def _engine(pool_size, prepared):
+    options = database._engine_options(config.DATABASE_URL, pool_size)
+    options['max_overflow'] = 0
+    if not prepared:
+        options['connect_args'] = {'prepare_threshold': None}
+    engine = create_async_engine(database._async_url(config.DATABASE_URL), **options)
+    if prepared:
+        event.listen(engine.sync_engine, 'do_execute', database._prepared)
+    return engine
+
+
+def _query(telegram_id):
+    return select(User).where(User.telegram_id == telegram_id).execution_options(prepare=True)
+
+
+def _describe(latencies):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    return f"p50 {p50:.2f} ms, p99 {p99:.2f} ms"
+
+
+async def hot_lookup(args):
+    for prepared in (False, True):
+        engine = _engine(1, prepared)
+        latencies = []
+        async with engine.connect() as conn:
+            for i in range(args.lookups):
+                began = time.perf_counter()
+                (await conn.execute(_query(FIRST_USER + i % args.users))).first()
+                latencies.append(time.perf_counter() - began)
+        await engine.dispose()
+        print(f"запрос пользователя {'с подготовкой' if prepared else 'без подготовки'}: {_describe(latencies)}")
+
+
+async def pool_throughput(args):
+    for size in args.pool_sizes:
+        engine = _engine(size, prepared=True)
+        latencies = []
+        deadline = time.perf_counter() + args.seconds
+
+        async def worker(n):
+            i = n
+            while time.perf_counter() < deadline:
+                began = time.perf_counter()
+                async with engine.connect() as conn:
+                    (await conn.execute(_query(FIRST_USER + i % args.users))).first()
+                latencies.append(time.perf_counter() - began)
+                i += args.concurrency
+
+        began = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(args.concurrency)))
+        elapsed = time.perf_counter() - began
+        await engine.dispose()
+        speed = f"{len(latencies) / elapsed:,.0f}".replace(',', ' ')
+        print(f"пул {size:>3}, {args.concurrency} одновременно: {speed} запросов/с, {_describe(latencies)}")
+
+
+async def run(args):
+    await count_statements(args.users)
+    if async_engine.dialect.name != 'postgresql':
+        print("\nПодготовка запросов и размер пула проверяются только на Postgres (DATABASE_URL)")
+        return
+    print()
+    await hot_lookup(args)
+    print()
+    await pool_throughput(args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--lookups', type=int, default=5000)
+    parser.add_argument('--pool-sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[1, 2, 5, 10])
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    reset_db()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
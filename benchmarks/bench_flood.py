@@ -0,0 +1,178 @@
+"""Флуд от части пользователей: нагрузка на БД и Bot API с защитой от флуда и без нее.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_flood --users 100 --flooders 20 --flood 0,100,1000
+
+--users обычных пользователей проходят регистрацию и смотрят баланс. Каждый
+из --flooders присылает --flood апдейтов подряд: новые пользователи —
+/start и произвольный текст, зарегистрированные — /history, «Мой баланс»,
+«Списать баллы» и «Забронировать стол». Апдейты перемешиваются и разом
+кладутся в update_queue настоящего Application; считаются запросы к БД
+(before_cursor_execute) и вызовы Bot API. Лимиты отправок (TELEGRAM_RATE,
+TELEGRAM_CHAT_RATE) подняты: измеряется входящий поток, а не очередь ответов.
+
+С защитой число запросов к БД и вызовов Bot API не должно расти вместе с
+--flood — кроме answerCallbackQuery: каждое нажатие кнопки, даже отброшенное,
+получает ответ, они считаются отдельно. Обычные пользователи в обоих режимах
+должны закончить регистрацию.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('TELEGRAM_RATE', '100000')
+os.environ.setdefault('TELEGRAM_CHAT_RATE', '100000')
+
+from benchmarks._fakes import setup_env, FakeRequest, message_update, callback_update  # noqa: E402
+
+setup_env('bench_flood.db')
+
+from sqlalchemy import delete, event, insert, select  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import config  # noqa: E402
+import router  # noqa: E402
+import throttle  # noqa: E402
+import user_cache  # noqa: E402
+from database import (SessionLocal, User, PointsTransaction, OutboxMessage, ConversationState,  # noqa: E402
+                      async_engine, init_db)
+from main import build_application  # noqa: E402
+
+FIRST_USER = 1100000
+FIRST_FLOODER = 1200000
+
+
+class Statements:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def reset_db(flooders):
+    init_db()
+    db = SessionLocal()
+    try:
+        ours = User.telegram_id >= FIRST_USER
+        db.execute(delete(PointsTransaction).where(PointsTransaction.user_id.in_(select(User.id).where(ours))))
+        db.execute(delete(OutboxMessage).where(OutboxMessage.chat_id >= FIRST_USER))
+        db.execute(delete(ConversationState))
+        db.execute(delete(User).where(ours))
+        # Половина флудеров уже зарегистрирована
+        db.execute(insert(User), [
+            {'telegram_id': FIRST_FLOODER + i, 'first_name': 'Флудер', 'last_name': str(i),
+             'bonus_balance': 100, 'registration_complete': True}
+            for i in range(0, flooders, 2)
+        ])
+        db.commit()
+    finally:
+        db.close()
+    user_cache.cache = user_cache.UserCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+
+
+def user_flow(bot, telegram_id):
+    return [
+        message_update(bot, telegram_id, '/start'),
+        message_update(bot, telegram_id, 'Имя'),
+        message_update(bot, telegram_id, 'Фамилия'),
+        message_update(bot, telegram_id, f'+7{telegram_id}'),
+        callback_update(bot, telegram_id, 'confirm_registration'),
+        callback_update(bot, telegram_id, router.callback_data(router.BALANCE)),
+    ]
+
+
+def flood(bot, telegram_id, count, rng):
+    if (telegram_id - FIRST_FLOODER) % 2 == 0:
+        buttons = [router.callback_data(code) for code in (router.BALANCE, router.REDEEM, router.BOOKING)]
+        make = [lambda: message_update(bot, telegram_id, '/history')]
+        make += [lambda data=data: callback_update(bot, telegram_id, data) for data in buttons]
+    else:
+        make = [lambda: message_update(bot, telegram_id, '/start'),
+                lambda: message_update(bot, telegram_id, f'спам {rng.randrange(1000)}')]
+    return [rng.choice(make)() for _ in range(count)]
+
+
+def interleave(flows, rng):
+    flows = [list(reversed(flow)) for flow in flows if flow]
+    merged = []
+    while flows:
+        flow = rng.choice(flows)
+        merged.append(flow.pop())
+        if not flow:
+            flows.remove(flow)
+    return merged
+
+
+async def run_once(args, count, protected):
+    reset_db(args.flooders)
+    throttle.throttle = throttle.Throttle(config.THROTTLE_RATE if protected else 0, config.THROTTLE_BURST,
+                                          config.THROTTLE_USERS, config.THROTTLE_DUPLICATE_WINDOW,
+                                          config.THROTTLE_MAX_DELAY)
+    for name in throttle.stats:
+        throttle.stats[name] = 0
+
+    request = FakeRequest()
+    application = build_application(Application.builder().token(config.BOT_TOKEN).request(request))
+    rng = random.Random(args.seed)
+    users = [FIRST_USER + i for i in range(args.users)]
+    flows = [user_flow(application.bot, telegram_id) for telegram_id in users]
+    flows += [flood(application.bot, FIRST_FLOODER + i, count, rng) for i in range(args.flooders)]
+    updates = interleave(flows, rng)
+
+    statements = Statements(async_engine.sync_engine)
+    async with application:
+        await application.start()
+        began = time.perf_counter()
+        for update in updates:
+            await application.update_queue.put(update)
+        await application.update_queue.join()
+        await application.stop()
+        elapsed = time.perf_counter() - began
+    event.remove(async_engine.sync_engine, 'before_cursor_execute', statements._count)
+
+    db = SessionLocal()
+    try:
+        registered = len(db.scalars(select(User.id).where(User.telegram_id.in_(users),
+                                                          User.registration_complete == True)).all())
+    finally:
+        db.close()
+    answers = request.calls.get('answerCallbackQuery', 0)
+    calls = sum(request.calls.values()) - answers
+    mode = 'с защитой ' if protected else 'без защиты'
+    print(f"флуд {count:>5} x {args.flooders}, {mode}: {len(updates):>6} апдейтов за {elapsed:6.2f} с, "
+          f"запросов к БД {statements.count:>6}, вызовов Bot API {calls:>6} и ответов на кнопки {answers:>6}, "
+          f"регистраций {registered}/{args.users}"
+          + (f"; отброшено {throttle.stats['dropped']}, повторов {throttle.stats['duplicates']}, "
+             f"отложено {throttle.stats['deferred']}" if protected else ""))
+    return registered == args.users
+
+
+async def run(args):
+    ok = True
+    for count in args.flood:
+        for protected in (False, True):
+            ok = await run_once(args, count, protected) and ok
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--flooders', type=int, default=20)
+    parser.add_argument('--flood', type=lambda value: [int(count) for count in value.split(',')],
+                        default=[0, 100, 1000])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Нагрузочный прогон: смесь реальных сценариев через настоящий Application.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_load --users 500 --sessions 2000 --api-latency-ms 30 --api-rate 30
+
+Генератор собирает сессии пользователей — /start, регистрация, баланс и история,
+бронирование, списание баллов, действия администратора и рассылка — в заданной
+--mix пропорции. Апдейты разных пользователей перемешиваются (внутри
+пользователя порядок сохраняется, как у Telegram) и кладутся в update_queue
+разом или с частотой --rate апдейтов в секунду.
+
+Bot API подменяется FakeRequest: каждый вызов отвечает через --api-latency-ms,
+а отправки сверх --api-rate сообщений в секунду получают 429, как от Telegram.
+Без DATABASE_URL используется временная SQLite; для Postgres укажите
+DATABASE_URL=postgresql://... на отдельную пустую базу.
+
+Отчет: апдейтов в секунду, задержка апдейта от постановки в очередь до конца
+обработки и p50/p95/p99 по каждому обработчику.
+"""
+import argparse
+import asyncio
+import inspect
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import timedelta
+
+os.environ.setdefault('ADMIN_IDS', '1,2,3')
+os.environ.setdefault('MEMBER_ID_MAX', '1000000')
+
+from benchmarks._fakes import setup_env, FakeRequest, message_update, callback_update  # noqa: E402
+
+setup_env('bench_load.db')
+
+from sqlalchemy import delete, func, select, update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import availability  # noqa: E402
+import config  # noqa: E402
+import ledger  # noqa: E402
+import router  # noqa: E402
+from database import (SessionLocal, User, Booking, RedemptionRequest, PointsTransaction, OutboxMessage,  # noqa: E402
+                      ConversationState, MemberIdCounter, init_db)
+from main import build_application, post_init, post_shutdown  # noqa: E402
+from router import Router  # noqa: E402
+
+FIRST_USER = 900000
+BALANCE = 1000
+DEFAULT_MIX = 'start=25,register=10,balance=20,booking=15,redeem=15,admin=10,broadcast=1'
+
+
+def reset_db(users):
+    init_db()
+    db = SessionLocal()
+    try:
+        ids = select(User.id).where(User.telegram_id >= FIRST_USER)
+        for model in (PointsTransaction, RedemptionRequest, Booking):
+            db.execute(delete(model).where(model.user_id.in_(ids)))
+        db.execute(delete(OutboxMessage).where(OutboxMessage.chat_id >= FIRST_USER))
+        db.execute(delete(ConversationState).where(ConversationState.user_id >= FIRST_USER))
+        db.execute(delete(User).where(User.telegram_id >= FIRST_USER))
+
+        first_member = (db.scalar(select(func.max(User.member_id))) or 0) + 1
+        db.add_all(
+            User(telegram_id=FIRST_USER + i, member_id=first_member + i, first_name=f'Гость{i}',
+                 last_name=f'Фамилия{i}', phone=f'+7900{i:07d}', bonus_balance=BALANCE, registration_complete=True)
+            for i in range(users)
+        )
+        db.flush()
+        db.add_all(
+            PointsTransaction(user_id=user_id, kind=ledger.ADJUSTMENT, amount=BALANCE, balance_after=BALANCE)
+            for user_id in db.scalars(select(User.id).where(User.telegram_id >= FIRST_USER))
+        )
+        db.execute(update(MemberIdCounter).where(MemberIdCounter.id == 1).values(next_id=first_member + users))
+        db.commit()
+    finally:
+        db.close()
+
+
+def parse_mix(spec):
+    weights = {}
+    for item in spec.split(','):
+        name, weight = item.split('=')
+        if name not in SCENARIOS:
+            raise SystemExit(f"неизвестный сценарий {name}; доступны: {', '.join(SCENARIOS)}")
+        weights[name] = float(weight)
+    return weights
+
+
+# Сценарии: список апдейтов одной сессии
+
+def scenario_start(bot, user_id, rng):
+    return [message_update(bot, user_id, '/start')]
+
+
+def scenario_register(bot, user_id, rng):
+    return [
+        message_update(bot, user_id, '/start'),
+        message_update(bot, user_id, f'Имя{user_id}'),
+        message_update(bot, user_id, f'Фамилия{user_id}'),
+        message_update(bot, user_id, f'+7{user_id}'),
+        callback_update(bot, user_id, router.callback_data(router.CONFIRM_REGISTRATION)),
+    ]
+
+
+def scenario_balance(bot, user_id, rng):
+    return [message_update(bot, user_id, '/balance'), message_update(bot, user_id, '/history')]
+
+
+def scenario_booking(bot, user_id, rng):
+    engine = availability.availability
+    day = availability.now().date() + timedelta(days=rng.randint(1, 7))
+    slot = rng.choice(engine.start_times())
+    guests = rng.randint(1, engine.max_guests)
+    return [
+        callback_update(bot, user_id, router.callback_data(router.BOOKING)),
+        message_update(bot, user_id, f'{day:%d.%m.%Y} {slot:%H:%M} {guests}'),
+    ]
+
+
+def scenario_redeem(bot, user_id, rng):
+    return [
+        callback_update(bot, user_id, router.callback_data(router.REDEEM)),
+        message_update(bot, user_id, str(rng.randint(1, 50))),
+    ]
+
+
+def scenario_admin(bot, admin_id, rng):
+    return [
+        message_update(bot, admin_id, '/admin'),
+        callback_update(bot, admin_id, router.callback_data(router.ADMIN_REDEMPTIONS)),
+        message_update(bot, admin_id, f'/find Фамилия{rng.randrange(100)}'),
+    ]
+
+
+def scenario_broadcast(bot, admin_id, rng):
+    return [
+        callback_update(bot, admin_id, router.callback_data(router.BROADCAST)),
+        message_update(bot, admin_id, f'Акция дня #{rng.randrange(1000)}'),
+    ]
+
+
+SCENARIOS = {
+    'start': scenario_start,
+    'register': scenario_register,
+    'balance': scenario_balance,
+    'booking': scenario_booking,
+    'redeem': scenario_redeem,
+    'admin': scenario_admin,
+    'broadcast': scenario_broadcast,
+}
+ADMIN_SCENARIOS = {'admin', 'broadcast'}
+
+
+def generate(bot, args, rng):
+    """Апдейты всех сессий: сессии одного пользователя подряд, пользователи вперемешку."""
+    weights = parse_mix(args.mix)
+    names = rng.choices(list(weights), weights=list(weights.values()), k=args.sessions)
+    flows = {}
+    new_users = 0
+    for name in names:
+        if name in ADMIN_SCENARIOS:
+            user_id = rng.choice(config.ADMIN_IDS)
+        elif name == 'register':
+            user_id = FIRST_USER + args.users + new_users
+            new_users += 1
+        else:
+            user_id = FIRST_USER + rng.randrange(args.users)
+        flows.setdefault(user_id, []).extend(SCENARIOS[name](bot, user_id, rng))
+
+    pending = [list(reversed(flow)) for flow in flows.values()]
+    merged = []
+    while pending:
+        flow = rng.choice(pending)
+        merged.append(flow.pop())
+        if not flow:
+            pending.remove(flow)
+    return merged, Counter(names)
+
+
+def instrument(application, timings):
+    """Оборачивает обработчики, в том числе из таблиц Router: время каждого вызова по имени модуль.функция."""
+
+    def timed(callback):
+        samples = timings.setdefault(f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__name__}", [])
+
+        async def wrapper(update, context):
+            began = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                samples.append(time.perf_counter() - began)
+
+        return wrapper
+
+    routers = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            # metrics.instrument уже обернул обработчики: Router ищем под оберткой
+            owner = getattr(inspect.unwrap(handler.callback), '__self__', None)
+            if isinstance(owner, Router):
+                routers.add(owner)
+            else:
+                handler.callback = timed(handler.callback)
+    for routes in routers:
+        routes.wrap(timed)
+
+
+def percentile(samples, share):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))] if ordered else 0.0
+
+
+async def run(args):
+    request = FakeRequest(args.api_latency_ms / 1000, rate=args.api_rate or None)
+    config.UPDATE_WORKERS = args.workers
+    application = build_application(Application.builder().token(config.BOT_TOKEN).request(request))
+
+    timings = {}
+    instrument(application, timings)
+    errors = Counter()
+
+    async def on_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    application.add_error_handler(on_error)
+
+    # Задержка апдейта целиком: от постановки в очередь до конца process_update
+    queued = {}
+    latencies = []
+    process_update = application.process_update
+
+    async def timed_process_update(update):
+        try:
+            return await process_update(update)
+        finally:
+            began = queued.pop(id(update), None)
+            if began is not None:
+                latencies.append(time.perf_counter() - began)
+
+    application.process_update = timed_process_update
+
+    rng = random.Random(args.seed)
+    updates, sessions = generate(application.bot, args, rng)
+
+    async with application:
+        await post_init(application)
+        await application.start()
+        began = time.perf_counter()
+        for i, item in enumerate(updates):
+            if args.rate:
+                delay = began + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            queued[id(item)] = time.perf_counter()
+            await application.update_queue.put(item)
+        await application.update_queue.join()
+        # join() ждет только разбора очереди: дожидаемся самих обработчиков
+        while queued:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - began
+        await application.stop()
+        await post_shutdown(application)
+
+    return {'updates': len(updates), 'elapsed': elapsed, 'sessions': sessions, 'latencies': latencies,
+            'timings': timings, 'errors': errors, 'throttled': request.throttled, 'calls': request.calls}
+
+
+def report(args, result):
+    ms = 1000
+    sessions = ', '.join(f'{name} {count}' for name, count in result['sessions'].most_common())
+    print(f"сессий {args.sessions} ({sessions}), апдейтов {result['updates']}, воркеров {args.workers}")
+    print(f"обработано за {result['elapsed']:.2f} с: {result['updates'] / result['elapsed']:.0f} апдейтов/с")
+    latencies = result['latencies']
+    print(f"задержка апдейта (очередь + обработка): p50 {percentile(latencies, 0.5) * ms:.1f} ms, "
+          f"p95 {percentile(latencies, 0.95) * ms:.1f} ms, p99 {percentile(latencies, 0.99) * ms:.1f} ms")
+    print()
+    print(f"{'обработчик':<48} {'вызовов':>8} {'p50, ms':>9} {'p95, ms':>9} {'p99, ms':>9}")
+    for name, samples in sorted(result['timings'].items(), key=lambda item: -len(item[1])):
+        if samples:
+            print(f"{name:<48} {len(samples):>8} {percentile(samples, 0.5) * ms:>9.1f} "
+                  f"{percentile(samples, 0.95) * ms:>9.1f} {percentile(samples, 0.99) * ms:>9.1f}")
+    print()
+    errors = ', '.join(f'{name} {count}' for name, count in result['errors'].most_common()) or 'нет'
+    calls = ', '.join(f'{name} {count}' for name, count in Counter(result['calls']).most_common())
+    print(f"вызовы Bot API: {calls}; из них 429: {result['throttled']}")
+    print(f"ошибки обработчиков: {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500, help='зарегистрированных пользователей в базе')
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'веса сценариев, по умолчанию {DEFAULT_MIX}')
+    parser.add_argument('--workers', type=int, default=config.UPDATE_WORKERS)
+    parser.add_argument('--rate', type=float, default=0, help='апдейтов в секунду; 0 — все сразу')
+    parser.add_argument('--api-latency-ms', type=float, default=30)
+    parser.add_argument('--api-rate', type=float, default=30, help='сообщений в секунду до 429; 0 — без лимита')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    reset_db(args.users)
+    result = asyncio.run(run(args))
+    report(args, result)
+    sys.exit(1 if sum(result['errors'].values()) - result['errors'].get('RetryAfter', 0) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Пакетное начисление по файлу чеков: строк в секунду против построчного начисления.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_receipts --members 20000 --rows 50000
+
+Генерирует CSV из --rows чеков (номера участников и телефоны вперемешку,
+часть строк с ошибками), разбирает его receipts.parse_file и проводит
+receipts.apply одной транзакцией. Для сравнения первые --legacy-rows строк
+начисляются как раньше: ledger.post и commit на каждую строку.
+"""
+import argparse
+import asyncio
+import csv
+import os
+import random
+import tempfile
+import time
+
+from benchmarks._fakes import setup_env
+
+setup_env('bench_receipts.db')
+
+from sqlalchemy import delete, insert, select, func  # noqa: E402
+
+import ledger  # noqa: E402
+import receipts  # noqa: E402
+from database import AsyncSessionLocal, SessionLocal, User, PointsTransaction, init_db  # noqa: E402
+
+FIRST_USER = 700000
+
+
+def seed(members):
+    init_db()
+    db = SessionLocal()
+    try:
+        ids = select(User.id).where(User.telegram_id >= FIRST_USER)
+        db.execute(delete(PointsTransaction).where(PointsTransaction.user_id.in_(ids)))
+        db.execute(delete(User).where(User.telegram_id >= FIRST_USER))
+        db.execute(insert(User), [
+            {'telegram_id': FIRST_USER + i, 'member_id': i + 1, 'first_name': 'Bench', 'last_name': str(i),
+             'phone': f'+7900{i:07d}', 'phone_normalized': f'7900{i:07d}', 'bonus_balance': 0,
+             'registration_complete': True}
+            for i in range(members)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def write_csv(path, members, rows, rng):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['Участник', 'Сумма', 'Чек'])
+        for i in range(rows):
+            member = rng.randrange(members)
+            key = str(member + 1) if i % 2 else f'8900{member:07d}'
+            amount = f'{rng.randint(100, 5000)},{rng.randint(0, 99):02d}'
+            if i % 997 == 0:
+                key = str(members + 10 + i)  # неизвестный участник
+            elif i % 991 == 0:
+                amount = 'n/a'
+            writer.writerow([key, amount, f'R{i}'])
+
+
+async def bulk(path):
+    began = time.perf_counter()
+    batch = receipts.parse_file(path, 'receipts.csv')
+    parsed = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        credited = await receipts.apply(db, batch, f'receipts:bench-{time.time_ns()}')
+        await db.commit()
+    done = time.perf_counter()
+    return batch, credited, parsed - began, done - parsed
+
+
+async def legacy(path, members, limit):
+    # Как process_bonus_addition: поиск, начисление и commit на каждую строку
+    batch = receipts.parse_file(path, 'receipts.csv')
+    lines = sorted((lines[0], member_id) for member_id, (_, lines) in batch.by_member_id.items()
+                   if member_id <= members)[:limit]
+    began = time.perf_counter()
+    for _, member_id in lines:
+        async with AsyncSessionLocal() as db:
+            user = await db.scalar(select(User).where(User.member_id == member_id))
+            await ledger.post(db, user.id, ledger.ACCRUAL, 50, reference='admin:bench')
+            await db.commit()
+    return len(lines) / (time.perf_counter() - began)
+
+
+async def check():
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(func.count()).select_from(User)
+            .where(User.telegram_id >= FIRST_USER, User.bonus_balance > 0)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=20000)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--legacy-rows', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    seed(args.members)
+    path = os.path.join(tempfile.gettempdir(), 'bench_receipts.csv')
+    write_csv(path, args.members, args.rows, random.Random(args.seed))
+
+    batch, credited, parse_time, apply_time = asyncio.run(bulk(path))
+    total = parse_time + apply_time
+    print(f"пакетно:    {args.rows / total:9.0f} строк/с (разбор {parse_time:.2f} s, транзакция {apply_time:.2f} s), "
+          f"участников {len(credited)}, ошибок {len(batch.errors)}")
+    rate = asyncio.run(legacy(path, args.members, args.legacy_rows))
+    print(f"построчно:  {rate:9.0f} строк/с")
+    print(f"участников с баллами: {asyncio.run(check())}")
+
+
+if __name__ == '__main__':
+    main()
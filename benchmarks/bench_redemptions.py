@@ -0,0 +1,136 @@
+"""Подтверждение запросов на списание: по одному против пачки, и защита от двойного нажатия.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_redemptions --requests 1000
+
+Создает --requests ожидающих запросов и подтверждает их трижды на свежих данных:
+
+* по одному — как прежний handle_admin_redemption: два чтения, списание и commit на запрос;
+* пачкой — redemptions.decide одной транзакцией;
+* дважды одновременно — две параллельные пачки с одними и теми же запросами
+  (двойное нажатие или два администратора): каждый запрос должен списаться ровно один раз.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks._fakes import setup_env
+
+setup_env('bench_redemptions.db')
+
+from sqlalchemy import delete, func, insert, select  # noqa: E402
+
+import ledger  # noqa: E402
+import redemptions  # noqa: E402
+from database import (AsyncSessionLocal, SessionLocal, User, RedemptionRequest, PointsTransaction,  # noqa: E402
+                      OutboxMessage, init_db)
+
+FIRST_USER = 800000
+BALANCE = 1000
+ADMIN = 1
+
+
+def seed(requests):
+    init_db()
+    db = SessionLocal()
+    try:
+        ids = select(User.id).where(User.telegram_id >= FIRST_USER)
+        db.execute(delete(PointsTransaction).where(PointsTransaction.user_id.in_(ids)))
+        db.execute(delete(RedemptionRequest).where(RedemptionRequest.user_id.in_(ids)))
+        db.execute(delete(OutboxMessage).where(OutboxMessage.chat_id >= FIRST_USER))
+        db.execute(delete(User).where(User.telegram_id >= FIRST_USER))
+        users = requests // 2
+        db.execute(insert(User), [
+            {'telegram_id': FIRST_USER + i, 'member_id': i + 1, 'first_name': 'Bench', 'last_name': str(i),
+             'bonus_balance': BALANCE, 'registration_complete': True}
+            for i in range(users)
+        ])
+        user_ids = db.scalars(select(User.id).where(User.telegram_id >= FIRST_USER).order_by(User.id)).all()
+        db.execute(insert(PointsTransaction), [
+            {'user_id': user_id, 'kind': ledger.ADJUSTMENT, 'amount': BALANCE, 'balance_after': BALANCE}
+            for user_id in user_ids
+        ])
+        # Два запроса на пользователя; у каждого десятого на второй не хватит баллов
+        db.execute(insert(RedemptionRequest), [
+            {'user_id': user_ids[i % users], 'amount': 700 if i % 10 == 0 else 300, 'status': 'pending'}
+            for i in range(requests)
+        ])
+        db.commit()
+        return db.scalars(select(RedemptionRequest.id).where(RedemptionRequest.status == 'pending')
+                          .order_by(RedemptionRequest.id)).all()
+    finally:
+        db.close()
+
+
+async def legacy(request_ids):
+    for request_id in request_ids:
+        async with AsyncSessionLocal() as db:
+            request = await db.get(RedemptionRequest, request_id)
+            user = await db.get(User, request.user_id)
+            try:
+                await ledger.post(db, user.id, ledger.REDEMPTION, -request.amount, reference=f"redemption:{request.id}")
+                request.status = 'approved'
+            except ledger.InsufficientBalance:
+                request.status = 'rejected'
+            await db.commit()
+
+
+async def batch(request_ids):
+    async with AsyncSessionLocal() as db:
+        result = await redemptions.decide(db, request_ids, True, ADMIN)
+        await db.commit()
+    return result
+
+
+async def double(request_ids):
+    return await asyncio.gather(batch(request_ids), batch(request_ids))
+
+
+async def check(request_ids):
+    async with AsyncSessionLocal() as db:
+        entries = dict((await db.execute(
+            select(PointsTransaction.reference, func.count()).where(PointsTransaction.kind == ledger.REDEMPTION)
+            .group_by(PointsTransaction.reference)
+        )).all())
+        negative = await db.scalar(select(func.count()).select_from(User).where(User.bonus_balance < 0))
+        mismatched = (await ledger.reconcile())['mismatched']
+    problems = [f"запрос {request_id} списан {entries[f'redemption:{request_id}']} раз"
+                for request_id in request_ids if entries.get(f'redemption:{request_id}', 0) > 1]
+    if negative:
+        problems.append(f"отрицательный баланс у {negative} пользователей")
+    if mismatched:
+        problems.append(f"расхождений с журналом: {mismatched}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    request_ids = seed(args.requests)
+    began = time.perf_counter()
+    asyncio.run(legacy(request_ids))
+    print(f"по одному: {args.requests / (time.perf_counter() - began):8.0f} запросов/с")
+
+    request_ids = seed(args.requests)
+    began = time.perf_counter()
+    result = asyncio.run(batch(request_ids))
+    print(f"пачкой:    {args.requests / (time.perf_counter() - began):8.0f} запросов/с "
+          f"(подтверждено {len(result['approved'])}, без баллов {len(result['insufficient'])})")
+
+    request_ids = seed(args.requests)
+    first, second = asyncio.run(double(request_ids))
+    problems = asyncio.run(check(request_ids))
+    print(f"две пачки одновременно: подтверждено {len(first['approved'])} + {len(second['approved'])}, "
+          f"пропущено как уже решенные {len(first['skipped'])} + {len(second['skipped'])}")
+    for problem in problems[:20]:
+        print(problem)
+    print(f"нарушений: {len(problems)}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
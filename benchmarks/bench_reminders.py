@@ -0,0 +1,204 @@
+"""Напоминания о бронях: цена прохода при растущей истории броней.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_reminders --history 100000,1000000 --upcoming 2000
+
+В базе --upcoming броней на ближайшие дни (часть из них — в окне
+напоминаний) и прошедшие брони, которых становится по очереди столько,
+сколько указано в --history. Для каждого размера истории:
+
+* закрытие — reminders.close_past: сколько броней стали completed/no_show;
+* напоминания — reminders.send_reminders: отмеченные брони, сообщения в
+  outbox, запросы к БД и время;
+* повторный проход должен не отметить ни одной брони и не добавить сообщений;
+* для сравнения — выборка без окна дат, только по reminded_at IS NULL, как
+  если бы окно не было выбрано по индексу: ее время растет вместе с таблицей.
+
+Перед каждым проходом отметки и статусы предстоящих броней сбрасываются.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks._fakes import setup_env
+
+setup_env('bench_reminders.db')
+
+from sqlalchemy import case, delete, event, func, insert, select, text, tuple_, update  # noqa: E402
+
+import availability  # noqa: E402
+import config  # noqa: E402
+import reminders  # noqa: E402
+from database import (SessionLocal, User, Booking, OutboxMessage, async_engine, engine,  # noqa: E402
+                      init_db)
+
+FIRST_USER = 1300000
+USERS = 1000
+CHUNK = 10000
+
+
+class Statements:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def _slots():
+    return availability.availability.start_times()
+
+
+def seed_users():
+    init_db()
+    db = SessionLocal()
+    try:
+        ids = select(User.id).where(User.telegram_id >= FIRST_USER)
+        db.execute(delete(Booking).where(Booking.user_id.in_(ids)))
+        db.execute(delete(OutboxMessage).where(OutboxMessage.chat_id >= FIRST_USER))
+        db.execute(delete(User).where(User.telegram_id >= FIRST_USER))
+        db.execute(insert(User), [
+            {'telegram_id': FIRST_USER + i, 'first_name': 'Гость', 'last_name': str(i), 'registration_complete': True}
+            for i in range(USERS)
+        ])
+        db.commit()
+        return db.scalars(select(User.id).where(User.telegram_id >= FIRST_USER)).all()
+    finally:
+        db.close()
+
+
+def add_bookings(user_ids, count, first_day, days, statuses, rng):
+    slots = _slots()
+    db = SessionLocal()
+    try:
+        for start in range(0, count, CHUNK):
+            db.execute(insert(Booking), [
+                {'user_id': rng.choice(user_ids), 'booking_date': first_day + timedelta(days=rng.randrange(days)),
+                 'booking_time': rng.choice(slots), 'guests': rng.randint(1, 6), 'table_seats': 4,
+                 'status': rng.choice(statuses)}
+                for _ in range(min(CHUNK, count - start))
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def reset_upcoming(today):
+    db = SessionLocal()
+    try:
+        db.execute(update(Booking).where(Booking.booking_date >= today).values(status=reminders.PENDING,
+                                                                               reminded_at=None))
+        # Вчерашние получили напоминание, подтвердила их половина гостей
+        db.execute(update(Booking).where(Booking.booking_date == today - timedelta(days=1)).values(
+            status=case((Booking.id % 2 == 0, reminders.CONFIRMED), else_=reminders.PENDING),
+            reminded_at=datetime.utcnow()))
+        db.execute(delete(OutboxMessage).where(OutboxMessage.chat_id >= FIRST_USER))
+        db.commit()
+        return db.scalar(select(func.count()).select_from(Booking))
+    finally:
+        db.close()
+
+
+def outbox_count():
+    db = SessionLocal()
+    try:
+        return db.scalar(select(func.count()).select_from(OutboxMessage).where(OutboxMessage.chat_id >= FIRST_USER))
+    finally:
+        db.close()
+
+
+def plan(query):
+    if engine.dialect.name != 'sqlite':
+        return ''
+    compiled = query.compile(engine, compile_kwargs={'literal_binds': True})
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    return '; '.join(row[-1] for row in rows)
+
+
+async def measure(now):
+    statements = Statements(async_engine.sync_engine)
+    began = time.perf_counter()
+    closed = await reminders.close_past(now)
+    closing = time.perf_counter() - began
+    began = time.perf_counter()
+    marked = await reminders.send_reminders(now)
+    sending = time.perf_counter() - began
+    count = statements.count
+    event.remove(async_engine.sync_engine, 'before_cursor_execute', statements._count)
+    return closed, closing, marked, sending, count
+
+
+def naive(now):
+    # Без окна по индексу: все неотмеченные активные брони, окно проверяется в Python
+    end = now + timedelta(minutes=config.REMINDER_BEFORE_MINUTES)
+    query = select(Booking.id, Booking.booking_date, Booking.booking_time).where(
+        Booking.reminded_at.is_(None), Booking.booking_time.isnot(None))
+    began = time.perf_counter()
+    db = SessionLocal()
+    try:
+        due = [row for row in db.execute(query)
+               if now <= datetime.combine(row.booking_date, row.booking_time) < end]
+    finally:
+        db.close()
+    return len(due), time.perf_counter() - began, plan(query)
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    user_ids = seed_users()
+    # «Сейчас» — начало работы заведения: окно напоминаний целиком внутри дня
+    today = availability.now().date()
+    now = datetime.combine(today, _slots()[0])
+    add_bookings(user_ids, args.upcoming, today, 3, [reminders.PENDING], rng)
+    # Незакрытые брони за вчера закроет close_past
+    add_bookings(user_ids, args.upcoming // 10, today - timedelta(days=1), 1, [reminders.PENDING], rng)
+
+    ok = True
+    history = 0
+    for size in args.history:
+        add_bookings(user_ids, size - history, today - timedelta(days=730), 728,
+                     [reminders.COMPLETED, reminders.NO_SHOW, reminders.CANCELLED], rng)
+        history = size
+        total = reset_upcoming(today)
+
+        due, naive_elapsed, naive_plan = naive(now)
+        closed, closing, marked, sending, statements = await measure(now)
+        messages = outbox_count()
+        _, _, again, _, _ = await measure(now)
+
+        print(f"броней в таблице {total}:")
+        print(f"  закрытие: завершено {closed['completed']}, неявок {closed['no_show']} за {closing * 1000:.1f} ms")
+        print(f"  напоминания: отмечено {marked}, сообщений в outbox {messages}, запросов к БД {statements}, "
+              f"{sending * 1000:.1f} ms")
+        print(f"  повторный проход: отмечено {again}, сообщений в outbox {outbox_count()}")
+        print(f"  без окна по индексу: найдено {due} за {naive_elapsed * 1000:.1f} ms")
+        if naive_plan:
+            window = reminders._starting_between(now, now + timedelta(minutes=config.REMINDER_BEFORE_MINUTES))
+            ended = tuple_(Booking.booking_date, Booking.booking_time) <= tuple_(today, now.time())
+            print(f"  план окна: {plan(select(Booking.id).where(window, Booking.reminded_at.is_(None)))}")
+            print(f"  план без окна: {naive_plan}")
+            print(f"  план закрытия: {plan(select(Booking.id).where(Booking.status == reminders.PENDING, ended))}")
+        ok = ok and again == 0 and outbox_count() == messages == marked == due
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--history', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[100000, 1000000])
+    parser.add_argument('--upcoming', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
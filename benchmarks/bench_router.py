@@ -0,0 +1,209 @@
+"""Стоимость диспетчеризации: цепочка обработчиков с регулярными выражениями против Router.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_router --iterations 20000 --extra-routes 0 50
+
+Для каждого маршрута — кнопки и ввода в каждом состоянии диалога — замеряется
+только выбор обработчика, без самих обработчиков:
+
+* старая цепочка — обработчики в порядке прежнего main.py, как их обходит
+  Application.process_update (check_update каждого, пока один не подойдет),
+  плюс второй разбор внутри handle_admin_action и каскад флагов handle_all_messages;
+* Router — CommandHandler'ы, один CallbackQueryHandler и один MessageHandler,
+  дальше поиск в таблицах.
+
+--extra-routes добавляет в обе схемы столько же новых кнопок: цепочка растет
+линейно, таблица — нет.
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('ADMIN_IDS', '1')
+
+from benchmarks._fakes import setup_env, FakeBot, message_update, callback_update  # noqa: E402
+
+setup_env('bench_router.db')
+
+from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler, filters  # noqa: E402
+
+import config  # noqa: E402
+import router  # noqa: E402
+from main import build_router  # noqa: E402
+
+ADMIN = config.ADMIN_IDS[0]
+USER = 500001
+
+
+async def noop(update, context):
+    pass
+
+
+def legacy_chain(extra):
+    """Группы обработчиков прежнего main.py (без отслеживания доступности — оно не изменилось)."""
+    admins = filters.User(user_id=config.ADMIN_IDS)
+    group0 = [
+        CommandHandler("start", noop),
+        CommandHandler("balance", noop),
+        CommandHandler("history", noop),
+        CallbackQueryHandler(noop, pattern="^confirm_registration$"),
+        CallbackQueryHandler(noop, pattern="^edit_registration$"),
+        CallbackQueryHandler(noop, pattern="^booking$"),
+        CallbackQueryHandler(noop, pattern="^book:"),
+        CallbackQueryHandler(noop, pattern="^redeem_bonus$"),
+        CallbackQueryHandler(noop, pattern="^admin_redeem_"),
+        CommandHandler("admin", noop),
+        CommandHandler("find", noop),
+        MessageHandler(admins & filters.Document.ALL, noop),
+        CallbackQueryHandler(legacy_admin_action, pattern="^admin_"),
+        CallbackQueryHandler(noop, pattern="^broadcast$"),
+    ]
+    group0 += [CallbackQueryHandler(noop, pattern=f"^extra_{i}$") for i in range(extra)]
+    group0.append(MessageHandler(filters.TEXT & ~filters.COMMAND, legacy_text))
+    broadcast = MessageHandler(admins & (filters.TEXT | filters.PHOTO | filters.VIDEO) & ~filters.COMMAND, noop)
+    return [[broadcast], group0]
+
+
+def legacy_admin_action(data):
+    # Второй разбор в handle_admin_action
+    if data == "admin_users" or data.startswith("admin_users:"):
+        return 'users'
+    elif data == "admin_add_bonus":
+        return 'add_bonus'
+    elif data.startswith("admin_bonus:"):
+        return 'bonus'
+    elif data == "admin_receipts":
+        return 'receipts'
+    elif data == "admin_redemption_requests" or data.startswith("admin_rq:"):
+        return 'queue'
+
+
+def legacy_text(user_data):
+    # Каскад handle_all_messages
+    if user_data.get('registration_step') is not None:
+        return 'registration'
+    elif user_data.get('awaiting_redemption_amount'):
+        return 'redeem'
+    elif user_data.get('awaiting_booking_data'):
+        return 'booking'
+    elif user_data.get('admin_action'):
+        return 'admin'
+
+
+def legacy_dispatch(groups, update, user_data):
+    for handlers in groups:
+        for handler in handlers:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                if handler.callback is legacy_admin_action:
+                    legacy_admin_action(update.callback_query.data)
+                elif handler.callback is legacy_text:
+                    legacy_text(user_data)
+                break
+
+
+def router_chain(extra):
+    routes = build_router()
+    for i in range(extra):
+        routes.callback(f'x{i}', noop)
+    group0 = [
+        CommandHandler("start", noop),
+        CommandHandler("balance", noop),
+        CommandHandler("history", noop),
+        CommandHandler("admin", noop),
+        CommandHandler("find", noop),
+        CallbackQueryHandler(noop),
+        MessageHandler(
+            filters.UpdateType.MESSAGE & ~filters.COMMAND
+            & (filters.TEXT | filters.PHOTO | filters.VIDEO | filters.Document.ALL),
+            noop
+        ),
+    ]
+    return routes, group0
+
+
+def router_dispatch(routes, handlers, update, user_data):
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            if update.callback_query:
+                routes.resolve_callback(update.callback_query.data, update.callback_query.from_user.id)
+            else:
+                routes.resolve_message(update.message, user_data, update.effective_user.id)
+            break
+
+
+def cases(bot):
+    """(маршрут, апдейт и user_data для старой схемы, то же для Router)."""
+    buttons = [
+        ('кнопка: подтвердить регистрацию', USER, 'confirm_registration', router.CONFIRM_REGISTRATION, ()),
+        ('кнопка: исправить регистрацию', USER, 'edit_registration', router.EDIT_REGISTRATION, ()),
+        ('кнопка: баланс', USER, 'balance', router.BALANCE, ()),
+        ('кнопка: бронирование', USER, 'booking', router.BOOKING, ()),
+        ('кнопка: слот', USER, 'book:20261020:1930:4', router.BOOK_SLOT, ('20261020', '1930', 4)),
+        ('кнопка: списать баллы', USER, 'redeem_bonus', router.REDEEM, ()),
+        ('кнопка: решение по списанию', ADMIN, 'admin_redeem_confirm_42', router.REDEMPTION_DECISION, ('ok', 42)),
+        ('кнопка: очередь списаний', ADMIN, 'admin_rq:t:0:42', router.ADMIN_REDEMPTIONS, ('t', 0, 42)),
+        ('кнопка: участники', ADMIN, 'admin_users:bal:n:500:17', router.ADMIN_USERS, ('bal', 'n', 500, 17)),
+        ('кнопка: начислить баллы', ADMIN, 'admin_add_bonus', router.ADMIN_ADD_BONUS, ()),
+        ('кнопка: выбор получателя', ADMIN, 'admin_bonus:17:1000', router.ADMIN_BONUS_RECIPIENT, (17, 1000)),
+        ('кнопка: чеки из файла', ADMIN, 'admin_receipts', router.ADMIN_RECEIPTS, ()),
+        ('кнопка: рассылка', ADMIN, 'broadcast', router.BROADCAST, ()),
+    ]
+    for name, user_id, old, code, args in buttons:
+        yield (name, (callback_update(bot, user_id, old), {}),
+               (callback_update(bot, user_id, router.callback_data(code, *args)), {}))
+
+    flows = [
+        ('ввод: регистрация', USER, {'registration_step': 1}, router.FLOW_REGISTRATION),
+        ('ввод: сумма списания', USER, {'awaiting_redemption_amount': True}, router.FLOW_REDEEM_AMOUNT),
+        ('ввод: бронирование', USER, {'awaiting_booking_data': True}, router.FLOW_BOOKING),
+        ('ввод: начисление по чеку', ADMIN, {'admin_action': 'add_bonus'}, router.FLOW_ADD_BONUS),
+        ('ввод: рассылка', ADMIN, {'awaiting_broadcast': True}, router.FLOW_BROADCAST),
+        ('ввод вне диалога', USER, {}, None),
+    ]
+    for name, user_id, old_data, flow in flows:
+        update = message_update(bot, user_id, 'Текст')
+        yield name, (update, old_data), (update, {router.FLOW_KEY: flow})
+
+
+def measure(function, iterations):
+    began = time.perf_counter_ns()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter_ns() - began) / iterations / 1000
+
+
+def run(args, extra):
+    bot = FakeBot()
+    groups = legacy_chain(extra)
+    routes, handlers = router_chain(extra)
+    rows = []
+    for name, (old_update, old_data), (new_update, new_data) in cases(bot):
+        old = measure(lambda: legacy_dispatch(groups, old_update, old_data), args.iterations)
+        new = measure(lambda: router_dispatch(routes, handlers, new_update, new_data), args.iterations)
+        rows.append((name, old, new))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--extra-routes', type=int, nargs='+', default=[0, 50])
+    args = parser.parse_args()
+
+    for extra in args.extra_routes:
+        rows = run(args, extra)
+        print(f"дополнительных кнопок: {extra}")
+        print(f"{'маршрут':<36} {'цепочка, мкс':>13} {'Router, мкс':>12}")
+        for name, old, new in rows:
+            print(f"{name:<36} {old:>13.2f} {new:>12.2f}")
+        old_mean = sum(row[1] for row in rows) / len(rows)
+        new_mean = sum(row[2] for row in rows) / len(rows)
+        print(f"{'в среднем':<36} {old_mean:>13.2f} {new_mean:>12.2f}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
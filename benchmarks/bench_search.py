@@ -0,0 +1,125 @@
+"""Поиск участника кассиром: задержка search.find_users на большой таблице.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_search --members 100000 --queries 500
+
+Генерирует --members зарегистрированных участников со случайными фамилиями,
+именами и телефонами в разных форматах и измеряет p50/p99 для запросов по номеру,
+полному телефону, началу телефона, фамилии, фамилии с именем и фамилии с опечаткой.
+Для сравнения приводится прежний способ — перебор всех строк без индексов.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks._fakes import setup_env
+
+setup_env('bench_search.db')
+
+from sqlalchemy import delete, func, insert, or_, select  # noqa: E402
+
+import search  # noqa: E402
+from database import AsyncSessionLocal, SessionLocal, User, init_db, normalize_name, normalize_phone  # noqa: E402
+
+SURNAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+            'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов', 'Егоров']
+FIRST_NAMES = ['Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Анна', 'Мария', 'Елена', 'Ольга']
+PHONE_FORMATS = ['+7{}', '8{}', '+7 ({}) {}-{}-{}', '7{}']
+FIRST_USER = 600000
+
+
+def make_phone(rng):
+    digits = '9' + ''.join(rng.choice('0123456789') for _ in range(9))
+    fmt = rng.choice(PHONE_FORMATS)
+    if '(' in fmt:
+        return fmt.format(digits[:3], digits[3:6], digits[6:8], digits[8:])
+    return fmt.format(digits)
+
+
+def seed(members, rng):
+    init_db()
+    db = SessionLocal()
+    try:
+        db.execute(delete(User).where(User.telegram_id >= FIRST_USER))
+        rows = []
+        for i in range(members):
+            # Уникальная фамилия на каждого участника: общий корень + суффикс
+            last_name = rng.choice(SURNAMES) + ('' if i % 50 == 0 else str(i))
+            first_name = rng.choice(FIRST_NAMES)
+            phone = make_phone(rng)
+            rows.append({
+                'telegram_id': FIRST_USER + i, 'member_id': i + 1, 'first_name': first_name,
+                'last_name': last_name, 'phone': phone, 'bonus_balance': 0, 'registration_complete': True,
+                'phone_normalized': normalize_phone(phone), 'first_name_lower': normalize_name(first_name),
+                'last_name_lower': normalize_name(last_name),
+            })
+            if len(rows) == 5000:
+                db.execute(insert(User), rows)
+                rows = []
+        if rows:
+            db.execute(insert(User), rows)
+        db.commit()
+        return list(db.execute(select(User.member_id, User.phone, User.first_name, User.last_name)
+                               .where(User.telegram_id >= FIRST_USER)))
+    finally:
+        db.close()
+
+
+def make_queries(members, count, rng):
+    kinds = {
+        'номер': lambda m: str(m.member_id),
+        'телефон': lambda m: m.phone,
+        'начало телефона': lambda m: normalize_phone(m.phone)[1:7],
+        'фамилия': lambda m: m.last_name,
+        'фамилия + имя': lambda m: f"{m.last_name} {m.first_name[:2]}",
+        'опечатка': lambda m: m.last_name[:3] + m.last_name[4:],
+    }
+    return {kind: [make(rng.choice(members)) for _ in range(count)] for kind, make in kinds.items()}
+
+
+async def legacy_find(db, query):
+    # Без нормализованных колонок и индексов: сравнение по сырым полям всей таблицы
+    pattern = f"%{query.lower()}%"
+    return (await db.scalars(
+        select(User).where(User.registration_complete == True, or_(
+            func.lower(User.last_name).like(pattern), User.phone.like(pattern), User.member_id == -1,
+        )).limit(search.SEARCH_LIMIT)
+    )).all()
+
+
+async def measure(find, queries):
+    latencies, empty = [], 0
+    async with AsyncSessionLocal() as db:
+        for query in queries:
+            began = time.perf_counter()
+            if not await find(db, query):
+                empty += 1
+            latencies.append(time.perf_counter() - began)
+    latencies.sort()
+    return (latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000, empty)
+
+
+async def run(queries):
+    for kind, items in queries.items():
+        p50, p99, empty = await measure(search.find_users, items)
+        print(f"{kind:16} p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  без результата: {empty}")
+    p50, p99, _ = await measure(legacy_find, queries['фамилия'])
+    print(f"{'перебор (было)':16} p50 {p50:7.2f} ms  p99 {p99:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    members = seed(args.members, rng)
+    asyncio.run(run(make_queries(members, args.queries, rng)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Экран статистики: полные агрегаты против счетчиков stats, и цена счетчиков на записи.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_stats --members 200000 --accruals 500
+
+Заполняет базу --members участниками (с записью журнала у каждого), бронями
+и запросами на списание, после чего:
+
+* сверка — stats.verify на пустых счетчиках заполняет их по агрегатам;
+* экран — те же числа полными агрегатами по таблицам и суммами счетчиков;
+* запись — --accruals начислений по одному (транзакция на каждое) без
+  счетчиков и со счетчиками;
+* параллельно — столько же начислений одновременно, затем повторная сверка:
+  поправок быть не должно.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks._fakes import setup_env
+
+setup_env('bench_stats.db')
+
+from sqlalchemy import delete, event, insert, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import ledger  # noqa: E402
+import stats  # noqa: E402
+from database import (AsyncSessionLocal, SessionLocal, User, Booking, RedemptionRequest,  # noqa: E402
+                      PointsTransaction, StatsTotal, StatsDaily, init_db)
+
+FIRST_USER = 600000
+BALANCE = 500
+CHUNK = 10000
+
+
+def seed(members):
+    init_db()
+    db = SessionLocal()
+    try:
+        ids = select(User.id).where(User.telegram_id >= FIRST_USER)
+        for model in (PointsTransaction, RedemptionRequest, Booking):
+            db.execute(delete(model).where(model.user_id.in_(ids)))
+        db.execute(delete(User).where(User.telegram_id >= FIRST_USER))
+        db.execute(delete(StatsTotal))
+        db.execute(delete(StatsDaily))
+        for start in range(0, members, CHUNK):
+            db.execute(insert(User), [
+                {'telegram_id': FIRST_USER + i, 'first_name': 'Bench', 'last_name': str(i),
+                 'bonus_balance': BALANCE, 'registration_complete': True}
+                for i in range(start, min(start + CHUNK, members))
+            ])
+        user_ids = db.scalars(select(User.id).where(User.telegram_id >= FIRST_USER).order_by(User.id)).all()
+        now = datetime.utcnow()
+        today = stats.today()
+        rng = random.Random(1)
+        for start in range(0, len(user_ids), CHUNK):
+            chunk = user_ids[start:start + CHUNK]
+            db.execute(insert(PointsTransaction), [
+                {'user_id': user_id, 'kind': ledger.WELCOME, 'amount': BALANCE, 'balance_after': BALANCE,
+                 'created_at': now - timedelta(days=rng.randrange(365))}
+                for user_id in chunk
+            ])
+            db.execute(insert(Booking), [
+                {'user_id': user_id, 'booking_date': today + timedelta(days=rng.randrange(-300, 30)),
+                 'guests': rng.randint(1, 6), 'status': 'pending'}
+                for user_id in chunk[::4]
+            ])
+            db.execute(insert(RedemptionRequest), [
+                {'user_id': user_id, 'amount': 10, 'status': rng.choice(('pending', 'approved', 'rejected'))}
+                for user_id in chunk[::10]
+            ])
+        db.commit()
+        return user_ids
+    finally:
+        db.close()
+
+
+async def aggregates():
+    async with AsyncSessionLocal() as db:
+        return await stats._actual(db, [stats.today()])
+
+
+async def counters():
+    async with AsyncSessionLocal() as db:
+        return await stats.snapshot(db)
+
+
+async def timed(function, runs):
+    samples = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        await function()
+        samples.append(time.perf_counter() - began)
+    return statistics.median(samples) * 1000
+
+
+async def accrue(user_id):
+    async with AsyncSessionLocal() as db:
+        await ledger.post(db, user_id, ledger.ACCRUAL, 5, reference='bench')
+        await db.commit()
+
+
+async def sequential(user_ids):
+    began = time.perf_counter()
+    for user_id in user_ids:
+        await accrue(user_id)
+    return (time.perf_counter() - began) / len(user_ids) * 1000
+
+
+async def run(args, user_ids):
+    began = time.perf_counter()
+    result = await stats.verify()
+    print(f"сверка на пустых счетчиках: {time.perf_counter() - began:.2f} с, поправок {result['corrected']}")
+
+    print(f"экран полными агрегатами: {await timed(aggregates, args.runs):8.2f} ms (медиана)")
+    print(f"экран по счетчикам:       {await timed(counters, args.runs):8.2f} ms (медиана)")
+
+    rng = random.Random(2)
+    sample = rng.sample(user_ids, args.accruals)
+    event.remove(Session, 'before_commit', stats._before_commit)
+    try:
+        without = await sequential(sample)
+    finally:
+        event.listen(Session, 'before_commit', stats._before_commit)
+    with_stats = await sequential(sample)
+    print(f"начисление: {without:.2f} ms без счетчиков, {with_stats:.2f} ms со счетчиками")
+
+    await stats.verify()  # начисления без счетчиков выше
+    began = time.perf_counter()
+    await asyncio.gather(*(accrue(user_id) for user_id in sample))
+    print(f"{args.accruals} начислений одновременно: {time.perf_counter() - began:.2f} с")
+    began = time.perf_counter()
+    result = await stats.verify()
+    print(f"повторная сверка: {time.perf_counter() - began:.2f} с, поправок {result['corrected']}")
+    return result['corrected']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=200000)
+    parser.add_argument('--accruals', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    user_ids = seed(args.members)
+    corrected = asyncio.run(run(args, user_ids))
+    sys.exit(1 if corrected else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Выгрузка в CSV и массовая загрузка участников на миллионе строк.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_transfer --members 1000000 --import-rows 1000000
+
+Заполняет базу --members участниками, бронями (каждый 4-й) и запросами на
+списание (каждый 10-й), после чего:
+
+* выгрузка — exports.write_csv для участников, броней и списаний: строк в
+  секунду, размер файла и пик памяти Python (tracemalloc); для сравнения
+  участники выгружаются и через .all() со сборкой CSV в памяти;
+* загрузка — файл из --import-rows участников (с повторами, уже известными
+  телефонами и ошибками) загружается member_import.load; для сравнения
+  --legacy-rows участников регистрируются как раньше — по строке с номером,
+  журналом и commit на каждого;
+* повторная загрузка того же файла не должна создать никого, а stats.verify —
+  найти расхождений в счетчиках.
+
+Время замеряется вместе с tracemalloc; --no-trace убирает его накладные расходы.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('MEMBER_ID_MAX', '100000000')
+
+from benchmarks._fakes import setup_env  # noqa: E402
+
+setup_env('bench_transfer.db')
+
+from sqlalchemy import delete, func, insert, or_, select, update  # noqa: E402
+
+import exports  # noqa: E402
+import ledger  # noqa: E402
+import member_ids  # noqa: E402
+import member_import  # noqa: E402
+import stats  # noqa: E402
+from database import (AsyncSessionLocal, SessionLocal, User, Booking, RedemptionRequest,  # noqa: E402
+                      PointsTransaction, MemberIdCounter, init_db)
+
+FIRST_USER = 1000000000
+SEED_PREFIX = '7800'
+IMPORT_PREFIX = '7811'
+LEGACY_PREFIX = '7822'
+BALANCE = 300
+CHUNK = 10000
+
+
+def _ours():
+    prefixes = (SEED_PREFIX, IMPORT_PREFIX, LEGACY_PREFIX)
+    return or_(User.telegram_id >= FIRST_USER, *(User.phone_normalized.like(prefix + '%') for prefix in prefixes))
+
+
+def seed(members):
+    init_db()
+    db = SessionLocal()
+    try:
+        ids = select(User.id).where(_ours())
+        for model in (PointsTransaction, RedemptionRequest, Booking):
+            db.execute(delete(model).where(model.user_id.in_(ids)))
+        db.execute(delete(User).where(_ours()))
+
+        first_member = (db.scalar(select(func.max(User.member_id))) or 0) + 1
+        for start in range(0, members, CHUNK):
+            db.execute(insert(User), [
+                {'telegram_id': FIRST_USER + i, 'member_id': first_member + i, 'first_name': 'Гость',
+                 'last_name': f'Фамилия{i}', 'phone': f'+{SEED_PREFIX}{i:07d}',
+                 'phone_normalized': f'{SEED_PREFIX}{i:07d}', 'bonus_balance': BALANCE,
+                 'registration_complete': True}
+                for i in range(start, min(start + CHUNK, members))
+            ])
+        db.execute(update(MemberIdCounter).where(MemberIdCounter.id == 1).values(next_id=first_member + members))
+
+        user_ids = db.scalars(select(User.id).where(User.telegram_id >= FIRST_USER).order_by(User.id)).all()
+        today = stats.today()
+        rng = random.Random(1)
+        for start in range(0, len(user_ids), CHUNK):
+            chunk = user_ids[start:start + CHUNK]
+            db.execute(insert(Booking), [
+                {'user_id': user_id, 'booking_date': today, 'guests': rng.randint(1, 6), 'status': 'pending'}
+                for user_id in chunk[::4]
+            ])
+            db.execute(insert(RedemptionRequest), [
+                {'user_id': user_id, 'amount': 10, 'status': 'approved'} for user_id in chunk[::10]
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def write_import_file(path, rows, members):
+    """Новые участники плюс повторы в файле, уже известные телефоны и ошибочные строки."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['Телефон', 'Имя', 'Фамилия', 'Баллы'])
+        for i in range(rows):
+            phone = f'8{IMPORT_PREFIX[1:]}{i:07d}'
+            if i % 1000 == 1:
+                phone = f'8{IMPORT_PREFIX[1:]}{i - 1:07d}'  # повтор предыдущей строки
+            elif i % 1000 == 2 and members:
+                phone = f'+{SEED_PREFIX}{i % members:07d}'  # уже в базе
+            elif i % 1000 == 3:
+                phone = 'нет'
+            writer.writerow([phone, 'Гость', f'Загруженный{i}', (i * 7) % 1000])
+
+
+class Phase:
+    """Время и пик памяти Python участка кода."""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        if self.trace:
+            tracemalloc.start()
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.began
+        self.peak = tracemalloc.get_traced_memory()[1] / 2 ** 20 if self.trace else 0.0
+        if self.trace:
+            tracemalloc.stop()
+
+    def describe(self, rows):
+        memory = f", пик памяти {self.peak:.1f} МБ" if self.trace else ""
+        speed = f"{rows / self.elapsed:,.0f}".replace(',', ' ')
+        return f"{self.elapsed:.2f} с, {speed} строк/с{memory}"
+
+
+async def export_all(args, directory):
+    for kind in exports.EXPORTS:
+        with Phase(args.trace) as phase:
+            path, rows = await exports.write_csv(kind, directory)
+        size = os.path.getsize(path) / 2 ** 20
+        print(f"выгрузка {kind:<12} {rows:>9} строк, {size:6.1f} МБ {os.path.basename(path)}: "
+              f"{phase.describe(rows)}")
+
+    # Как выгрузили бы без потока: все строки в память, CSV в StringIO
+    query = exports.EXPORTS['users'][1]
+    with Phase(args.trace) as phase:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(query)).all()
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter=exports.DELIMITER).writerows(rows)
+    print(f"для сравнения users через .all() {len(rows):>9} строк: {phase.describe(len(rows))}")
+
+
+async def legacy(rows):
+    # Как регистрация: номер, строка пользователя, приветственная запись журнала, commit
+    for i in range(rows):
+        async with AsyncSessionLocal() as db:
+            user = User(first_name='Гость', last_name=f'Построчный{i}', phone=f'+{LEGACY_PREFIX}{i:07d}',
+                        registration_complete=True, is_reachable=False)
+            user.member_id = await member_ids.allocate(db)
+            db.add(user)
+            await db.flush()
+            await ledger.post(db, user.id, ledger.ADJUSTMENT, BALANCE, reference='bench')
+            stats.add(db, stats.MEMBERS)
+            await db.commit()
+
+
+async def run(args):
+    await stats.verify()  # счетчики для участников, вставленных в обход stats
+    with tempfile.TemporaryDirectory() as directory:
+        await export_all(args, directory)
+        print()
+
+        path = os.path.join(directory, 'members.csv')
+        write_import_file(path, args.import_rows, args.members)
+        with Phase(args.trace) as phase:
+            result = await member_import.load(path, 'members.csv', 'import:bench')
+        print(f"загрузка {args.import_rows} строк: {phase.describe(args.import_rows)}")
+        print(f"  создано {result.created}, уже в базе {result.existing}, повторов {result.duplicates}, "
+              f"ошибок {result.error_count}, баллов {result.points}")
+
+        began = time.perf_counter()
+        await legacy(args.legacy_rows)
+        elapsed = time.perf_counter() - began
+        print(f"построчно {args.legacy_rows} участников: {elapsed:.2f} с, {args.legacy_rows / elapsed:.0f} строк/с "
+              f"(на {args.import_rows} строк ушло бы ~{args.import_rows / args.legacy_rows * elapsed / 60:.0f} мин)")
+
+        again = await member_import.load(path, 'members.csv', 'import:bench')
+    print(f"повторная загрузка: создано {again.created}, уже в базе {again.existing}")
+
+    verified = await stats.verify()
+    print(f"сверка счетчиков: поправок {verified['corrected']}")
+    return again.created == 0 and verified['corrected'] == 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=1000000)
+    parser.add_argument('--import-rows', type=int, default=1000000)
+    parser.add_argument('--legacy-rows', type=int, default=2000)
+    parser.add_argument('--no-trace', dest='trace', action='store_false', help='без замера памяти')
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    seed(args.members)
+    print(f"база заполнена за {time.perf_counter() - began:.0f} с")
+    ok = asyncio.run(run(args))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Нагрузочный тест вебхука: запросы в секунду и p99 задержки ответа Telegram.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_webhook --requests 2000 --concurrency 100 --api-latency-ms 50
+
+Сравниваются два маршрута поверх одного и того же Application с настоящими
+обработчиками (вызовы Bot API отвечают локально с задержкой --api-latency-ms):
+
+* legacy — как прежний Flask-маршрут: апдейт целиком обрабатывается до ответа 200;
+* asgi — bot.create_app: апдейт кладется в update_queue, ответ 200 сразу.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks._fakes import setup_env, FakeRequest, message_update
+
+setup_env('bench_webhook.db')
+
+import httpx  # noqa: E402
+from sqlalchemy import delete  # noqa: E402
+from starlette.applications import Starlette  # noqa: E402
+from starlette.responses import Response  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import config  # noqa: E402
+from bot import create_app  # noqa: E402
+from database import SessionLocal, User, init_db  # noqa: E402
+from main import build_application  # noqa: E402
+
+FIRST_USER = 200000
+
+
+def seed(users):
+    init_db()
+    db = SessionLocal()
+    try:
+        db.execute(delete(User).where(User.telegram_id >= FIRST_USER))
+        db.add_all(
+            User(telegram_id=FIRST_USER + i, first_name='Bench', bonus_balance=100, registration_complete=True)
+            for i in range(users)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def make_application(api_latency):
+    builder = Application.builder().token(config.BOT_TOKEN).request(FakeRequest(api_latency))
+    return build_application(builder)
+
+
+def legacy_app(bot_application):
+    async def webhook(request):
+        update = Update.de_json(await request.json(), bot_application.bot)
+        await bot_application.process_update(update)
+        return Response()
+
+    return Starlette(routes=[Route('/webhook', webhook, methods=['POST'])])
+
+
+async def hammer(app, payloads, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def one(payload):
+            async with semaphore:
+                began = time.perf_counter()
+                response = await client.post('/webhook', json=payload)
+                latencies.append(time.perf_counter() - began)
+                assert response.status_code == 200, response.status_code
+
+        began = time.perf_counter()
+        await asyncio.gather(*(one(payload) for payload in payloads))
+        elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    return len(payloads) / elapsed, latencies[int(len(latencies) * 0.99) - 1] * 1000
+
+
+async def run_legacy(args, payloads):
+    bot_application = make_application(args.api_latency_ms / 1000)
+    await bot_application.initialize()
+    try:
+        return await hammer(legacy_app(bot_application), payloads, args.concurrency)
+    finally:
+        await bot_application.shutdown()
+
+
+async def run_asgi(args, payloads):
+    bot_application = make_application(args.api_latency_ms / 1000)
+    app = create_app(bot_application)
+    async with app.router.lifespan_context(app):
+        result = await hammer(app, payloads, args.concurrency)
+        drain_began = time.perf_counter()
+        # stop() не ждет апдейты, уже разобранные в параллельные задачи
+        await bot_application.update_queue.join()
+        drained = time.perf_counter() - drain_began
+    return result + (drained,)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--api-latency-ms', type=float, default=50.0)
+    args = parser.parse_args()
+
+    seed(args.users)
+    payloads = [
+        message_update(None, FIRST_USER + i % args.users, '/balance').to_dict()
+        for i in range(args.requests)
+    ]
+
+    rps, p99 = asyncio.run(run_legacy(args, payloads))
+    print(f"legacy (обработка до ответа): {rps:8.1f} req/s, p99 ack {p99:8.1f} ms")
+    rps, p99, drain = asyncio.run(run_asgi(args, payloads))
+    print(f"asgi   (update_queue):        {rps:8.1f} req/s, p99 ack {p99:8.1f} ms, "
+          f"очередь разобрана за {drain:.1f} s при UPDATE_WORKERS={config.UPDATE_WORKERS}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Параллельные регистрации: каждый участник получает уникальный короткий номер.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.stress_member_ids --users 500 --concurrency 50
+
+Сценарий: --users пользователей одновременно нажимают «Подтвердить» (обработчик
+вызывается напрямую, в обход порядка PerUserUpdateProcessor), затем часть номеров
+попадает в free-list — как пропуски, которые оставляет перенос старых users.id, —
+и регистрируется еще столько же пользователей: они должны получить ровно эти номера.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks._fakes import setup_env, FakeBot, callback_update, fake_context
+
+setup_env('stress_member_ids.db')
+
+from sqlalchemy import select, delete, insert  # noqa: E402
+
+from database import AsyncSessionLocal, SessionLocal, Base, User, FreeMemberId, engine, init_db  # noqa: E402
+from handlers import user_handlers  # noqa: E402
+
+FIRST_USER = 400000
+
+
+def reset_db(users):
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    db = SessionLocal()
+    try:
+        db.add_all(User(telegram_id=FIRST_USER + i) for i in range(users * 2))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def register(telegram_ids, concurrency):
+    bot = FakeBot()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(telegram_id):
+        user_data = {'first_name': 'Имя', 'last_name': str(telegram_id), 'phone': '+7', 'registration_step': 3}
+        async with semaphore:
+            await user_handlers.handle_registration(
+                callback_update(bot, telegram_id, 'confirm_registration'), fake_context(bot, user_data)
+            )
+
+    began = time.perf_counter()
+    await asyncio.gather(*(one(t) for t in telegram_ids))
+    return time.perf_counter() - began
+
+
+async def assigned(telegram_ids):
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(select(User.telegram_id, User.member_id).where(User.telegram_id.in_(telegram_ids)))
+        return dict(rows.all())
+
+
+async def run(args):
+    first = [FIRST_USER + i for i in range(args.users)]
+    elapsed = await register(first, args.concurrency)
+    numbers = await assigned(first)
+    problems = []
+    if sorted(numbers.values()) != list(range(1, args.users + 1)):
+        problems.append(f"первая волна: номера не 1..{args.users} без повторов")
+
+    released = sorted(numbers.values())[::3]
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(User).where(User.member_id.in_(released)))
+        await db.execute(insert(FreeMemberId), [{'member_id': member_id} for member_id in released])
+        await db.commit()
+
+    second = [FIRST_USER + args.users + i for i in range(len(released))]
+    elapsed += await register(second, args.concurrency)
+    reused = sorted((await assigned(second)).values())
+    if reused != released:
+        problems.append(f"вторая волна получила {reused[:10]}..., ожидались номера из free-list {released[:10]}...")
+
+    return (args.users + len(second)) / elapsed, problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    reset_db(args.users)
+    rate, problems = asyncio.run(run(args))
+    for problem in problems:
+        print(problem)
+    print(f"{rate:.1f} регистраций/с, нарушений: {len(problems)}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
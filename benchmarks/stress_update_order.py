@@ -0,0 +1,141 @@
+"""Стресс-проверка порядка апдейтов: регистрация и списание при перемешанном потоке.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.stress_update_order --users 200 --workers 32
+
+Каждый пользователь проходит /start -> имя -> фамилия -> телефон -> подтверждение
+-> «Списать баллы» -> сумма. Апдейты разных пользователей перемешиваются случайно
+(порядок внутри пользователя сохраняется, как у Telegram) и обрабатываются
+настоящим Application с PerUserUpdateProcessor. В конце проверяется, что у каждого
+пользователя в БД свои данные и своя заявка на списание, а user_data в покое.
+"""
+import argparse
+import asyncio
+import random
+import sys
+
+from benchmarks._fakes import setup_env, FakeRequest, message_update, callback_update
+
+setup_env('stress_update_order.db')
+
+from sqlalchemy import delete, select  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import config  # noqa: E402
+from database import SessionLocal, User, RedemptionRequest, init_db  # noqa: E402
+from main import build_application  # noqa: E402
+
+FIRST_USER = 300000
+
+
+def user_flow(bot, telegram_id):
+    return [
+        message_update(bot, telegram_id, '/start'),
+        message_update(bot, telegram_id, f'Имя{telegram_id}'),
+        message_update(bot, telegram_id, f'Фамилия{telegram_id}'),
+        message_update(bot, telegram_id, f'+7{telegram_id}'),
+        callback_update(bot, telegram_id, 'confirm_registration'),
+        callback_update(bot, telegram_id, 'redeem_bonus'),
+        message_update(bot, telegram_id, str(expected_amount(telegram_id))),
+    ]
+
+
+def expected_amount(telegram_id):
+    return telegram_id % 50 + 1
+
+
+def interleave(flows, rng):
+    flows = [list(reversed(flow)) for flow in flows]
+    merged = []
+    while flows:
+        flow = rng.choice(flows)
+        merged.append(flow.pop())
+        if not flow:
+            flows.remove(flow)
+    return merged
+
+
+def reset_db():
+    init_db()
+    db = SessionLocal()
+    try:
+        ids = select(User.id).where(User.telegram_id >= FIRST_USER)
+        db.execute(delete(RedemptionRequest).where(RedemptionRequest.user_id.in_(ids)))
+        db.execute(delete(User).where(User.telegram_id >= FIRST_USER))
+        db.commit()
+    finally:
+        db.close()
+
+
+def check(application, telegram_ids):
+    problems = []
+    db = SessionLocal()
+    try:
+        users = {u.telegram_id: u for u in db.scalars(select(User).where(User.telegram_id.in_(telegram_ids)))}
+        requests = {}
+        for request in db.scalars(select(RedemptionRequest)):
+            requests.setdefault(request.user_id, []).append(request.amount)
+    finally:
+        db.close()
+
+    for telegram_id in telegram_ids:
+        user = users.get(telegram_id)
+        if not user or not user.registration_complete:
+            problems.append(f"{telegram_id}: регистрация не завершена")
+            continue
+        if (user.first_name, user.last_name, user.phone) != (f'Имя{telegram_id}', f'Фамилия{telegram_id}',
+                                                             f'+7{telegram_id}'):
+            problems.append(f"{telegram_id}: чужие или перепутанные данные {user.first_name} {user.last_name}")
+        if requests.get(user.id) != [expected_amount(telegram_id)]:
+            problems.append(f"{telegram_id}: заявки на списание {requests.get(user.id)}")
+        user_data = application.user_data.get(telegram_id, {})
+        if 'registration_step' in user_data or user_data.get('flow'):
+            problems.append(f"{telegram_id}: незавершенное состояние {user_data}")
+    return problems
+
+
+async def run(args):
+    builder = Application.builder().token(config.BOT_TOKEN).request(FakeRequest(args.api_latency_ms / 1000))
+    config.UPDATE_WORKERS = args.workers
+    application = build_application(builder)
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+
+    application.add_error_handler(on_error)
+
+    telegram_ids = [FIRST_USER + i for i in range(args.users)]
+    updates = interleave([user_flow(application.bot, t) for t in telegram_ids], random.Random(args.seed))
+
+    async with application:
+        await application.start()
+        for update in updates:
+            await application.update_queue.put(update)
+        # stop() не ждет апдейты, уже разобранные в параллельные задачи
+        await application.update_queue.join()
+        await application.stop()
+
+    return errors, check(application, telegram_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--api-latency-ms', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    reset_db()
+    errors, problems = asyncio.run(run(args))
+    for line in (errors + problems)[:20]:
+        print(line)
+    print(f"{args.users} пользователей, {args.workers} воркеров: "
+          f"{len(errors)} ошибок обработчиков, {len(problems)} нарушений")
+    sys.exit(1 if errors or problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,122 @@
-from flask import Flask, request
+import startup  # первым: отсчет времени запуска
+
+from contextlib import asynccontextmanager
+import asyncio
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
 from telegram import Update
 import logging
-import os
-import asyncio
 
-app = Flask(__name__)
+import config
+import metrics
+from database import init_db_async
+from main import build_application, post_init, post_shutdown
+
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-# Инициализация базы данных
-from database import init_db
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+SHUTDOWN_TIMEOUT = 20  # секунд на обработку уже принятых апдейтов при остановке
 
-init_db()
 
-# Импорт основного приложения
-from main import application as bot_application
+def create_app(bot_application):
+    """ASGI-приложение вокруг одного долгоживущего Application.
 
+    Вебхук только кладет апдейт в update_queue и сразу отвечает 200;
+    обработкой занимаются воркеры Application (config.UPDATE_WORKERS).
+    """
 
-@app.route('/webhook', methods=['POST'])
-async def webhook():
-    try:
-        json_data = request.get_json()
-        update = Update.de_json(json_data, bot_application.bot)
-        await bot_application.process_update(update)
-        return 'OK', 200
-    except Exception as e:
-        logging.error(f"Error processing update: {e}")
-        return 'ERROR', 500
+    @asynccontextmanager
+    async def lifespan(app):
+        timer = startup.timer
+        # Сверка схемы и getMe — независимые сетевые запросы: выполняем одновременно.
+        # Соединение, открытое для схемы, остается в пуле для первого апдейта.
+        migrated, _ = await asyncio.gather(
+            timer.measure('схема БД', init_db_async()),
+            timer.measure('getMe', bot_application.bot.initialize()),
+        )
+        await timer.measure('initialize', bot_application.initialize())
+        await timer.measure('post_init', post_init(bot_application))
+        await timer.measure('start', bot_application.start())
+        timer.report()
+        if not migrated:
+            logger.info("Схема БД актуальна, сверка таблиц пропущена")
+        # Вебхук уже указывает сюда (иначе бы нас не разбудили): ставим его в фоне,
+        # не задерживая первый апдейт
+        webhook_task = asyncio.create_task(set_bot_webhook(config.WEBHOOK_URL)) if config.WEBHOOK_URL else None
+        try:
+            yield
+        finally:
+            if webhook_task is not None:
+                await asyncio.gather(webhook_task, return_exceptions=True)
+            # stop() не ждет апдейты, уже разобранные в параллельные задачи
+            try:
+                await asyncio.wait_for(bot_application.update_queue.join(), SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.warning("Не все апдейты обработаны до остановки")
+            await bot_application.stop()
+            await post_shutdown(bot_application)
+            await bot_application.shutdown()
 
+    async def set_bot_webhook(url):
+        try:
+            await bot_application.bot.set_webhook(
+                url,
+                secret_token=config.WEBHOOK_SECRET,
+                max_connections=max(config.UPDATE_WORKERS, 40),
+            )
+        except Exception:
+            logger.exception("Не удалось установить вебхук %s", url)
+            raise
 
-@app.route('/')
-def index():
-    return 'Bot is live! Use /start in Telegram.'
+    async def webhook(request: Request):
+        if config.WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != config.WEBHOOK_SECRET:
+            return Response(status_code=403)
+        try:
+            json_data = await request.json()
+        except ValueError:
+            return Response(status_code=400)
+        # Не объект (список, строка, число) — не апдейт: 500 заставил бы Telegram присылать его снова
+        if not isinstance(json_data, dict):
+            return Response(status_code=400)
+        try:
+            update = Update.de_json(json_data, bot_application.bot)
+        except (TypeError, ValueError, AttributeError):
+            return Response(status_code=400)
+        if update is None:
+            return Response(status_code=400)
 
+        await bot_application.update_queue.put(update)
+        return Response()
 
-@app.route('/set_webhook', methods=['GET'])
-def set_webhook():
-    webhook_url = f"https://{request.host}/webhook"
-    try:
-        # Используем asyncio для запуска асинхронной функции
-        async def set_wh():
-            await bot_application.bot.set_webhook(webhook_url)
+    async def metrics_endpoint(request: Request):
+        if config.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {config.METRICS_TOKEN}':
+            return Response(status_code=403)
+        return PlainTextResponse(await metrics.render(), media_type='text/plain; version=0.0.4')
 
-        asyncio.run(set_wh())
-        return f'Webhook set to: {webhook_url}'
-    except Exception as e:
-        return f'Error setting webhook: {e}'
+    async def index(request: Request):
+        return PlainTextResponse('Bot is live! Use /start in Telegram.')
+
+    return Starlette(
+        routes=[
+            Route('/webhook', webhook, methods=['POST']),
+            Route('/metrics', metrics_endpoint),
+            Route('/', index),
+        ],
+        lifespan=lifespan,
+    )
+
+
+startup.timer.lap('импорт модулей')
+app = create_app(build_application())
+startup.timer.lap('сборка Application')
 
 
 if __name__ == '__main__':
+    import os
+    import uvicorn
+
     port = int(os.environ.get('PORT', 10000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    uvicorn.run(app, host='0.0.0.0', port=port)
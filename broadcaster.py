@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import select, update, func
+from telegram.error import RetryAfter, TelegramError
+
+import config
+import delivery
+from database import AsyncSessionLocal, User, Broadcast
+from ratelimit import RateLimiter, BULK
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+PROGRESS_INTERVAL = 5  # секунд между обновлениями прогресса у администратора
+
+_jobs = {}
+
+
+def start_job(application, broadcast_id):
+    """Запускает рассылку в фоне, не дожидаясь ее окончания."""
+    if broadcast_id not in _jobs:
+        task = asyncio.create_task(run_broadcast(application, broadcast_id))
+        _jobs[broadcast_id] = task
+        task.add_done_callback(lambda _: _jobs.pop(broadcast_id, None))
+
+
+async def resume_broadcasts(application):
+    """Продолжает рассылки, прерванные перезапуском процесса."""
+    async with AsyncSessionLocal() as db:
+        ids = (await db.scalars(select(Broadcast.id).where(Broadcast.status == 'running'))).all()
+    for broadcast_id in ids:
+        logger.info("Продолжаем рассылку #%s", broadcast_id)
+        start_job(application, broadcast_id)
+
+
+async def stop_broadcasts(application):
+    # Отмененная посреди порции задача сама сохраняет курсор после уже отправленных (run_broadcast)
+    for task in list(_jobs.values()):
+        task.cancel()
+    await asyncio.gather(*_jobs.values(), return_exceptions=True)
+
+
+async def run_broadcast(application, broadcast_id):
+    bot = application.bot
+    limiter = RateLimiter(config.BROADCAST_RATE)
+    semaphore = asyncio.Semaphore(config.BROADCAST_CONCURRENCY)
+
+    async with AsyncSessionLocal() as db:
+        broadcast = await db.get(Broadcast, broadcast_id)
+        if broadcast is None:
+            # Рассылку удалили, пока задача ждала запуска или перезапуска процесса
+            logger.warning("Рассылка #%s не найдена", broadcast_id)
+            return
+        if not broadcast.total:
+            broadcast.total = await db.scalar(
+                select(func.count(User.id)).where(User.registration_complete == True, User.is_reachable == True)
+            )
+            broadcast.skipped_count = await db.scalar(
+                select(func.count(User.id)).where(User.registration_complete == True, User.is_reachable == False)
+            )
+            delivery.stats['avoided_sends'] += broadcast.skipped_count
+            await db.commit()
+
+    async def send(chat_id):
+        async with semaphore:
+            for _ in range(MAX_ATTEMPTS):
+                await limiter.acquire()
+                try:
+                    await _send_content(bot, broadcast, chat_id)
+                    return True
+                except RetryAfter as e:
+                    limiter.pause(e.retry_after)
+                except TelegramError as e:
+                    await delivery.handle_send_error(chat_id, e)
+                    return False
+            return False
+
+    last_report = 0.0
+    loop = asyncio.get_running_loop()
+
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(User.id, User.telegram_id)
+                .where(User.registration_complete == True, User.is_reachable == True,
+                       User.id > broadcast.last_user_id)
+                .order_by(User.id)
+                .limit(config.BROADCAST_CHUNK_SIZE)
+            )).all()
+        if not rows:
+            break
+
+        results = [None] * len(rows)
+
+        async def deliver(i, chat_id):
+            results[i] = await send(chat_id)
+
+        try:
+            await asyncio.gather(*(deliver(i, row.telegram_id) for i, row in enumerate(rows)))
+        except asyncio.CancelledError:
+            # Остановка процесса посреди порции: после перезапуска рассылка продолжится
+            # с первого неотправленного, а не с начала порции
+            _advance(broadcast, rows, results)
+            await asyncio.shield(_save_progress(broadcast))
+            raise
+        _advance(broadcast, rows, results)
+        await _save_progress(broadcast)
+
+        if loop.time() - last_report >= PROGRESS_INTERVAL:
+            last_report = loop.time()
+            await _report(bot, broadcast)
+
+    broadcast.status = 'done'
+    broadcast.finished_at = datetime.utcnow()
+    await _save_progress(broadcast)
+    await _report(bot, broadcast)
+
+
+async def _send_content(bot, broadcast, chat_id):
+    if broadcast.content_type == 'photo':
+        await bot.send_photo(chat_id=chat_id, photo=broadcast.file_id, caption=broadcast.caption,
+                             rate_limit_args=BULK)
+    elif broadcast.content_type == 'video':
+        await bot.send_video(chat_id=chat_id, video=broadcast.file_id, caption=broadcast.caption,
+                             rate_limit_args=BULK)
+    else:
+        await bot.send_message(chat_id=chat_id, text=broadcast.text, rate_limit_args=BULK)
+
+
+def _advance(broadcast, rows, results):
+    """Сдвигает курсор по непрерывному началу порции, для которого отправка завершена."""
+    for row, result in zip(rows, results):
+        if result is None:
+            break
+        broadcast.last_user_id = row.id
+        if result:
+            broadcast.sent_count += 1
+        else:
+            broadcast.failed_count += 1
+
+
+async def _save_progress(broadcast):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast.id)
+            .values(
+                last_user_id=broadcast.last_user_id,
+                sent_count=broadcast.sent_count,
+                failed_count=broadcast.failed_count,
+                status=broadcast.status,
+                finished_at=broadcast.finished_at,
+            )
+        )
+        await db.commit()
+
+
+async def _report(bot, broadcast):
+    processed = broadcast.sent_count + broadcast.failed_count
+    if broadcast.status == 'done':
+        text = (f"Рассылка завершена. Сообщение отправлено {broadcast.sent_count} пользователям.\n"
+                f"Не доставлено: {broadcast.failed_count}\n"
+                f"Пропущено недоступных чатов: {broadcast.skipped_count}")
+    else:
+        text = (f"Рассылка идет: {processed} из {broadcast.total}\n"
+                f"Отправлено: {broadcast.sent_count}, не доставлено: {broadcast.failed_count}")
+    try:
+        if broadcast.progress_message_id:
+            await bot.edit_message_text(chat_id=broadcast.admin_chat_id,
+                                        message_id=broadcast.progress_message_id, text=text,
+                                        rate_limit_args=BULK)
+        else:
+            await bot.send_message(chat_id=broadcast.admin_chat_id, text=text, rate_limit_args=BULK)
+    except TelegramError as e:
+        logger.warning("Не удалось обновить прогресс рассылки #%s: %s", broadcast.id, e)
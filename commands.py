@@ -1,18 +1,46 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import SessionLocal, User
-from sqlalchemy.orm import Session
+from database import AsyncSessionLocal
+import ledger
+import user_cache
 
 
 async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/balance и кнопка «Мой баланс» в меню."""
+    if update.callback_query:
+        await update.callback_query.answer()
     user_id = update.effective_user.id
-    db: Session = SessionLocal()
-
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if user and user.registration_complete:
-            await update.message.reply_text(f"Ваш баланс: {user.bonus_balance} бонусных баллов")
-        else:
-            await update.message.reply_text("Пожалуйста, завершите регистрацию через /start")
-    finally:
-        db.close()
\ No newline at end of file
+
+    user = await user_cache.get_user(user_id)
+    if user and user.registration_complete:
+        await update.effective_message.reply_text(f"Ваш баланс: {user.bonus_balance} бонусных баллов")
+    else:
+        await update.effective_message.reply_text("Пожалуйста, завершите регистрацию через /start")
+
+
+KINDS = {
+    'welcome': "Приветственные баллы",
+    'accrual': "Начисление",
+    'redemption': "Списание",
+    'adjustment': "Корректировка",
+}
+
+
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await user_cache.get_user(update.effective_user.id)
+    if not user or not user.registration_complete:
+        await update.message.reply_text("Пожалуйста, завершите регистрацию через /start")
+        return
+
+    async with AsyncSessionLocal() as db:
+        entries = await ledger.history(db, user.id)
+
+    if not entries:
+        await update.message.reply_text("Операций по счету пока нет.")
+        return
+
+    message = "Последние операции:\n\n"
+    for entry in entries:
+        message += (f"{entry.created_at:%d.%m.%Y} {KINDS.get(entry.kind, entry.kind)}: "
+                    f"{entry.amount:+d} (баланс {entry.balance_after})\n")
+    await update.message.reply_text(message)
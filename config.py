@@ -7,5 +7,106 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_IDS = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',') if id.strip()]
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# Пул соединений с Postgres на процесс: постоянных соединений, сколько можно открыть сверх них,
+# сколько секунд ждать свободного, через сколько секунд пересоздавать соединение и проверять ли
+# его перед выдачей (бесплатный Postgres засыпает, и простаивавшие соединения оказываются разорваны)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+# Подготовленные на сервере запросы: после скольких выполнений psycopg готовит запрос сам
+# (горячие запросы готовятся сразу). DB_PGBOUNCER=1 — подключение через PgBouncer
+# в режиме transaction: подготовка выключается
+DB_PREPARE_THRESHOLD = int(os.getenv('DB_PREPARE_THRESHOLD', '5'))
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', '0') == '1'
+
+# Вебхук: публичный адрес (если задан, вебхук ставится при старте), секрет для заголовка
+# X-Telegram-Bot-Api-Secret-Token и число апдейтов, обрабатываемых одновременно
+# (апдейты одного пользователя всегда идут по порядку)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '16'))
+
+# Адрес Bot API без /bot<token> (свой сервер telegram-bot-api или заглушка в бенчмарках)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Исходящие сообщения (ratelimit.SendGateway): общий лимит бота в секунду, лимит на личный чат
+# (в секунду, с запасом TELEGRAM_CHAT_BURST) и на группу, сколько раз повторять ответ после 429
+# и сколько секунд ответ может ждать retry_after; размер пула HTTP-соединений и ожидание соединения
+TELEGRAM_RATE = float(os.getenv('TELEGRAM_RATE', '28'))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_CHAT_BURST = float(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', str(20 / 60)))
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '2'))
+TELEGRAM_MAX_RETRY_WAIT = float(os.getenv('TELEGRAM_MAX_RETRY_WAIT', '10'))
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '64'))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', '5'))
+
+# Метрики /metrics: если задан токен, нужен заголовок "Authorization: Bearer <токен>";
+# апдейты дольше METRICS_SLOW_UPDATE секунд пишутся в лог с разбивкой по БД и Bot API
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_SLOW_UPDATE = float(os.getenv('METRICS_SLOW_UPDATE', '1'))
+
+# Состояние диалогов в БД: как часто сбрасывать изменения (секунды) и перечитывать ли
+# его на каждом апдейте, когда бот запущен в нескольких процессах
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '5'))
+PERSISTENCE_SHARED = os.getenv('PERSISTENCE_SHARED', '0') == '1'
+
+# Короткие номера участников (карта лояльности): от 1 до MEMBER_ID_MAX
+MEMBER_ID_MAX = int(os.getenv('MEMBER_ID_MAX', '3000'))
+
+# Как часто (секунды) сверять users.bonus_balance с журналом баллов
+LEDGER_RECONCILE_INTERVAL = float(os.getenv('LEDGER_RECONCILE_INTERVAL', '3600'))
+
+# Кэш профилей пользователей: сколько записей держать и сколько секунд им доверять
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+
+# Защита от флуда: апдейтов в секунду на пользователя и запас (THROTTLE_RATE=0 — выключить),
+# сколько пользователей помнить, окно склейки повторных команд и нажатий (секунды) и сколько
+# секунд ввод в диалоге может ждать токена, прежде чем будет отброшен
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', '1'))
+THROTTLE_BURST = float(os.getenv('THROTTLE_BURST', '8'))
+THROTTLE_USERS = int(os.getenv('THROTTLE_USERS', '50000'))
+THROTTLE_DUPLICATE_WINDOW = float(os.getenv('THROTTLE_DUPLICATE_WINDOW', '3'))
+THROTTLE_MAX_DELAY = float(os.getenv('THROTTLE_MAX_DELAY', '1'))
+
+# Рассылки: глобальный лимит сообщений в секунду, параллельность и размер порции получателей
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', '500'))
+
+# Очередь уведомлений (outbox): сообщений в секунду, одновременных отправок, сколько строк
+# забирать за раз, сколько попыток делать и как часто проверять таблицу без явного сигнала
+OUTBOX_RATE = float(os.getenv('OUTBOX_RATE', '20'))
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', '10'))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+
+# Бронирование: столы в формате "<мест>x<количество>,...", шаг сетки и длительность брони
+# в минутах, часы работы (последняя бронь — за BOOKING_DURATION_MINUTES до закрытия),
+# на сколько дней вперед принимать брони и часовой пояс заведения
+BOOKING_TABLES = os.getenv('BOOKING_TABLES', '2x4,4x6,6x2')
+BOOKING_SLOT_MINUTES = int(os.getenv('BOOKING_SLOT_MINUTES', '30'))
+BOOKING_DURATION_MINUTES = int(os.getenv('BOOKING_DURATION_MINUTES', '120'))
+BOOKING_OPEN = os.getenv('BOOKING_OPEN', '12:00')
+BOOKING_CLOSE = os.getenv('BOOKING_CLOSE', '23:00')
+BOOKING_DAYS_AHEAD = int(os.getenv('BOOKING_DAYS_AHEAD', '30'))
+TIMEZONE = os.getenv('TIMEZONE', 'Europe/Moscow')
+
+# Напоминания о бронях: как часто (секунды) просматривать ближайшие брони и закрывать прошедшие,
+# за сколько минут до начала напоминать и сколько броней брать в одну транзакцию
+REMINDER_INTERVAL = float(os.getenv('REMINDER_INTERVAL', '300'))
+REMINDER_BEFORE_MINUTES = int(os.getenv('REMINDER_BEFORE_MINUTES', '180'))
+REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', '200'))
+
+# Статистика в админке: на сколько строк-слотов разносить счетчики, как часто (секунды)
+# сверять их с полными агрегатами и за сколько последних дней сверять дневные счетчики
+STATS_SLOTS = int(os.getenv('STATS_SLOTS', '8'))
+STATS_VERIFY_INTERVAL = float(os.getenv('STATS_VERIFY_INTERVAL', '3600'))
+STATS_VERIFY_DAYS = int(os.getenv('STATS_VERIFY_DAYS', '7'))
+
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен")
\ No newline at end of file
@@ -1,19 +1,106 @@
-from sqlalchemy import create_engine, Column, Integer, String, BigInteger, DateTime, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, inspect, text, true, select, insert, update, bindparam, or_, and_, Index, Column, Integer, String, BigInteger, Date, DateTime, Time, Boolean, Text, JSON
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker, declarative_base, validates
 from datetime import datetime
+import hashlib
+import logging
+import re
 import config
 
-# Используем psycopg3 connection string
-engine = create_engine(config.DATABASE_URL.replace('postgresql://', 'postgresql+psycopg://'))
+logger = logging.getLogger(__name__)
+
+
+def _sync_url(url):
+    # Используем psycopg3 connection string
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url.replace('postgresql://', 'postgresql+psycopg://')
+
+
+def _async_url(url):
+    # psycopg3 умеет работать асинхронно через тот же диалект,
+    # для локальной SQLite нужен aiosqlite
+    url = _sync_url(url)
+    if url.startswith('sqlite://'):
+        url = url.replace('sqlite://', 'sqlite+aiosqlite://', 1)
+    return url
+
+
+def _engine_options(url, pool_size):
+    if url.startswith('sqlite'):
+        # Локальная SQLite сериализует запись: даем конкурирующим транзакциям подождать
+        return {'connect_args': {'timeout': 30}}
+    return {
+        'pool_size': pool_size,
+        'max_overflow': config.DB_MAX_OVERFLOW,
+        'pool_timeout': config.DB_POOL_TIMEOUT,
+        # Бесплатный Postgres засыпает и рвет соединения: старые пересоздаем, перед выдачей проверяем
+        'pool_recycle': config.DB_POOL_RECYCLE,
+        'pool_pre_ping': config.DB_POOL_PRE_PING,
+        # Последнее возвращенное соединение выдается первым: горячие запросы попадают туда,
+        # где они уже подготовлены, а лишние соединения простаивают
+        'pool_use_lifo': True,
+        # PgBouncer в режиме transaction отдает каждую транзакцию случайному серверному
+        # соединению, и подготовленного на другом соединении выражения там нет
+        'connect_args': {'prepare_threshold': None if config.DB_PGBOUNCER else config.DB_PREPARE_THRESHOLD},
+    }
+
+
+# Синхронный движок — схема при старте и скрипты: одного постоянного соединения хватает
+engine = create_engine(_sync_url(config.DATABASE_URL), **_engine_options(config.DATABASE_URL, pool_size=1))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Асинхронный движок для обработчиков: запросы не блокируют цикл событий PTB
+async_engine = create_async_engine(_async_url(config.DATABASE_URL),
+                                   **_engine_options(config.DATABASE_URL, pool_size=config.DB_POOL_SIZE))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+@event.listens_for(async_engine.sync_engine, 'do_execute')
+def _prepared(cursor, statement, parameters, context):
+    # Горячие запросы помечены execution_options(prepare=True): psycopg готовит их на сервере
+    # с первого выполнения, не дожидаясь DB_PREPARE_THRESHOLD повторов
+    if (context.execution_options.get('prepare') and context.dialect.driver == 'psycopg'
+            and not config.DB_PGBOUNCER):
+        cursor.execute(statement, parameters, prepare=True)
+        return True
+
+
 Base = declarative_base()
 
 
+def normalize_phone(phone):
+    """Только цифры, российские номера к виду 7XXXXXXXXXX: +7 (916) 123-45-67, 89161234567 -> 79161234567."""
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10 and digits[0] == '9':
+        digits = '7' + digits
+    return digits or None
+
+
+def normalize_name(name):
+    # SQLite lower() не знает кириллицу, поэтому храним готовую нижнюю форму
+    return (name or '').strip().lower().replace('ё', 'е') or None
+
+
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Ключи сортировки постраничного списка участников в админке
+        Index('ix_users_bonus_balance_id', 'bonus_balance', 'id'),
+        Index('ix_users_created_at_id', 'created_at', 'id'),
+        # Поиск участника кассиром: по префиксу телефона и фамилии (LIKE 'abc%')
+        Index('ix_users_phone_normalized', 'phone_normalized',
+              postgresql_ops={'phone_normalized': 'varchar_pattern_ops'}),
+        Index('ix_users_last_name_lower', 'last_name_lower', 'first_name_lower',
+              postgresql_ops={'last_name_lower': 'varchar_pattern_ops', 'first_name_lower': 'varchar_pattern_ops'}),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    # Короткий номер участника, который видят гости и кассир; выдается member_ids
+    member_id = Column(Integer, unique=True, index=True)
     telegram_id = Column(BigInteger, unique=True, index=True)
     first_name = Column(String(100))
     last_name = Column(String(100))
@@ -21,32 +108,239 @@ class User(Base):
     bonus_balance = Column(Integer, default=0)
     registration_complete = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Доступность чата: False, если пользователь заблокировал бота или чат удален
+    is_reachable = Column(Boolean, default=True, server_default=true(), nullable=False, index=True)
+    unreachable_since = Column(DateTime)
+    # Нормализованные копии для поиска, заполняются автоматически при записи полей
+    phone_normalized = Column(String(20))
+    first_name_lower = Column(String(100))
+    last_name_lower = Column(String(100))
+
+    @validates('phone')
+    def _set_phone_normalized(self, key, value):
+        self.phone_normalized = normalize_phone(value)
+        return value
+
+    @validates('first_name', 'last_name')
+    def _set_name_lower(self, key, value):
+        setattr(self, key + '_lower', normalize_name(value))
+        return value
 
 
 class Booking(Base):
     __tablename__ = "bookings"
+    __table_args__ = (
+        # Брони на день/диапазон дней: построение индекса свободных слотов и окно напоминаний
+        Index('ix_bookings_booking_date_booking_time', 'booking_date', 'booking_time'),
+        # Закрытие прошедших броней: только еще активные, сколько бы ни было истории
+        Index('ix_bookings_status_booking_date_booking_time', 'status', 'booking_date', 'booking_time'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, index=True)
+    # Исходный ввод пользователя ("25.12.2024", "19:30"); для запросов — booking_date/booking_time
     date = Column(String(20))
     time = Column(String(10))
+    booking_date = Column(Date)
+    booking_time = Column(Time)
     guests = Column(Integer)
+    table_seats = Column(Integer)  # вместимость занятого стола
+    # pending -> confirmed (гость ответил на напоминание) -> completed; cancelled; no_show
     status = Column(String(20), default="pending")
     created_at = Column(DateTime, default=datetime.utcnow)
+    reminded_at = Column(DateTime)  # напоминание поставлено в outbox (или не нужно)
 
 
 class RedemptionRequest(Base):
     __tablename__ = "redemption_requests"
+    __table_args__ = (
+        # Очередь ожидающих запросов в админке: WHERE status = 'pending' AND id > курсор
+        Index('ix_redemption_requests_status_id', 'status', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, index=True)
     amount = Column(Integer)
-    status = Column(String(20), default="pending")
+    status = Column(String(20), default="pending")  # pending, approved, rejected
     created_at = Column(DateTime, default=datetime.utcnow)
+    decided_at = Column(DateTime)
+    decided_by = Column(BigInteger)  # telegram_id администратора
+
+
+class PointsTransaction(Base):
+    """Запись журнала баллов; users.bonus_balance — накопленная сумма amount по пользователю."""
+    __tablename__ = "points_ledger"
+    __table_args__ = (
+        Index('ix_points_ledger_user_id_id', 'user_id', 'id'),
+        # Поиск операций по источнику, например повторная загрузка того же файла чеков
+        Index('ix_points_ledger_reference', 'reference'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    kind = Column(String(20), nullable=False)  # welcome, accrual, redemption, adjustment
+    amount = Column(Integer, nullable=False)   # со знаком: списания отрицательные
+    balance_after = Column(Integer, nullable=False)
+    reference = Column(String(64))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    admin_chat_id = Column(BigInteger)
+    content_type = Column(String(10))  # text, photo, video
+    text = Column(Text)
+    file_id = Column(String(255))
+    caption = Column(Text)
+    status = Column(String(20), default="running", index=True)
+    last_user_id = Column(Integer, default=0)  # курсор: последний обработанный User.id
+    total = Column(Integer, default=0)
+    skipped_count = Column(Integer, default=0)  # недоступные чаты, которым не отправляли
+    sent_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    progress_message_id = Column(BigInteger)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+
+class OutboxMessage(Base):
+    """Исходящее уведомление; пишется в той же транзакции, что и изменение, о котором оно сообщает."""
+    __tablename__ = "outbox"
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    kind = Column(String(10), nullable=False, default="user")  # user, admin (admin сводятся в дайджесты)
+    text = Column(Text, nullable=False)
+    reply_markup = Column(JSON)
+    status = Column(String(10), nullable=False, default="pending")  # pending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # до этого момента строка занята
+    last_error = Column(String(255))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+
+class MemberIdCounter(Base):
+    """Следующий еще не выдававшийся номер участника (одна строка)."""
+    __tablename__ = "member_id_counter"
+
+    id = Column(Integer, primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
+
+class FreeMemberId(Base):
+    """Свободные номера ниже счетчика — пропуски после переноса старых users.id; их выдают первыми."""
+    __tablename__ = "free_member_ids"
+
+    member_id = Column(Integer, primary_key=True)
+
 
+class ConversationState(Base):
+    """Состояние диалога пользователя (context.user_data) для SQLPersistence."""
+    __tablename__ = "conversation_state"
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+    user_id = Column(BigInteger, primary_key=True)
+    data = Column(JSON, nullable=False)
+    version = Column(BigInteger, nullable=False)  # меняется при каждой записи любым процессом
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class StatsTotal(Base):
+    """Итоговый счетчик статистики (stats.py); значение — сумма value по слотам."""
+    __tablename__ = "stats_totals"
+
+    name = Column(String(40), primary_key=True)
+    # Транзакции пишут в случайный слот: параллельные записи не ждут одну строку
+    slot = Column(Integer, primary_key=True, autoincrement=False)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class StatsDaily(Base):
+    """Счетчик статистики за день по времени заведения; значение — сумма value по слотам."""
+    __tablename__ = "stats_daily"
+
+    day = Column(Date, primary_key=True)
+    name = Column(String(40), primary_key=True)
+    slot = Column(Integer, primary_key=True, autoincrement=False)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class SchemaMeta(Base):
+    """Служебные значения: отпечаток схемы, до которой уже доведена база."""
+    __tablename__ = "schema_meta"
+
+    key = Column(String(50), primary_key=True)
+    value = Column(String(255), nullable=False)
+
+
+SCHEMA_FINGERPRINT_KEY = 'fingerprint'
+
+
+def schema_fingerprint():
+    """Хеш таблиц, колонок и индексов моделей: меняется при любом изменении схемы в коде."""
+    parts = []
+    for table in Base.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f'{column.name}:{column.type!r}:{column.nullable}' for column in table.columns)
+        parts.extend(sorted(index.name for index in table.indexes))
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+def init_db(force=False):
+    """Создает и досоздает схему; возвращает False, если база уже соответствует моделям."""
+    with engine.begin() as conn:
+        return _migrate(conn, force)
+
+
+async def init_db_async(force=False):
+    """init_db через асинхронный движок: его соединение остается в пуле для первых апдейтов."""
+    async with async_engine.begin() as conn:
+        return await conn.run_sync(_migrate, force)
+
+
+def _migrate(conn, force=False):
+    # Полная сверка схемы — десятки запросов к каталогу; при совпадении отпечатка хватает одного
+    fingerprint = schema_fingerprint()
+    if not force and _stored_fingerprint(conn) == fingerprint:
+        return False
+
+    Base.metadata.create_all(bind=conn)
+    _add_missing_columns(conn)
+    _init_member_ids(conn)
+    _init_search(conn)
+    _init_bookings(conn)
+
+    meta = SchemaMeta.__table__
+    conn.execute(meta.delete().where(meta.c.key == SCHEMA_FINGERPRINT_KEY))
+    conn.execute(insert(meta).values(key=SCHEMA_FINGERPRINT_KEY, value=fingerprint))
+    return True
+
+
+def _stored_fingerprint(conn):
+    if not inspect(conn).has_table(SchemaMeta.__tablename__):
+        return None
+    return conn.scalar(select(SchemaMeta.value).where(SchemaMeta.key == SCHEMA_FINGERPRINT_KEY))
+
+
+def _add_missing_columns(conn):
+    # create_all не меняет существующие таблицы: досоздаем новые колонки и индексы
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(conn)
 
 
 def get_db():
@@ -54,4 +348,90 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _init_member_ids(conn):
+    if conn.scalar(select(MemberIdCounter.next_id).where(MemberIdCounter.id == 1)) is not None:
+        return
+
+    # Раньше номер участника хранился прямо в users.id (1..MEMBER_ID_MAX)
+    conn.execute(
+        update(User)
+        .where(User.registration_complete == True, User.member_id.is_(None),
+               User.id.between(1, config.MEMBER_ID_MAX))
+        .values(member_id=User.id)
+    )
+    used = set(conn.scalars(select(User.member_id).where(User.member_id.isnot(None))))
+    next_id = max(used, default=0) + 1
+    conn.execute(insert(MemberIdCounter).values(id=1, next_id=next_id))
+    gaps = [{'member_id': i} for i in range(1, next_id) if i not in used]
+    if gaps:
+        conn.execute(insert(FreeMemberId), gaps)
+
+    if conn.dialect.name == 'postgresql':
+        # Переписанные вручную users.id могли обогнать последовательность
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('users', 'id'), "
+                          "GREATEST((SELECT MAX(id) FROM users), 1))"))
+
+
+def _init_search(conn):
+    # Заполняем нормализованные колонки у строк, записанных до их появления
+    users = User.__table__
+    while True:
+        rows = conn.execute(
+            select(users.c.id, users.c.phone, users.c.first_name, users.c.last_name)
+            .where(or_(and_(users.c.phone_normalized.is_(None), users.c.phone.isnot(None)),
+                       and_(users.c.last_name_lower.is_(None), users.c.last_name.isnot(None))))
+            .limit(1000)
+        ).all()
+        if not rows:
+            break
+        conn.execute(
+            update(users).where(users.c.id == bindparam('user_id')),
+            [{'user_id': row.id, 'phone_normalized': normalize_phone(row.phone) or '',
+              'first_name_lower': normalize_name(row.first_name) or '',
+              'last_name_lower': normalize_name(row.last_name) or ''} for row in rows]
+        )
+
+    if conn.dialect.name != 'postgresql':
+        return
+    # Нечеткий поиск по фамилии (опечатки, середина слова) — триграммный индекс pg_trgm.
+    # Без прав на CREATE EXTENSION поиск работает без него, только медленнее.
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_last_name_trgm "
+                              "ON users USING gin (last_name_lower gin_trgm_ops)"))
+    except Exception as e:
+        logger.warning("Триграммный индекс не создан: %s", e)
+
+
+def _init_bookings(conn):
+    # Брони, сохраненные до появления booking_date/booking_time, хранили только строки
+    bookings = Booking.__table__
+    rows = conn.execute(
+        select(bookings.c.id, bookings.c.date, bookings.c.time)
+        .where(bookings.c.booking_date.is_(None), bookings.c.date.isnot(None))
+    ).all()
+    parsed = []
+    for row in rows:
+        try:
+            parsed.append({
+                'booking_id': row.id,
+                'booking_date': datetime.strptime(row.date.strip(), '%d.%m.%Y').date(),
+                'booking_time': datetime.strptime((row.time or '').strip(), '%H:%M').time(),
+            })
+        except ValueError:
+            logger.warning("Бронь #%s: не удалось разобрать дату %r и время %r", row.id, row.date, row.time)
+    if parsed:
+        conn.execute(
+            update(bookings).where(bookings.c.id == bindparam('booking_id'))
+            .values(booking_date=bindparam('booking_date'), booking_time=bindparam('booking_time')),
+            parsed,
+        )
@@ -0,0 +1,94 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import select, update
+from telegram.constants import ChatMemberStatus
+from telegram.error import BadRequest, Forbidden
+
+from database import AsyncSessionLocal, User
+
+logger = logging.getLogger(__name__)
+
+# Ошибки BadRequest, после которых писать в чат бессмысленно
+DEAD_CHAT_ERRORS = ('chat not found', 'user is deactivated', 'bot was blocked')
+
+# telegram_id недоступных чатов; БД остается источником правды, это лишь быстрый фильтр
+_unreachable = set()
+
+stats = {
+    'avoided_sends': 0,
+    'marked_unreachable': 0,
+    'marked_reachable': 0,
+}
+
+
+def is_dead_chat_error(error):
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and any(text in error.message.lower() for text in DEAD_CHAT_ERRORS)
+
+
+def is_reachable(telegram_id):
+    if telegram_id in _unreachable:
+        stats['avoided_sends'] += 1
+        return False
+    return True
+
+
+async def load_unreachable():
+    async with AsyncSessionLocal() as db:
+        ids = await db.scalars(select(User.telegram_id).where(User.is_reachable == False))
+        _unreachable.update(ids)
+
+
+async def mark_unreachable(telegram_id):
+    if telegram_id in _unreachable:
+        return
+    _unreachable.add(telegram_id)
+    stats['marked_unreachable'] += 1
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(User)
+            .where(User.telegram_id == telegram_id, User.is_reachable == True)
+            .values(is_reachable=False, unreachable_since=datetime.utcnow())
+        )
+        await db.commit()
+
+
+async def mark_reachable(telegram_id):
+    if telegram_id not in _unreachable:
+        return
+    _unreachable.discard(telegram_id)
+    stats['marked_reachable'] += 1
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(User)
+            .where(User.telegram_id == telegram_id, User.is_reachable == False)
+            .values(is_reachable=True, unreachable_since=None)
+        )
+        await db.commit()
+
+
+async def handle_send_error(chat_id, error):
+    """Запоминает мертвый чат; возвращает True, если ошибка означает недоступность."""
+    if is_dead_chat_error(error):
+        await mark_unreachable(chat_id)
+        return True
+    logger.warning("Не удалось отправить сообщение в чат %s: %s", chat_id, error)
+    return False
+
+
+async def track_incoming(update, context):
+    # Любое входящее сообщение от пользователя значит, что чат снова доступен
+    if update.effective_user and not update.my_chat_member:
+        await mark_reachable(update.effective_user.id)
+
+
+async def track_chat_member(update, context):
+    member = update.my_chat_member
+    if member.chat.type != 'private':
+        return
+    if member.new_chat_member.status == ChatMemberStatus.BANNED:
+        await mark_unreachable(member.chat.id)
+    elif member.new_chat_member.status == ChatMemberStatus.MEMBER:
+        await mark_reachable(member.chat.id)
@@ -0,0 +1,120 @@
+"""Выгрузка участников, броней и запросов на списание в CSV для администратора.
+
+Строки не собираются в памяти: на Postgres файл пишет сам сервер через
+COPY (...) TO STDOUT, на других базах результат читается серверным курсором
+(AsyncSession.stream) порциями по EXPORT_CHUNK_SIZE. Память процесса не
+зависит от числа строк; файл пишется во временный каталог и, если он больше
+лимита Bot API на отправку документа, сжимается в .csv.gz.
+
+Формат — как у файлов, которые загружает админка: UTF-8 с BOM, разделитель
+';', первая строка — заголовок. Выгрузка участников подходит для
+member_import как есть.
+"""
+import asyncio
+import csv
+import gzip
+import os
+import shutil
+from datetime import date, datetime, time
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, async_engine, User, Booking, RedemptionRequest
+
+EXPORT_CHUNK_SIZE = 5000
+DOCUMENT_MAX_SIZE = 50 * 1024 * 1024  # больше Bot API отправить не даст
+DELIMITER = ';'
+
+
+class ExportTooLarge(Exception):
+    pass
+
+
+EXPORTS = {
+    'users': ("Участники", select(
+        User.phone.label('phone'), User.first_name.label('first_name'), User.last_name.label('last_name'),
+        User.bonus_balance.label('balance'), User.member_id.label('member_id'),
+        User.telegram_id.label('telegram_id'), User.created_at.label('created_at'),
+    ).where(User.registration_complete == True).order_by(User.id)),
+    'bookings': ("Брони", select(
+        Booking.id.label('booking_id'), User.member_id.label('member_id'), User.first_name.label('first_name'),
+        User.last_name.label('last_name'), User.phone.label('phone'), Booking.booking_date.label('booking_date'),
+        Booking.booking_time.label('booking_time'), Booking.guests.label('guests'),
+        Booking.table_seats.label('table_seats'), Booking.status.label('status'),
+        Booking.created_at.label('created_at'),
+    ).outerjoin(User, User.id == Booking.user_id).order_by(Booking.id)),
+    'redemptions': ("Списания", select(
+        RedemptionRequest.id.label('request_id'), User.member_id.label('member_id'),
+        User.first_name.label('first_name'), User.last_name.label('last_name'),
+        RedemptionRequest.amount.label('amount'), RedemptionRequest.status.label('status'),
+        RedemptionRequest.created_at.label('created_at'), RedemptionRequest.decided_at.label('decided_at'),
+        RedemptionRequest.decided_by.label('decided_by'),
+    ).outerjoin(User, User.id == RedemptionRequest.user_id).order_by(RedemptionRequest.id)),
+}
+
+
+def _cell(value):
+    # Как в выводе COPY: пустое значение, t/f, даты ISO
+    if value is None:
+        return ''
+    if value is True or value is False:
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat(' ') if isinstance(value, datetime) else value.isoformat()
+    return value
+
+
+async def _copy_postgres(query, f):
+    sql = str(query.compile(dialect=async_engine.dialect, compile_kwargs={'literal_binds': True}))
+    sql = f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER, DELIMITER '{DELIMITER}')"
+    async with async_engine.connect() as conn:
+        raw = (await conn.get_raw_connection()).driver_connection
+        async with raw.cursor() as cursor:
+            async with cursor.copy(sql) as copy:
+                async for chunk in copy:
+                    f.write(chunk)
+            rows = cursor.rowcount
+        await conn.rollback()
+    return rows
+
+
+async def _stream(query, f):
+    writer = csv.writer(f, delimiter=DELIMITER)
+    writer.writerow([column.name for column in query.selected_columns])
+    rows = 0
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for chunk in result.partitions():
+            writer.writerows([_cell(value) for value in row] for row in chunk)
+            rows += len(chunk)
+    return rows
+
+
+def _compress(path):
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb', compresslevel=6) as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+
+
+async def write_csv(kind, directory):
+    """Пишет выгрузку `kind` в каталог `directory`; возвращает (путь к файлу, число строк).
+
+    Если файл больше лимита на документ, он сжимается в .csv.gz; не влезает
+    и сжатым — ExportTooLarge.
+    """
+    query = EXPORTS[kind][1]
+    path = os.path.join(directory, f"{kind}_{datetime.now():%Y%m%d_%H%M}.csv")
+    if async_engine.dialect.name == 'postgresql':
+        with open(path, 'wb') as f:
+            f.write('\ufeff'.encode())  # BOM: Excel иначе читает файл как cp1251
+            rows = await _copy_postgres(query, f)
+    else:
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            rows = await _stream(query, f)
+
+    if os.path.getsize(path) > DOCUMENT_MAX_SIZE:
+        await asyncio.to_thread(_compress, path)
+        path += '.gz'
+        if os.path.getsize(path) > DOCUMENT_MAX_SIZE:
+            raise ExportTooLarge(path)
+    return path, rows
@@ -1,3 +1,5 @@
 bind = "0.0.0.0:10000"
+# Один процесс с одним долгоживущим Application; параллельность задает UPDATE_WORKERS
 workers = 1
-timeout = 120
\ No newline at end of file
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
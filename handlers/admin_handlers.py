@@ -1,8 +1,28 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
-from database import SessionLocal, User
-from sqlalchemy.orm import Session
+from database import AsyncSessionLocal, User, PointsTransaction
+from sqlalchemy import select, func, tuple_
+from datetime import datetime, timezone
+import asyncio
+import csv
+import io
+import os
+import secrets
+import tempfile
+import time
+from sqlalchemy.orm.attributes import set_committed_value
 import config
+import exports
+import ledger
+import member_ids
+import member_import
+import outbox
+import receipts
+import router
+import search
+import stats
+import user_cache
 
 
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -13,102 +33,461 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     keyboard = [
-        [InlineKeyboardButton("👥 Список пользователей", callback_data="admin_users")],
-        [InlineKeyboardButton("💰 Начислить баллы", callback_data="admin_add_bonus")],
-        [InlineKeyboardButton("📤 Рассылка", callback_data="broadcast")],
-        [InlineKeyboardButton("🎁 Запросы на списание", callback_data="admin_redemption_requests")]
+        [InlineKeyboardButton("👥 Список пользователей", callback_data=router.callback_data(router.ADMIN_USERS))],
+        [InlineKeyboardButton("💰 Начислить баллы", callback_data=router.callback_data(router.ADMIN_ADD_BONUS))],
+        [InlineKeyboardButton("📄 Чеки из файла", callback_data=router.callback_data(router.ADMIN_RECEIPTS))],
+        [InlineKeyboardButton("📤 Рассылка", callback_data=router.callback_data(router.BROADCAST))],
+        [InlineKeyboardButton("🎁 Запросы на списание", callback_data=router.callback_data(router.ADMIN_REDEMPTIONS))],
+        [InlineKeyboardButton("📊 Статистика", callback_data=router.callback_data(router.ADMIN_STATS))],
+        [InlineKeyboardButton("📦 Выгрузка CSV", callback_data=router.callback_data(router.ADMIN_EXPORT)),
+         InlineKeyboardButton("📥 Загрузка участников", callback_data=router.callback_data(router.ADMIN_IMPORT))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await update.message.reply_text("Панель администратора:", reply_markup=reply_markup)
 
 
-async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+USERS_PAGE_SIZE = 10
+USERS_COUNT_TTL = 60
+
+# Сортировки списка участников: подпись, колонки ключа (последняя — уникальная), по убыванию ли
+USERS_SORTS = {
+    'id': ("по номеру", (User.member_id,), False),
+    'bal': ("по балансу", (User.bonus_balance, User.id), True),
+    'new': ("новые", (User.created_at, User.id), True),
+}
+
+_users_count = {'value': None, 'expires': 0.0}
+
+
+async def count_registered_users(db):
+    # COUNT по всей таблице дорогой, а точное число на каждой странице не нужно
+    now = time.monotonic()
+    if _users_count['value'] is None or now >= _users_count['expires']:
+        _users_count['value'] = await db.scalar(
+            select(func.count()).select_from(User).where(User.registration_complete == True)
+        )
+        _users_count['expires'] = now + USERS_COUNT_TTL
+    return _users_count['value']
+
+
+def _encode_key(value):
+    if isinstance(value, datetime):
+        return str(int(value.replace(tzinfo=timezone.utc).timestamp() * 1000000))
+    return str(value)
+
+
+def _decode_key(column, value):
+    if column is User.created_at:
+        return datetime.fromtimestamp(int(value) / 1000000, timezone.utc).replace(tzinfo=None)
+    return int(value)
+
+
+def _users_callback(sort, direction, row):
+    # <сортировка>:<n|p>:<ключ>... — укладывается в 64 байта callback_data
+    columns = USERS_SORTS[sort][1]
+    return router.callback_data(router.ADMIN_USERS, sort, direction,
+                                *(_encode_key(getattr(row, column.key)) for column in columns))
+
+
+def _parse_users_callback(args):
+    sort = args[0] if args and args[0] in USERS_SORTS else 'id'
+    columns = USERS_SORTS[sort][1]
+    if len(args) != 2 + len(columns) or args[1] not in ('n', 'p'):
+        return sort, 'n', None
+    try:
+        cursor = tuple(_decode_key(column, value) for column, value in zip(columns, args[2:]))
+    except ValueError:
+        return sort, 'n', None
+    return sort, args[1], cursor
+
+
+async def fetch_users_page(db, sort, direction='n', cursor=None):
+    """Страница участников после (n) или до (p) курсора. Возвращает (rows, has_prev, has_next)."""
+    _, columns, descending = USERS_SORTS[sort]
+    forward = direction == 'n'
+    ascending = forward != descending
+    key = tuple_(*columns) if len(columns) > 1 else columns[0]
+
+    query = select(User.id, User.member_id, User.first_name, User.last_name,
+                   User.bonus_balance, User.created_at).where(User.registration_complete == True)
+    if cursor is not None:
+        bound = tuple_(*cursor) if len(columns) > 1 else cursor[0]
+        query = query.where(key > bound if ascending else key < bound)
+    order = [column.asc() if ascending else column.desc() for column in columns]
+    rows = (await db.execute(query.order_by(*order).limit(USERS_PAGE_SIZE + 1))).all()
+
+    more = len(rows) > USERS_PAGE_SIZE
+    rows = rows[:USERS_PAGE_SIZE]
+    if forward:
+        return rows, cursor is not None, more
+    rows.reverse()
+    return rows, more, True
+
+
+async def show_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    action = query.data
+    sort, direction, cursor = _parse_users_callback(context.args)
+
+    async with AsyncSessionLocal() as db:
+        rows, has_prev, has_next = await fetch_users_page(db, sort, direction, cursor)
+        if not rows and cursor is not None:
+            # Страница опустела (участников удалили) — возвращаемся к началу
+            rows, has_prev, has_next = await fetch_users_page(db, sort)
+        total = await count_registered_users(db)
 
-    if action == "admin_users":
-        await show_users_list(query, context)
-    elif action == "admin_add_bonus":
-        await ask_user_for_bonus(query, context)
+    if not rows:
+        await query.edit_message_text("Нет зарегистрированных пользователей.")
+        return
 
+    message = f"Список пользователей ({USERS_SORTS[sort][0]}), всего: {total}\n\n"
+    for row in rows:
+        message += f"ID: {row.member_id} | {row.first_name} {row.last_name} | Баланс: {row.bonus_balance}\n"
 
-async def show_users_list(query, context):
-    db: Session = SessionLocal()
+    sort_buttons = [
+        InlineKeyboardButton(("• " if name == sort else "") + label,
+                             callback_data=router.callback_data(router.ADMIN_USERS, name))
+        for name, (label, _, _) in USERS_SORTS.items()
+    ]
+    nav_buttons = []
+    if has_prev:
+        nav_buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=_users_callback(sort, 'p', rows[0])))
+    if has_next:
+        nav_buttons.append(InlineKeyboardButton("Вперед ▶️", callback_data=_users_callback(sort, 'n', rows[-1])))
 
+    keyboard = [sort_buttons] + ([nav_buttons] if nav_buttons else [])
     try:
-        users = db.query(User).filter(User.registration_complete == True).all()
+        await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+    except BadRequest as e:
+        # Повторное нажатие на текущую сортировку не меняет сообщение
+        if 'not modified' not in str(e):
+            raise
 
-        if not users:
-            await query.edit_message_text("Нет зарегистрированных пользователей.")
-            return
 
-        message = "Список пользователей:\n\n"
-        for user in users[:10]:  # Показываем первых 10
-            message += f"ID: {user.id} | {user.first_name} {user.last_name} | Баланс: {user.bonus_balance}\n"
+async def ask_user_for_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
 
-        if len(users) > 10:
-            message += f"\n... и еще {len(users) - 10} пользователей"
+    router.set_flow(context, router.FLOW_ADD_BONUS)
+    await query.edit_message_text(
+        "Введите номер участника, телефон или фамилию и сумму чека через пробел "
+        "(например: 123 1000, +79161234567 1000 или Иванов 1000):"
+    )
 
-        await query.edit_message_text(message)
 
-    finally:
-        db.close()
+async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in config.ADMIN_IDS:
+        return
 
+    await process_bonus_addition(update, context, update.message.text)
 
-async def ask_user_for_bonus(query, context):
-    context.user_data['admin_action'] = 'add_bonus'
-    await query.edit_message_text("Введите ID пользователя и сумму через пробел (например: 123 1000):")
 
+def _describe(user):
+    return f"ID: {user.member_id} | {user.first_name} {user.last_name} | {user.phone} | Баланс: {user.bonus_balance}"
 
-async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
 
-    if user_id not in config.ADMIN_IDS:
+STATS_DAYS = 7
+
+
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Экран статистики: только счетчики stats, без агрегатов по таблицам."""
+    query = update.callback_query
+    await query.answer()
+
+    async with AsyncSessionLocal() as db:
+        totals, daily = await stats.snapshot(db, STATS_DAYS)
+
+    day = stats.today()
+    current = daily.get(day, {})
+    week = {}
+    for values in daily.values():
+        for name, value in values.items():
+            week[name] = week.get(name, 0) + value
+
+    def accrued(values):
+        return sum(values.get(stats.points_daily(kind), 0) for kind in (ledger.WELCOME, ledger.ACCRUAL))
+
+    def redeemed(values):
+        return -values.get(stats.points_daily(ledger.REDEMPTION), 0)
+
+    message = (
+        f"📊 Статистика на {day:%d.%m.%Y}\n\n"
+        f"Участников: {totals.get(stats.MEMBERS, 0)} (сегодня +{current.get(stats.REGISTRATIONS, 0)})\n"
+        f"Баллов на счетах: {totals.get(stats.POINTS, 0)}\n"
+        f"Ждут списания: {totals.get(stats.PENDING_REDEMPTIONS, 0)}\n\n"
+        f"Сегодня:\n"
+        f"Броней: {current.get(stats.BOOKINGS, 0)}, гостей: {current.get(stats.GUESTS, 0)}\n"
+        f"Начислено баллов: {accrued(current)}, списано: {redeemed(current)}\n"
+        f"Запросов на списание: {current.get(stats.REDEMPTION_REQUESTS, 0)}, "
+        f"подтверждено: {current.get(stats.REDEMPTIONS_APPROVED, 0)}, "
+        f"отклонено: {current.get(stats.REDEMPTIONS_REJECTED, 0)}\n\n"
+        f"За {STATS_DAYS} дней:\n"
+        f"Регистраций: {week.get(stats.REGISTRATIONS, 0)}\n"
+        f"Броней: {week.get(stats.BOOKINGS, 0)}, гостей: {week.get(stats.GUESTS, 0)}\n"
+        f"Начислено баллов: {accrued(week)}, списано: {redeemed(week)}"
+    )
+    keyboard = [[InlineKeyboardButton("🔄 Обновить", callback_data=router.callback_data(router.ADMIN_STATS))]]
+    try:
+        await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+    except BadRequest as e:
+        # Обновление без изменений
+        if 'not modified' not in str(e):
+            raise
+
+
+async def find_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/find <номер, телефон или фамилия> — поиск участника для администратора."""
+    if update.effective_user.id not in config.ADMIN_IDS:
+        await update.message.reply_text("У вас нет доступа к этой команде.")
         return
 
-    text = update.message.text
+    if not context.args:
+        await update.message.reply_text("Использование: /find <номер, телефон или фамилия>")
+        return
 
-    if context.user_data.get('admin_action') == 'add_bonus':
-        await process_bonus_addition(update, context, text)
+    async with AsyncSessionLocal() as db:
+        users = await search.find_users(db, ' '.join(context.args))
+
+    if not users:
+        await update.message.reply_text("Никого не нашлось.")
+        return
+
+    await update.message.reply_text("Найдено:\n\n" + "\n".join(_describe(user) for user in users))
+
+
+BONUS_TOKEN_BYTES = 4
 
 
 async def process_bonus_addition(update, context, text):
+    # Последнее слово — сумма чека, все до него — поисковый запрос
+    parts = text.rsplit(maxsplit=1)
     try:
-        user_id_str, amount_str = text.split()
-        user_id = int(user_id_str)
-        amount = int(amount_str)
+        search_text, amount = parts[0], int(parts[1])
+        if amount <= 0:
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "Неверный формат. Введите номер, телефон или фамилию и сумму через пробел (например: 123 1000)"
+        )
+        return
 
-        db: Session = SessionLocal()
+    async with AsyncSessionLocal() as db:
+        users = await search.find_users(db, search_text)
+
+    if not users:
+        await update.message.reply_text("Пользователь не найден.")
+        return
+
+    if len(users) > 1:
+        # Несколько совпадений: кассир выбирает гостя кнопкой. Метка одна на сообщение и пишется
+        # в журнал: повторное нажатие (двойное или по старой кнопке) второй раз не начислит
+        token = secrets.token_hex(BONUS_TOKEN_BYTES)
+        keyboard = [
+            [InlineKeyboardButton(f"{user.member_id} · {user.first_name} {user.last_name} · {user.phone}",
+                                  callback_data=router.callback_data(router.ADMIN_BONUS_RECIPIENT, user.id, amount,
+                                                                     token))]
+            for user in users
+        ]
+        await update.message.reply_text(f"Кому начислить за чек на {amount}?",
+                                        reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+
+    await update.message.reply_text(await accrue_bonus(context, update.effective_user.id, users[0].id, amount))
 
-        try:
-            user = db.query(User).filter(User.id == user_id).first()
-            if user:
-                bonus_amount = int(amount * 0.05)  # 5% от суммы
-                user.bonus_balance += bonus_amount
-                db.commit()
-
-                # Уведомляем пользователя
-                try:
-                    await context.bot.send_message(
-                        chat_id=user.telegram_id,
-                        text=f"Вам начислено {bonus_amount} бонусных баллов за посещение!\n"
-                             f"Текущий баланс: {user.bonus_balance}"
-                    )
-                except:
-                    pass  # Пользователь заблокировал бота
-
-                await update.message.reply_text(
-                    f"Пользователю {user.first_name} {user.last_name} начислено {bonus_amount} баллов.\n"
-                    f"Новый баланс: {user.bonus_balance}"
-                )
-            else:
-                await update.message.reply_text("Пользователь не найден.")
-
-        finally:
-            db.close()
 
+async def choose_bonus_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    try:
+        user_id, amount, token = context.args
+        user_id, amount = int(user_id), int(amount)
+        if amount <= 0 or not token:
+            raise ValueError
     except ValueError:
-        await update.message.reply_text("Неверный формат. Введите ID и сумму через пробел (например: 123 1000)")
\ No newline at end of file
+        # Кнопка без метки (до ее появления) или испорченная
+        await query.answer(router.STALE_BUTTON)
+        return
+    await query.answer()
+
+    await query.edit_message_text(await accrue_bonus(context, query.from_user.id, user_id, amount, token))
+
+
+async def accrue_bonus(context, admin_id, user_id, amount, token=None):
+    """Начисляет участнику 5% от суммы чека и возвращает ответ для кассира.
+
+    token — метка кнопки выбора гостя: начисление с той же меткой уже в
+    журнале — повторное нажатие, баллы не начисляются.
+    """
+    reference = f"admin:{admin_id}" if token is None else f"admin:{admin_id}:{token}"
+    async with AsyncSessionLocal() as db:
+        # Блокировка строки участника: повторное нажатие ждет первое и видит его запись в журнале
+        user = await db.get(User, user_id, with_for_update=True, execution_options={'prepare': True})
+        if not user or not user.registration_complete:
+            return "Пользователь не найден."
+        if token is not None and await db.scalar(
+                select(PointsTransaction.id).where(PointsTransaction.reference == reference).limit(1)):
+            return "Начисление по этому чеку уже проведено."
+
+        bonus_amount = int(amount * 0.05)  # 5% от суммы
+        balance = await ledger.post(db, user.id, ledger.ACCRUAL, bonus_amount, reference=reference)
+        set_committed_value(user, 'bonus_balance', balance)
+        # Уведомление пользователю сохраняется вместе с начислением;
+        # у загруженного из файла участника Telegram еще нет
+        if user.telegram_id is not None:
+            outbox.enqueue(
+                db,
+                user.telegram_id,
+                f"Вам начислено {bonus_amount} бонусных баллов за посещение!\n"
+                f"Текущий баланс: {user.bonus_balance}"
+            )
+        await db.commit()
+        if user.telegram_id is not None:
+            user_cache.cache.put(user)
+
+    return (f"Пользователю {user.first_name} {user.last_name} начислено {bonus_amount} баллов.\n"
+            f"Новый баланс: {user.bonus_balance}")
+
+
+RECEIPTS_MAX_FILE_SIZE = 20 * 1024 * 1024  # больше Bot API скачать не даст
+RECEIPTS_ERRORS_SHOWN = 20
+
+
+async def ask_receipts_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    router.set_flow(context, router.FLOW_RECEIPTS)
+    await query.edit_message_text(
+        "Отправьте файл CSV или XLSX с чеками. В каждой строке: номер участника или телефон "
+        "и сумма чека (например: 123;1500 или +79161234567;820,50). Начислим 5% от каждого чека."
+    )
+
+
+async def handle_receipts_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in config.ADMIN_IDS:
+        return
+
+    document = update.message.document
+    if document.file_size and document.file_size > RECEIPTS_MAX_FILE_SIZE:
+        await update.message.reply_text("Файл больше 20 МБ, разбейте его на части.")
+        return
+
+    reference = f"receipts:{document.file_unique_id}"
+    suffix = os.path.splitext(document.file_name or '')[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        await (await document.get_file()).download_to_drive(tmp.name)
+        try:
+            # Разбор — работа процессора: не держим цикл событий
+            batch = await asyncio.to_thread(receipts.parse_file, tmp.name, document.file_name)
+        except receipts.ReceiptsError as e:
+            await update.message.reply_text(str(e))
+            return
+
+    async with AsyncSessionLocal() as db:
+        try:
+            credited = await receipts.apply(db, batch, reference)
+        except receipts.AlreadyApplied:
+            await update.message.reply_text("Этот файл уже был загружен, баллы по нему начислены.")
+            return
+        await db.commit()
+
+    for telegram_id, bonus, balance in credited:
+        user_cache.cache.update_balance(telegram_id, balance)
+    router.end_flow(context)
+
+    message = (f"Обработано строк: {batch.total}\n"
+               f"Начислено участникам: {len(credited)}, всего баллов: {sum(bonus for _, bonus, _ in credited)}\n"
+               f"Ошибок: {len(batch.errors)}")
+    if batch.errors:
+        message += "\n\n" + "\n".join(f"Строка {line}: {error}"
+                                       for line, error in batch.errors[:RECEIPTS_ERRORS_SHOWN])
+    await update.message.reply_text(message)
+
+    if len(batch.errors) > RECEIPTS_ERRORS_SHOWN:
+        report = io.StringIO()
+        csv.writer(report, delimiter=';').writerows(batch.errors)
+        await update.message.reply_document(io.BytesIO(report.getvalue().encode('utf-8-sig')),
+                                            filename='receipts_errors.csv', caption="Все ошибки")
+
+
+EXPORT_UPLOAD_TIMEOUT = 300
+
+
+async def export_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    kind = context.args[0] if context.args else None
+    if kind not in exports.EXPORTS:
+        keyboard = [[InlineKeyboardButton(title, callback_data=router.callback_data(router.ADMIN_EXPORT, name))]
+                    for name, (title, _) in exports.EXPORTS.items()]
+        await query.edit_message_text("Что выгрузить в CSV?", reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+
+    title = exports.EXPORTS[kind][0]
+    await query.edit_message_text(f"Готовлю выгрузку «{title}»…")
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            path, rows = await exports.write_csv(kind, directory)
+        except exports.ExportTooLarge:
+            await query.edit_message_text(f"Выгрузка «{title}» больше 50 МБ даже сжатой — выгрузите ее из базы.")
+            return
+        with open(path, 'rb') as f:
+            await query.message.reply_document(f, filename=os.path.basename(path), caption=f"{title}, строк: {rows}",
+                                               write_timeout=EXPORT_UPLOAD_TIMEOUT)
+    await query.edit_message_text(f"Выгрузка «{title}» готова, строк: {rows}.")
+
+
+async def ask_members_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    router.set_flow(context, router.FLOW_MEMBERS_IMPORT)
+    await query.edit_message_text(
+        "Отправьте файл CSV, CSV.GZ или XLSX с участниками. В каждой строке: телефон, имя, фамилия "
+        "и баланс баллов (например: +79161234567;Иван;Иванов;350). Телефоны, которые уже есть в базе, "
+        "пропускаются. Гость получит свои баллы, когда зарегистрируется в боте с тем же телефоном."
+    )
+
+
+async def handle_members_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in config.ADMIN_IDS:
+        return
+
+    document = update.message.document
+    if document.file_size and document.file_size > RECEIPTS_MAX_FILE_SIZE:
+        await update.message.reply_text("Файл больше 20 МБ: сожмите CSV в .csv.gz или разбейте его на части.")
+        return
+
+    suffix = os.path.splitext(document.file_name or '')[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        await (await document.get_file()).download_to_drive(tmp.name)
+        try:
+            result = await member_import.load(tmp.name, document.file_name,
+                                              f"import:{document.file_unique_id}")
+        except receipts.ReceiptsError as e:
+            await update.message.reply_text(str(e))
+            return
+        except member_ids.MemberIdsExhausted:
+            await update.message.reply_text("Свободных номеров участников на всех не хватает, ничего не загружено.")
+            return
+    router.end_flow(context)
+
+    message = (f"Обработано строк: {result.total}\n"
+               f"Загружено участников: {result.created}, баллов на их счетах: {result.points}\n"
+               f"Уже были в базе: {result.existing}, повторы в файле: {result.duplicates}\n"
+               f"Ошибок: {result.error_count}")
+    if result.created:
+        message += f"\nНомера: {result.first_member_id}–{result.first_member_id + result.created - 1}"
+    if result.errors:
+        message += "\n\n" + "\n".join(f"Строка {line}: {error}"
+                                       for line, error in result.errors[:RECEIPTS_ERRORS_SHOWN])
+    await update.message.reply_text(message)
+
+    if result.error_count > RECEIPTS_ERRORS_SHOWN:
+        report = io.StringIO()
+        csv.writer(report, delimiter=';').writerows(result.errors)
+        caption = "Все ошибки" if result.error_count == len(result.errors) else f"Первые {len(result.errors)} ошибок"
+        await update.message.reply_document(io.BytesIO(report.getvalue().encode('utf-8-sig')),
+                                            filename='members_errors.csv', caption=caption)
@@ -1,88 +1,269 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from database import SessionLocal, User, Booking
-from sqlalchemy.orm import Session
+from datetime import datetime
+from sqlalchemy import select
+from database import AsyncSessionLocal, Booking
+import availability
+import config
+import outbox
+import reminders
+import router
+import stats
+import user_cache
+
+
+BOOKING_FORMAT_HINT = (
+    "Пожалуйста, введите дату и количество гостей, при желании — время:\n"
+    "Дата (ДД.ММ.ГГГГ) [Время (ЧЧ:ММ)] Количество гостей\n\n"
+    "Например: 25.12.2024 19:30 4 или 25.12 4"
+)
+SLOTS_SHOWN = 12
+SLOTS_PER_ROW = 4
 
 
 async def start_booking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    context.user_data['booking_step'] = 0
-    await query.edit_message_text(
-        "🎯 Бронирование стола\n\n"
-        "Пожалуйста, введите данные в следующем формате:\n"
-        "Дата (ДД.ММ.ГГГГ) Время (ЧЧ:ММ) Количество гостей\n\n"
-        "Например: 25.12.2024 19:30 4"
-    )
+    router.set_flow(context, router.FLOW_BOOKING)
+    await query.edit_message_text("🎯 Бронирование стола\n\n" + BOOKING_FORMAT_HINT)
+
+
+def parse_booking_request(text, today):
+    """"25.12.2024 19:30 4" -> (дата, время или None, гости); ValueError при неверном формате."""
+    parts = text.split()
+    if len(parts) not in (2, 3):
+        raise ValueError
+    date_str, guests_str = parts[0], parts[-1]
+    if date_str.count('.') == 1:
+        # Без года: ближайшая такая дата
+        day = datetime.strptime(f"{date_str}.{today.year}", '%d.%m.%Y').date()
+        if day < today:
+            day = day.replace(year=today.year + 1)
+    else:
+        day = datetime.strptime(date_str, '%d.%m.%Y').date()
+    booking_time = datetime.strptime(parts[1], '%H:%M').time() if len(parts) == 3 else None
+    guests = int(guests_str)
+    if guests <= 0:
+        raise ValueError
+    return day, booking_time, guests
+
+
+def free_slots_keyboard(day, guests, times):
+    day_key = f"{day:%Y%m%d}"
+    buttons = [
+        InlineKeyboardButton(f"{slot:%H:%M}",
+                             callback_data=router.callback_data(router.BOOK_SLOT, day_key, f"{slot:%H%M}", guests))
+        for slot in times
+    ]
+    return InlineKeyboardMarkup([buttons[i:i + SLOTS_PER_ROW] for i in range(0, len(buttons), SLOTS_PER_ROW)])
+
+
+def _free_slots(day, guests, after=None):
+    current = availability.now()
+    if day == current.date():
+        after = max(after, current.time()) if after else current.time()
+    return availability.availability.free_slots(day, guests, after=after, limit=SLOTS_SHOWN)
 
 
 async def handle_booking_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = update.message.text
 
-    db: Session = SessionLocal()
+    user = await user_cache.get_user(user_id)
+    if not user or not user.registration_complete:
+        await update.message.reply_text("Пожалуйста, завершите регистрацию через /start")
+        return
 
+    # Парсим введенные данные
     try:
-        user = db.query(User).filter(User.telegram_id == user_id, User.registration_complete == True).first()
-        if not user:
-            await update.message.reply_text("Пожалуйста, завершите регистрацию через /start")
+        day, booking_time, guests = parse_booking_request(text, availability.now().date())
+    except ValueError:
+        await update.message.reply_text("Неверный формат. " + BOOKING_FORMAT_HINT)
+        return
+
+    if not availability.bookable(day):
+        await update.message.reply_text(
+            f"Бронируем на даты с сегодняшней и на {config.BOOKING_DAYS_AHEAD} дней вперед. Укажите другую дату."
+        )
+        return
+    if guests > availability.availability.max_guests:
+        await update.message.reply_text(
+            f"Самый большой стол — на {availability.availability.max_guests} гостей. "
+            f"Для большой компании свяжитесь с администратором."
+        )
+        return
+
+    await availability.ensure_day(day)
+
+    current = availability.now()
+    in_past = booking_time is not None and day == current.date() and booking_time < current.time()
+    if booking_time is not None and not in_past:
+        booking = await create_booking(user, day, booking_time, guests)
+        if booking:
+            router.end_flow(context)
+            await update.message.reply_text(booking_confirmation(booking))
             return
 
-        # Парсим введенные данные
-        try:
-            parts = text.split()
-            if len(parts) != 3:
-                raise ValueError
-
-            date_str, time_str, guests_str = parts
-            guests = int(guests_str)
-
-            # Создаем бронирование
-            booking = Booking(
-                user_id=user.id,
-                date=date_str,
-                time=time_str,
-                guests=guests
-            )
+    slots = _free_slots(day, guests, after=booking_time)
+    if not slots and booking_time is not None:
+        slots = _free_slots(day, guests)
+    if not slots:
+        await update.message.reply_text(f"На {day:%d.%m.%Y} для {guests} гостей свободных столов нет. "
+                                        f"Попробуйте другую дату.")
+        return
+
+    # Время занято, в прошлом или не попадает на сетку слотов
+    intro = f"На {booking_time:%H:%M} забронировать нельзя. " if booking_time is not None else ""
+    await update.message.reply_text(
+        f"{intro}Свободное время на {day:%d.%m.%Y} для {guests} гостей:",
+        reply_markup=free_slots_keyboard(day, guests, slots),
+    )
+
+
+async def book_slot(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Нажатие на кнопку свободного слота; context.args: <ГГГГММДД>, <ЧЧММ>, <гости>."""
+    query = update.callback_query
+    try:
+        day_str, time_str, guests_str = context.args
+        day = datetime.strptime(day_str, '%Y%m%d').date()
+        booking_time = datetime.strptime(time_str, '%H%M').time()
+        guests = int(guests_str)
+        if guests <= 0:
+            raise ValueError
+    except ValueError:
+        await query.answer(router.STALE_BUTTON)
+        return
+    await query.answer()
+
+    user = await user_cache.get_user(query.from_user.id)
+    if not user or not user.registration_complete:
+        await query.edit_message_text("Пожалуйста, завершите регистрацию через /start")
+        return
+
+    if not availability.bookable(day):
+        await query.edit_message_text("Эта дата уже недоступна для бронирования.")
+        return
+
+    await availability.ensure_day(day)
+    booking = await create_booking(user, day, booking_time, guests)
+    if booking is None:
+        # Слот заняли, пока пользователь выбирал: показываем актуальные
+        slots = _free_slots(day, guests)
+        await query.edit_message_text(
+            f"{booking_time:%H:%M} уже занято. Свободное время на {day:%d.%m.%Y}:" if slots
+            else f"На {day:%d.%m.%Y} свободных столов не осталось.",
+            reply_markup=free_slots_keyboard(day, guests, slots) if slots else None,
+        )
+        return
+
+    router.end_flow(context)
+    await query.edit_message_text(booking_confirmation(booking))
+
+
+async def create_booking(user, day, booking_time, guests):
+    """Занимает стол в индексе и сохраняет бронь; None, если подходящих столов нет."""
+    seats = availability.availability.reserve(day, booking_time, guests)
+    if seats is None:
+        return None
+
+    # Бронь на ближайшие часы гость только что сделал сам: напоминать и просить подтверждения незачем
+    due = reminders.is_due(day, booking_time)
+    booking = Booking(
+        user_id=user.id,
+        date=f"{day:%d.%m.%Y}",
+        time=f"{booking_time:%H:%M}",
+        booking_date=day,
+        booking_time=booking_time,
+        guests=guests,
+        table_seats=seats,
+        status=reminders.CONFIRMED if due else reminders.PENDING,
+        reminded_at=datetime.utcnow() if due else None,
+    )
+    try:
+        async with AsyncSessionLocal() as db:
             db.add(booking)
-            db.commit()
+            # Уведомление администраторам уходит из outbox после commit
+            notify_admin_about_booking(db, user, booking)
+            stats.add_daily(db, stats.BOOKINGS, day=day)
+            stats.add_daily(db, stats.GUESTS, guests, day=day)
+            await db.commit()
+    except Exception:
+        availability.availability.release(day, booking_time, seats)
+        raise
+    return booking
 
-            # Уведомляем администратора
-            await notify_admin_about_booking(context, user, booking)
 
-            await update.message.reply_text(
-                f"✅ Бронирование принято!\n\n"
-                f"Дата: {date_str}\n"
-                f"Время: {time_str}\n"
-                f"Гости: {guests} чел.\n\n"
-                f"Мы свяжемся с вами для подтверждения."
-            )
+async def reply_to_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка в напоминании о брони; context.args: <yes|no>, <id брони>."""
+    query = update.callback_query
+    try:
+        answer, booking_id = context.args
+        booking_id = int(booking_id)
+        if answer not in ('yes', 'no'):
+            raise ValueError
+    except ValueError:
+        await query.answer(router.STALE_BUTTON)
+        return
+    await query.answer()
+
+    user = await user_cache.get_user(query.from_user.id)
+    if not user:
+        await query.edit_message_text("Пожалуйста, завершите регистрацию через /start")
+        return
 
-        except ValueError:
-            await update.message.reply_text(
-                "Неверный формат. Пожалуйста, введите данные в формате:\n"
-                "Дата Время Количество_гостей\n\n"
-                "Например: 25.12.2024 19:30 4"
+    async with AsyncSessionLocal() as db:
+        booking = await db.scalar(
+            select(Booking).where(Booking.id == booking_id, Booking.user_id == user.id).with_for_update()
+        )
+        if booking is None or booking.status not in availability.ACTIVE_STATUSES:
+            # Повторное нажатие после отмены или бронь уже закрыта
+            await query.edit_message_text("Эта бронь уже неактуальна.")
+            return
+        if answer == 'yes':
+            booking.status = reminders.CONFIRMED
+        else:
+            booking.status = reminders.CANCELLED
+            outbox.notify_admins(
+                db,
+                "❌ Гость отменил бронь\n\n"
+                f"Пользователь: {user.first_name} {user.last_name}\n"
+                f"ID: {user.member_id}\n"
+                f"Телефон: {user.phone}\n"
+                f"Дата: {booking.booking_date:%d.%m.%Y}\n"
+                f"Время: {booking.booking_time:%H:%M}\n"
+                f"Гости: {booking.guests} чел."
             )
+        await db.commit()
+
+    if answer == 'yes':
+        await query.edit_message_text(
+            f"Спасибо! Ждем вас {booking.booking_date:%d.%m.%Y} в {booking.booking_time:%H:%M}."
+        )
+    else:
+        seats = booking.table_seats or availability.availability.seats_for(booking.guests)
+        availability.availability.release(booking.booking_date, booking.booking_time, seats)
+        await query.edit_message_text("Бронь отменена. Будем рады видеть вас в другой раз!")
 
-    finally:
-        db.close()
+
+def booking_confirmation(booking):
+    return (
+        f"✅ Бронирование принято!\n\n"
+        f"Дата: {booking.booking_date:%d.%m.%Y}\n"
+        f"Время: {booking.booking_time:%H:%M}\n"
+        f"Гости: {booking.guests} чел.\n\n"
+        f"Мы свяжемся с вами для подтверждения."
+    )
 
 
-async def notify_admin_about_booking(context, user, booking):
+def notify_admin_about_booking(db, user, booking):
     message = f"🎯 Новое бронирование!\n\n"
     message += f"Пользователь: {user.first_name} {user.last_name}\n"
-    message += f"ID: {user.id}\n"
+    message += f"ID: {user.member_id}\n"
     message += f"Телефон: {user.phone}\n"
-    message += f"Дата: {booking.date}\n"
-    message += f"Время: {booking.time}\n"
-    message += f"Гости: {booking.guests} чел."
+    message += f"Дата: {booking.booking_date:%d.%m.%Y}\n"
+    message += f"Время: {booking.booking_time:%H:%M}\n"
+    message += f"Гости: {booking.guests} чел. (стол на {booking.table_seats})"
 
     # Отправляем всем администраторам
-    from config import ADMIN_IDS
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(chat_id=admin_id, text=message)
-        except:
-            pass
\ No newline at end of file
+    outbox.notify_admins(db, message)
\ No newline at end of file
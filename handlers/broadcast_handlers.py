@@ -1,8 +1,9 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from database import SessionLocal, User
-from sqlalchemy.orm import Session
+from database import AsyncSessionLocal, Broadcast
+import broadcaster
 import config
+import router
 
 
 async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -15,7 +16,7 @@ async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("У вас нет доступа к этой функции.")
         return
 
-    context.user_data['awaiting_broadcast'] = True
+    router.set_flow(context, router.FLOW_BROADCAST)
     await query.edit_message_text(
         "Отправьте сообщение для рассылки (текст, фото или видео):"
     )
@@ -24,40 +25,26 @@ async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_broadcast_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
-    if user_id not in config.ADMIN_IDS or not context.user_data.get('awaiting_broadcast'):
+    if user_id not in config.ADMIN_IDS:
         return
 
-    db: Session = SessionLocal()
-
-    try:
-        users = db.query(User).filter(User.registration_complete == True).all()
-        sent_count = 0
-
-        for user in users:
-            try:
-                if update.message.text:
-                    await context.bot.send_message(
-                        chat_id=user.telegram_id,
-                        text=update.message.text
-                    )
-                elif update.message.photo:
-                    await context.bot.send_photo(
-                        chat_id=user.telegram_id,
-                        photo=update.message.photo[-1].file_id,
-                        caption=update.message.caption
-                    )
-                elif update.message.video:
-                    await context.bot.send_video(
-                        chat_id=user.telegram_id,
-                        video=update.message.video.file_id,
-                        caption=update.message.caption
-                    )
-                sent_count += 1
-            except:
-                continue  # Пользователь заблокировал бота
-
-        await update.message.reply_text(f"Рассылка завершена. Сообщение отправлено {sent_count} пользователям.")
-
-    finally:
-        db.close()
-        context.user_data['awaiting_broadcast'] = False
\ No newline at end of file
+    router.end_flow(context)
+    message = update.message
+
+    if message.photo:
+        broadcast = Broadcast(content_type='photo', file_id=message.photo[-1].file_id, caption=message.caption)
+    elif message.video:
+        broadcast = Broadcast(content_type='video', file_id=message.video.file_id, caption=message.caption)
+    else:
+        broadcast = Broadcast(content_type='text', text=message.text)
+
+    progress = await message.reply_text("Рассылка запущена. Прогресс будет обновляться в этом сообщении.")
+    broadcast.admin_chat_id = message.chat_id
+    broadcast.progress_message_id = progress.message_id
+
+    async with AsyncSessionLocal() as db:
+        db.add(broadcast)
+        await db.commit()
+
+    # Рассылка идет в фоне: обработчик администратора не ждет всех получателей
+    broadcaster.start_job(context.application, broadcast.id)
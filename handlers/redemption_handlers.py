@@ -1,8 +1,13 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
-from database import SessionLocal, User, RedemptionRequest
-from sqlalchemy.orm import Session
+from database import AsyncSessionLocal, RedemptionRequest
 import config
+import outbox
+import redemptions
+import router
+import stats
+import user_cache
 
 
 async def start_redemption(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -10,124 +15,200 @@ async def start_redemption(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     user_id = query.from_user.id
-    db: Session = SessionLocal()
+    user = await user_cache.get_user(user_id)
 
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
-        if user and user.registration_complete:
-            await query.edit_message_text(
-                f"Ваш текущий баланс: {user.bonus_balance} баллов\n\n"
-                "Введите количество баллов для списания:"
-            )
-            context.user_data['awaiting_redemption_amount'] = True
-        else:
-            await query.edit_message_text("Пожалуйста, завершите регистрацию.")
-
-    finally:
-        db.close()
+    if user and user.registration_complete:
+        await query.edit_message_text(
+            f"Ваш текущий баланс: {user.bonus_balance} баллов\n\n"
+            "Введите количество баллов для списания:"
+        )
+        router.set_flow(context, router.FLOW_REDEEM_AMOUNT)
+    else:
+        await query.edit_message_text("Пожалуйста, завершите регистрацию.")
 
 
 async def handle_redemption_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-
-    if context.user_data.get('awaiting_redemption_amount'):
-        try:
-            amount = int(update.message.text)
-            user_id = update.effective_user.id
-
-            db: Session = SessionLocal()
-
-            try:
-                user = db.query(User).filter(User.telegram_id == user_id).first()
-                if user and user.bonus_balance >= amount:
-                    # Создаем запрос на списание
-                    redemption_request = RedemptionRequest(
-                        user_id=user.id,
-                        amount=amount
-                    )
-                    db.add(redemption_request)
-                    db.commit()
-
-                    # Уведомляем администраторов
-                    await notify_admins_about_redemption(context, user, redemption_request)
-
-                    await update.message.reply_text(
-                        f"Запрос на списание {amount} баллов отправлен администратору. "
-                        f"Ожидайте подтверждения."
-                    )
-                else:
-                    await update.message.reply_text("Недостаточно баллов на счете.")
-
-            finally:
-                db.close()
+    try:
+        amount = int(update.message.text)
+        if amount <= 0:
+            raise ValueError
+        user_id = update.effective_user.id
+
+        user = await user_cache.get_user(user_id)
+        if user and user.bonus_balance >= amount:
+            # Создаем запрос на списание
+            redemption_request = RedemptionRequest(
+                user_id=user.id,
+                amount=amount
+            )
+            async with AsyncSessionLocal() as db:
+                db.add(redemption_request)
+                await db.flush()
+                # Уведомляем администраторов (outbox, в той же транзакции)
+                notify_admins_about_redemption(db, user, redemption_request)
+                stats.add(db, stats.PENDING_REDEMPTIONS)
+                stats.add_daily(db, stats.REDEMPTION_REQUESTS)
+                await db.commit()
+
+            await update.message.reply_text(
+                f"Запрос на списание {amount} баллов отправлен администратору. "
+                f"Ожидайте подтверждения."
+            )
+        else:
+            await update.message.reply_text("Недостаточно баллов на счете.")
 
-        except ValueError:
-            await update.message.reply_text("Пожалуйста, введите число.")
+    except ValueError:
+        await update.message.reply_text("Пожалуйста, введите положительное число.")
 
-        context.user_data['awaiting_redemption_amount'] = False
+    router.end_flow(context)
 
 
-async def notify_admins_about_redemption(context, user, redemption_request):
+def notify_admins_about_redemption(db, user, redemption_request):
     message = f"🎁 Запрос на списание баллов!\n\n"
     message += f"Пользователь: {user.first_name} {user.last_name}\n"
-    message += f"ID: {user.id}\n"
+    message += f"ID: {user.member_id}\n"
     message += f"Телефон: {user.phone}\n"
     message += f"Сумма: {redemption_request.amount} баллов\n"
     message += f"Текущий баланс: {user.bonus_balance}"
 
+    request_id = redemption_request.id
     keyboard = [
         [
-            InlineKeyboardButton("✅ Подтвердить", callback_data=f"admin_redeem_confirm_{redemption_request.id}"),
-            InlineKeyboardButton("❌ Отклонить", callback_data=f"admin_redeem_reject_{redemption_request.id}")
+            InlineKeyboardButton("✅ Подтвердить", callback_data=router.callback_data(router.REDEMPTION_DECISION, 'ok', request_id)),
+            InlineKeyboardButton("❌ Отклонить", callback_data=router.callback_data(router.REDEMPTION_DECISION, 'no', request_id))
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    for admin_id in config.ADMIN_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=message,
-                reply_markup=reply_markup
-            )
-        except:
-            pass
+    outbox.notify_admins(db, message, reply_markup)
 
 
 async def handle_admin_redemption(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    try:
+        action, request_id = context.args
+        request_id = int(request_id)
+        if action not in ('ok', 'no'):
+            raise ValueError
+    except ValueError:
+        await query.answer(router.STALE_BUTTON)
+        return
     await query.answer()
 
-    action, request_id = query.data.split('_')[2], int(query.data.split('_')[3])
+    if query.from_user.id not in config.ADMIN_IDS:
+        return
 
-    db: Session = SessionLocal()
+    async with AsyncSessionLocal() as db:
+        result = await redemptions.decide(db, [request_id], action == 'ok', query.from_user.id)
+        await db.commit()
+    _update_cached_balances(result)
+
+    if result['skipped']:
+        # Повторное нажатие или другой администратор успел раньше
+        await query.edit_message_text("Этот запрос уже обработан.")
+    elif result['approved']:
+        await query.edit_message_text("Списание подтверждено. Пользователь уведомлен.")
+    elif result['insufficient']:
+        await query.edit_message_text("Списание отклонено: у пользователя недостаточно баллов.")
+    else:
+        await query.edit_message_text("Списание отклонено.")
+
+
+def _update_cached_balances(result):
+    for _, telegram_id, balance in result['approved']:
+        user_cache.cache.update_balance(telegram_id, balance)
+
+
+QUEUE_ACTIONS = ('p', 't', 'all', 'ok', 'no')
+
+
+def _queue_callback(action, cursor, request_id=None):
+    args = (action, cursor) if request_id is None else (action, cursor, request_id)
+    return router.callback_data(router.ADMIN_REDEMPTIONS, *args)
+
+
+async def show_redemption_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Очередь ожидающих запросов с отметками; context.args: <действие>, <курсор>[, <id запроса>].
+
+    Курсор — id запроса, после которого начинается страница (0 — первая).
+    Отмеченные запросы хранятся в user_data и сохраняются при листании.
+    """
+    query = update.callback_query
+    args = context.args
+    try:
+        # Без аргументов — кнопка «Запросы на списание» в меню: первая страница
+        action, cursor = (args[0], int(args[1])) if args else ('p', 0)
+        toggled = int(args[2]) if action == 't' else None
+        if action not in QUEUE_ACTIONS or cursor < 0:
+            raise ValueError
+    except (IndexError, ValueError):
+        await query.answer(router.STALE_BUTTON)
+        return
+    await query.answer()
+
+    selected = set(context.user_data.get('redemption_selected', [])) if args else set()
+    notice = ""
+
+    async with AsyncSessionLocal() as db:
+        if action == 't':
+            selected ^= {toggled}
+        elif action in ('ok', 'no') and not selected:
+            notice = "Сначала отметьте запросы."
+        elif action in ('ok', 'no'):
+            result = await redemptions.decide(db, sorted(selected), action == 'ok', query.from_user.id)
+            await db.commit()
+            _update_cached_balances(result)
+            selected = set()
+            notice = (f"Подтверждено: {len(result['approved'])}, отклонено: "
+                      f"{len(result['rejected']) + len(result['insufficient'])}")
+            if result['insufficient']:
+                notice += f" (из них без баллов: {len(result['insufficient'])})"
+            if result['skipped']:
+                notice += f", уже обработаны ранее: {len(result['skipped'])}"
+
+        rows, has_next = await redemptions.pending_page(db, cursor)
+        if not rows and cursor:
+            # Страница опустела после решения — возвращаемся к началу
+            cursor = 0
+            rows, has_next = await redemptions.pending_page(db)
+        if action == 'all':
+            selected |= {row.id for row in rows}
+        total = await redemptions.count_pending(db)
+
+    context.user_data['redemption_selected'] = sorted(selected)
+
+    message = f"🎁 Запросы на списание (ожидают: {total})\nОтмечено: {len(selected)}"
+    if notice:
+        message += f"\n\n{notice}"
+    if not rows:
+        message += "\n\nОжидающих запросов нет."
+
+    keyboard = [
+        [InlineKeyboardButton(
+            f"{'☑️' if row.id in selected else '⬜'} #{row.id} · {row.member_id} {row.first_name} {row.last_name} · "
+            f"{row.amount} (баланс {row.bonus_balance})",
+            callback_data=_queue_callback('t', cursor, row.id),
+        )]
+        for row in rows
+    ]
+    navigation = []
+    if cursor:
+        navigation.append(InlineKeyboardButton("⏮ В начало", callback_data=_queue_callback('p', 0)))
+    if rows:
+        navigation.append(InlineKeyboardButton("Отметить все", callback_data=_queue_callback('all', cursor)))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Далее ▶️", callback_data=_queue_callback('p', rows[-1].id)))
+    if navigation:
+        keyboard.append(navigation)
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Подтвердить ({len(selected)})", callback_data=_queue_callback('ok', cursor)),
+            InlineKeyboardButton(f"❌ Отклонить ({len(selected)})", callback_data=_queue_callback('no', cursor)),
+        ])
 
     try:
-        redemption_request = db.query(RedemptionRequest).filter(RedemptionRequest.id == request_id).first()
-        if redemption_request:
-            user = db.query(User).filter(User.id == redemption_request.user_id).first()
-
-            if action == 'confirm' and user.bonus_balance >= redemption_request.amount:
-                user.bonus_balance -= redemption_request.amount
-                redemption_request.status = 'approved'
-                db.commit()
-
-                # Уведомляем пользователя
-                try:
-                    await context.bot.send_message(
-                        chat_id=user.telegram_id,
-                        text=f"С вашего счета списано {redemption_request.amount} бонусных баллов.\n"
-                             f"Новый баланс: {user.bonus_balance}"
-                    )
-                except:
-                    pass
-
-                await query.edit_message_text(f"Списание подтверждено. Пользователь уведомлен.")
-            else:
-                redemption_request.status = 'rejected'
-                db.commit()
-                await query.edit_message_text("Списание отклонено.")
-
-    finally:
-        db.close()
\ No newline at end of file
+        await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+    except BadRequest as e:
+        # Повторное нажатие, которое ничего не изменило
+        if 'not modified' not in str(e):
+            raise
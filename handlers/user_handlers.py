@@ -1,57 +1,76 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup,
+                      ReplyKeyboardRemove)
 from telegram.ext import ContextTypes, ConversationHandler
-from database import SessionLocal, User
-from sqlalchemy.orm import Session
-import config
+from database import AsyncSessionLocal, User
+from sqlalchemy import select
+from sqlalchemy.orm.attributes import set_committed_value
+import ledger
+import member_ids
+import member_import
+import router
+import stats
+import user_cache
 
 REGISTRATION = range(1)
+WELCOME_BONUS = 100
+PHONE_STEP = 2
 
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    db: Session = SessionLocal()
+def phone_keyboard():
+    # Контакт приходит от Telegram с user_id отправителя: так телефон подтвержден
+    return ReplyKeyboardMarkup([[KeyboardButton("📱 Отправить мой номер", request_contact=True)]],
+                               resize_keyboard=True, one_time_keyboard=True)
 
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
 
-        if user and user.registration_complete:
-            # Пользователь уже зарегистрирован
-            keyboard = [
-                [InlineKeyboardButton("💰 Мой баланс", callback_data="balance")],
-                [InlineKeyboardButton("🎯 Забронировать стол", callback_data="booking")],
-                [InlineKeyboardButton("🎁 Списать баллы", callback_data="redeem_bonus")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
-                f"Добро пожаловать, {user.first_name}!",
-                reply_markup=reply_markup
-            )
-        elif user and not user.registration_complete:
-            # Пользователь в процессе регистрации
-            await update.message.reply_text("Пожалуйста, завершите регистрацию.")
-            await ask_registration_data(update, context)
-        else:
-            # Новый пользователь
+def main_menu():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("💰 Мой баланс", callback_data=router.callback_data(router.BALANCE))],
+        [InlineKeyboardButton("🎯 Забронировать стол", callback_data=router.callback_data(router.BOOKING))],
+        [InlineKeyboardButton("🎁 Списать баллы", callback_data=router.callback_data(router.REDEEM))]
+    ])
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user = await user_cache.get_user(user_id)
+
+    if user and user.registration_complete:
+        # Пользователь уже зарегистрирован
+        await update.message.reply_text(
+            f"Добро пожаловать, {user.first_name}!",
+            reply_markup=main_menu()
+        )
+    elif user and not user.registration_complete:
+        # Пользователь в процессе регистрации
+        context.user_data.setdefault('registration_step', 0)
+        router.set_flow(context, router.FLOW_REGISTRATION)
+        await update.message.reply_text("Пожалуйста, завершите регистрацию.")
+        await ask_registration_data(update, context)
+    else:
+        # Новый пользователь
+        async with AsyncSessionLocal() as db:
             user = User(telegram_id=user_id)
             db.add(user)
-            db.commit()
+            await db.commit()
+            user_cache.cache.put(user)
 
-            context.user_data['registration_step'] = 0
-            await update.message.reply_text(
-                "Добро пожаловать! Для регистрации в системе лояльности нам нужны ваши данные."
-            )
-            await ask_registration_data(update, context)
-
-    finally:
-        db.close()
+        context.user_data['registration_step'] = 0
+        router.set_flow(context, router.FLOW_REGISTRATION)
+        await update.message.reply_text(
+            "Добро пожаловать! Для регистрации в системе лояльности нам нужны ваши данные."
+        )
+        await ask_registration_data(update, context)
 
 
 async def ask_registration_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    steps = ["Введите ваше имя:", "Введите вашу фамилию:", "Введите ваш номер телефона:"]
+    steps = ["Введите ваше имя:", "Введите вашу фамилию:",
+             "Отправьте ваш номер телефона кнопкой ниже или введите его:"]
     current_step = context.user_data.get('registration_step', 0)
 
     if current_step < len(steps):
-        await update.message.reply_text(steps[current_step])
+        await update.effective_message.reply_text(
+            steps[current_step], reply_markup=phone_keyboard() if current_step == PHONE_STEP else None
+        )
         return REGISTRATION
     else:
         await show_registration_summary(update, context)
@@ -60,15 +79,27 @@ async def ask_registration_data(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def handle_registration_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     current_step = context.user_data.get('registration_step', 0)
-    text = update.message.text
+    message = update.message
+    text = message.text
 
-    if current_step == 0:
+    if message.contact is not None:
+        # Чужой контакт (пересланный или выбранный из адресной книги) номер не подтверждает
+        if current_step != PHONE_STEP or message.contact.user_id != update.effective_user.id:
+            await message.reply_text("Отправьте свой номер кнопкой «📱 Отправить мой номер».")
+            await ask_registration_data(update, context)
+            return
+        context.user_data['phone'] = message.contact.phone_number
+        context.user_data['phone_verified'] = True
+    elif current_step == 0:
         context.user_data['first_name'] = text
     elif current_step == 1:
         context.user_data['last_name'] = text
-    elif current_step == 2:
+    elif current_step == PHONE_STEP:
         context.user_data['phone'] = text
+        context.user_data['phone_verified'] = False
 
+    if current_step == PHONE_STEP:
+        await message.reply_text("Номер телефона получен.", reply_markup=ReplyKeyboardRemove())
     context.user_data['registration_step'] = current_step + 1
     await ask_registration_data(update, context)
 
@@ -76,8 +107,8 @@ async def handle_registration_data(update: Update, context: ContextTypes.DEFAULT
 async def show_registration_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [
-            InlineKeyboardButton("✅ Подтвердить", callback_data="confirm_registration"),
-            InlineKeyboardButton("✏️ Исправить", callback_data="edit_registration")
+            InlineKeyboardButton("✅ Подтвердить", callback_data=router.callback_data(router.CONFIRM_REGISTRATION)),
+            InlineKeyboardButton("✏️ Исправить", callback_data=router.callback_data(router.EDIT_REGISTRATION))
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -87,7 +118,7 @@ async def show_registration_summary(update: Update, context: ContextTypes.DEFAUL
     summary += f"Фамилия: {context.user_data.get('last_name', '')}\n"
     summary += f"Телефон: {context.user_data.get('phone', '')}"
 
-    await update.message.reply_text(summary, reply_markup=reply_markup)
+    await update.effective_message.reply_text(summary, reply_markup=reply_markup)
 
 
 async def handle_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -95,85 +126,88 @@ async def handle_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()
 
     user_id = query.from_user.id
-    db: Session = SessionLocal()
 
-    try:
-        user = db.query(User).filter(User.telegram_id == user_id).first()
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).where(User.telegram_id == user_id).with_for_update())
+        if user and user.registration_complete:
+            # Повторное нажатие «Подтвердить»: номер и приветственные баллы уже выданы
+            router.end_flow(context)
+            await query.edit_message_text(f"Вы уже зарегистрированы. Ваш ID: {user.member_id}")
+            return
         if user:
             user.first_name = context.user_data.get('first_name')
             user.last_name = context.user_data.get('last_name')
             user.phone = context.user_data.get('phone')
-            user.bonus_balance = 100  # Приветственные баллы
             user.registration_complete = True
 
-            # Генерация ID (от 1 до 3000)
-            max_id_user = db.query(User).filter(User.id.between(1, 3000)).order_by(User.id.desc()).first()
-            new_id = 1 if not max_id_user else max_id_user.id + 1
-            if new_id > 3000:
-                # Найти свободный ID
-                used_ids = {u.id for u in db.query(User.id).filter(User.id.between(1, 3000)).all()}
-                new_id = next(i for i in range(1, 3001) if i not in used_ids)
-
-            user.id = new_id
-            db.commit()
-
-            keyboard = [
-                [InlineKeyboardButton("💰 Мой баланс", callback_data="balance")],
-                [InlineKeyboardButton("🎯 Забронировать стол", callback_data="booking")],
-                [InlineKeyboardButton("🎁 Списать баллы", callback_data="redeem_bonus")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # Гость уже есть в загруженной базе: Telegram привязывается к его номеру и баллам,
+            # только если телефон подтвержден контактом — набранный номер мог быть чужим
+            if context.user_data.get('phone_verified'):
+                member = await member_import.claim(db, user)
+            else:
+                member = None
+                if await member_import.find_unclaimed(db, user.phone_normalized) is not None:
+                    await db.rollback()
+                    context.user_data['registration_step'] = PHONE_STEP
+                    router.set_flow(context, router.FLOW_REGISTRATION)
+                    await query.edit_message_text(
+                        "Этот номер уже есть в базе участников. Чтобы получить вашу карту и баллы, "
+                        "подтвердите номер кнопкой «📱 Отправить мой номер»."
+                    )
+                    await ask_registration_data(update, context)
+                    return
+            if member is not None:
+                await db.commit()
+                user_cache.cache.put(member)
+                context.user_data.pop('registration_step', None)
+                context.user_data.pop('phone_verified', None)
+                router.end_flow(context)
+                await query.edit_message_text(
+                    f"Мы нашли вашу карту участника! Ваш ID: {member.member_id}\n"
+                    f"Баланс: {member.bonus_balance} бонусных баллов",
+                    reply_markup=main_menu()
+                )
+                return
+
+            # Короткий номер участника (от 1 до MEMBER_ID_MAX), отдельно от первичного ключа
+            try:
+                user.member_id = await member_ids.allocate(db)
+            except member_ids.MemberIdsExhausted:
+                await db.rollback()
+                await query.edit_message_text(
+                    "К сожалению, свободные номера участников закончились. Обратитесь к администратору."
+                )
+                return
+
+            # Приветственные баллы
+            balance = await ledger.post(db, user.id, ledger.WELCOME, WELCOME_BONUS)
+            set_committed_value(user, 'bonus_balance', balance)
+            stats.add(db, stats.MEMBERS)
+            stats.add_daily(db, stats.REGISTRATIONS)
+
+            await db.commit()
+            user_cache.cache.put(user)
+            context.user_data.pop('registration_step', None)
+            context.user_data.pop('phone_verified', None)
+            router.end_flow(context)
 
             await query.edit_message_text(
-                f"Благодарим за регистрацию! Вам начислено 100 бонусных баллов.\n"
-                f"Ваш ID: {new_id}\n\n"
+                f"Благодарим за регистрацию! Вам начислено {WELCOME_BONUS} бонусных баллов.\n"
+                f"Ваш ID: {user.member_id}\n\n"
                 f"Имя: {user.first_name}\n"
                 f"Фамилия: {user.last_name}\n"
                 f"Телефон: {user.phone}",
-                reply_markup=reply_markup
+                reply_markup=main_menu()
             )
 
-    finally:
-        db.close()
-
 
 async def edit_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     context.user_data['registration_step'] = 0
+    context.user_data.pop('phone_verified', None)
+    router.set_flow(context, router.FLOW_REGISTRATION)
     await query.edit_message_text("Давайте начнем регистрацию заново.")
     await ask_registration_data(update, context)
 
-    async def handle_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик всех текстовых сообщений"""
-        user_id = update.effective_user.id
-
-        # Проверяем, ожидаем ли мы ввод данных для регистрации
-        if context.user_data.get('registration_step') is not None:
-            await handle_registration_data(update, context)
-        # Проверяем, ожидаем ли мы ввод суммы для списания
-        elif context.user_data.get('awaiting_redemption_amount'):
-            await redemption_handlers.handle_redemption_confirmation(update, context)
-        # Проверяем, ожидаем ли мы ввод данных для бронирования
-        elif context.user_data.get('awaiting_booking_data'):
-            await booking_handlers.handle_booking_data(update, context)
-        else:
-            await update.message.reply_text("Используйте кнопки меню для навигации.")
-
-
-async def handle_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик всех текстовых сообщений"""
-    user_id = update.effective_user.id
-
-    # Проверяем, ожидаем ли мы ввод данных для регистрации
-    if context.user_data.get('registration_step') is not None:
-        await handle_registration_data(update, context)
-    # Проверяем, ожидаем ли мы ввод суммы для списания
-    elif context.user_data.get('awaiting_redemption_amount'):
-        await redemption_handlers.handle_redemption_confirmation(update, context)
-    # Проверяем, ожидаем ли мы ввод данных для бронирования
-    elif context.user_data.get('awaiting_booking_data'):
-        await booking_handlers.handle_booking_data(update, context)
-    else:
-        await update.message.reply_text("Используйте кнопки меню для навигации.")
\ No newline at end of file
@@ -0,0 +1,170 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import select, update, insert, func, literal, values, column, bindparam, Integer
+
+import stats
+from database import AsyncSessionLocal, User, PointsTransaction
+
+logger = logging.getLogger(__name__)
+
+WELCOME = 'welcome'
+ACCRUAL = 'accrual'
+REDEMPTION = 'redemption'
+ADJUSTMENT = 'adjustment'
+
+BULK_CHUNK_SIZE = 1000
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+async def post(db, user_id, kind, amount, reference=None):
+    """Меняет баланс на `amount` и добавляет запись в журнал в транзакции `db`.
+
+    Возвращает новый баланс. Баланс меняется атомарно в самой БД
+    (bonus_balance = bonus_balance + amount), поэтому одновременные операции
+    над одним пользователем не теряют друг друга. Списание, после которого
+    баланс стал бы отрицательным, не выполняется: InsufficientBalance.
+    """
+    balance = func.coalesce(User.bonus_balance, 0)
+    changed = (
+        update(User)
+        .where(User.id == user_id, balance + amount >= 0)
+        .values(bonus_balance=balance + amount)
+        .returning(User.id, User.bonus_balance)
+    )
+    now = datetime.utcnow()
+
+    if db.bind.dialect.name == 'postgresql':
+        # Одно выражение: UPDATE в CTE и INSERT записи журнала по его результату
+        changed = changed.cte('changed')
+        statement = (
+            insert(PointsTransaction)
+            .from_select(
+                ['user_id', 'kind', 'amount', 'balance_after', 'reference', 'created_at'],
+                select(changed.c.id, literal(kind), literal(amount), changed.c.bonus_balance,
+                       literal(reference), literal(now)),
+            )
+            .returning(PointsTransaction.balance_after)
+            .execution_options(prepare=True)
+        )
+        new_balance = await db.scalar(statement)
+    else:
+        # SQLite не умеет изменяющие CTE: два выражения в одной транзакции
+        row = (await db.execute(changed)).first()
+        new_balance = row.bonus_balance if row else None
+        if new_balance is not None:
+            await db.execute(insert(PointsTransaction).values(
+                user_id=user_id, kind=kind, amount=amount, balance_after=new_balance,
+                reference=reference, created_at=now,
+            ))
+
+    if new_balance is None:
+        raise InsufficientBalance(f"Недостаточно баллов у пользователя {user_id} для операции {amount}")
+    stats.add(db, stats.POINTS, amount)
+    stats.add_daily(db, stats.points_daily(kind), amount)
+    return new_balance
+
+
+async def post_many(db, kind, amounts, reference=None):
+    """Начисляет сразу многим пользователям в транзакции `db`: amounts — {user_id: amount >= 0}.
+
+    Строки пользователей блокируются по возрастанию id, балансы меняются
+    одним UPDATE на порцию, записи журнала вставляются одним пакетом.
+    Возвращает {user_id: новый баланс} для найденных пользователей.
+    """
+    balances = {}
+    user_ids = sorted(amounts)
+    now = datetime.utcnow()
+    users = User.__table__
+
+    for start in range(0, len(user_ids), BULK_CHUNK_SIZE):
+        chunk = user_ids[start:start + BULK_CHUNK_SIZE]
+        if db.bind.dialect.name == 'postgresql':
+            # Порядок блокировок одинаков во всех транзакциях: без взаимных блокировок
+            await db.execute(select(users.c.id).where(users.c.id.in_(chunk)).order_by(users.c.id).with_for_update())
+            changes = values(column('id', Integer), column('amount', Integer), name='changes').data(
+                [(user_id, amounts[user_id]) for user_id in chunk]
+            )
+            rows = await db.execute(
+                update(users)
+                .where(users.c.id == changes.c.id)
+                .values(bonus_balance=func.coalesce(users.c.bonus_balance, 0) + changes.c.amount)
+                .returning(users.c.id, users.c.bonus_balance)
+            )
+        else:
+            # SQLite: пакетный UPDATE (запись и так сериализована) и чтение итогов
+            await db.execute(
+                update(users)
+                .where(users.c.id == bindparam('user_id'))
+                .values(bonus_balance=func.coalesce(users.c.bonus_balance, 0) + bindparam('amount')),
+                [{'user_id': user_id, 'amount': amounts[user_id]} for user_id in chunk],
+            )
+            rows = await db.execute(select(users.c.id, users.c.bonus_balance).where(users.c.id.in_(chunk)))
+        balances.update(rows.all())
+
+    if balances:
+        total = sum(amounts[user_id] for user_id in balances)
+        stats.add(db, stats.POINTS, total)
+        stats.add_daily(db, stats.points_daily(kind), total)
+        await db.execute(insert(PointsTransaction), [
+            {'user_id': user_id, 'kind': kind, 'amount': amounts[user_id], 'balance_after': balance,
+             'reference': reference, 'created_at': now}
+            for user_id, balance in balances.items()
+        ])
+    return balances
+
+
+async def history(db, user_id, before_id=None, limit=10):
+    """Страница журнала пользователя от новых к старым; следующая страница — before_id=последний id."""
+    query = select(PointsTransaction).where(PointsTransaction.user_id == user_id)
+    if before_id is not None:
+        query = query.where(PointsTransaction.id < before_id)
+    query = query.order_by(PointsTransaction.id.desc()).limit(limit).execution_options(prepare=True)
+    return (await db.scalars(query)).all()
+
+
+async def reconcile():
+    """Сверяет users.bonus_balance с суммами журнала одним агрегирующим запросом.
+
+    Пользователям без единой записи (балансы до появления журнала) добавляется
+    открывающая запись adjustment. Расхождения у остальных только логируются.
+    """
+    ledger = (
+        select(PointsTransaction.user_id, func.sum(PointsTransaction.amount).label('total'),
+               func.count(PointsTransaction.id).label('entries'))
+        .group_by(PointsTransaction.user_id)
+        .subquery()
+    )
+    balance = func.coalesce(User.bonus_balance, 0)
+    total = func.coalesce(ledger.c.total, 0)
+
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(User.id, balance.label('balance'), total.label('total'), ledger.c.entries)
+            .outerjoin(ledger, ledger.c.user_id == User.id)
+            .where(balance != total)
+        )).all()
+
+        opening = [row for row in rows if not row.entries]
+        mismatched = [row for row in rows if row.entries]
+        if opening:
+            now = datetime.utcnow()
+            await db.execute(insert(PointsTransaction), [
+                {'user_id': row.id, 'kind': ADJUSTMENT, 'amount': row.balance, 'balance_after': row.balance,
+                 'reference': 'opening', 'created_at': now}
+                for row in opening
+            ])
+            await db.commit()
+
+    for row in mismatched:
+        logger.error("Баланс пользователя %s (%s) не совпадает с журналом (%s)", row.id, row.balance, row.total)
+    return {'opened': len(opening), 'mismatched': len(mismatched)}
+
+
+async def reconcile_job(context):
+    result = await reconcile()
+    if result['opened'] or result['mismatched']:
+        logger.info("Сверка журнала баллов: %s", result)
@@ -1,7 +1,25 @@
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, \
+    ChatMemberHandler, TypeHandler
+from telegram import Update
 import config
+import commands
 from handlers import user_handlers, admin_handlers, booking_handlers, broadcast_handlers, redemption_handlers
 from database import init_db
+import availability
+import broadcaster
+import delivery
+import ledger
+import metrics
+import outbox
+import reminders
+import router
+import stats
+import throttle
+from update_processor import PerUserUpdateProcessor
+from persistence import SQLPersistence
+from ratelimit import SendGateway
+from router import Router
+import functools
 import logging
 
 # Настройка логирования
@@ -11,37 +29,125 @@ logging.basicConfig(
 )
 
 
-def main():
-    # Инициализация базы данных
-    init_db()
+async def post_init(application):
+    await delivery.load_unreachable()
+    await availability.preload()
+    await broadcaster.resume_broadcasts(application)
+    outbox.start(application)
 
-    # Создание приложения
-    application = Application.builder().token(config.BOT_TOKEN).build()
 
-    # Регистрация обработчиков пользователя
-    application.add_handler(CommandHandler("start", user_handlers.start))
-    application.add_handler(CommandHandler("balance", user_handlers.balance))
+async def post_shutdown(application):
+    await broadcaster.stop_broadcasts(application)
+    await outbox.stop(application)
+
+
+def build_router():
+    routes = Router()
+
+    # Кнопки пользователя
+    routes.callback(router.CONFIRM_REGISTRATION, user_handlers.handle_registration)
+    routes.callback(router.EDIT_REGISTRATION, user_handlers.edit_registration)
+    routes.callback(router.BALANCE, commands.balance)
+    routes.callback(router.BOOKING, booking_handlers.start_booking)
+    routes.callback(router.BOOK_SLOT, booking_handlers.book_slot)
+    routes.callback(router.BOOKING_REPLY, booking_handlers.reply_to_reminder)
+    routes.callback(router.REDEEM, redemption_handlers.start_redemption)
+
+    # Кнопки администратора
+    routes.callback(router.REDEMPTION_DECISION, redemption_handlers.handle_admin_redemption, admin=True)
+    routes.callback(router.ADMIN_REDEMPTIONS, redemption_handlers.show_redemption_queue, admin=True)
+    routes.callback(router.ADMIN_USERS, admin_handlers.show_users_list, admin=True)
+    routes.callback(router.ADMIN_ADD_BONUS, admin_handlers.ask_user_for_bonus, admin=True)
+    routes.callback(router.ADMIN_BONUS_RECIPIENT, admin_handlers.choose_bonus_recipient, admin=True)
+    routes.callback(router.ADMIN_RECEIPTS, admin_handlers.ask_receipts_file, admin=True)
+    routes.callback(router.ADMIN_STATS, admin_handlers.show_stats, admin=True)
+    routes.callback(router.ADMIN_EXPORT, admin_handlers.export_csv, admin=True)
+    routes.callback(router.ADMIN_IMPORT, admin_handlers.ask_members_file, admin=True)
+    routes.callback(router.BROADCAST, broadcast_handlers.start_broadcast, admin=True)
+
+    # Ввод в диалогах
+    routes.flow(router.FLOW_REGISTRATION, user_handlers.handle_registration_data, kinds=('text', 'contact'))
+    routes.flow(router.FLOW_REDEEM_AMOUNT, redemption_handlers.handle_redemption_confirmation)
+    routes.flow(router.FLOW_BOOKING, booking_handlers.handle_booking_data)
+    routes.flow(router.FLOW_ADD_BONUS, admin_handlers.handle_admin_input, admin=True)
+    routes.flow(router.FLOW_RECEIPTS, admin_handlers.handle_receipts_document, admin=True, kinds=('document',))
+    routes.flow(router.FLOW_MEMBERS_IMPORT, admin_handlers.handle_members_document, admin=True,
+                kinds=('document',))
+    routes.flow(router.FLOW_BROADCAST, broadcast_handlers.handle_broadcast_content, admin=True,
+                kinds=('text', 'photo', 'video'))
+    return routes
+
 
-    # Обработчики регистрации
-    application.add_handler(CallbackQueryHandler(user_handlers.handle_registration, pattern="^confirm_registration$"))
-    application.add_handler(CallbackQueryHandler(user_handlers.edit_registration, pattern="^edit_registration$"))
+def build_application(builder=None):
+    """Создает Application со всеми обработчиками; используется и polling, и вебхуком."""
+    if builder is None:
+        builder = (
+            Application.builder()
+            .token(config.BOT_TOKEN)
+            .base_url(f"{config.TELEGRAM_API_URL}/bot")
+            .base_file_url(f"{config.TELEGRAM_API_URL}/file/bot")
+            # Один пул соединений на все вызовы; отправки ждут в SendGateway, а не в пуле
+            .connection_pool_size(config.TELEGRAM_POOL_SIZE)
+            .pool_timeout(config.TELEGRAM_POOL_TIMEOUT)
+        )
 
-    # Обработчики бронирования
-    application.add_handler(CallbackQueryHandler(booking_handlers.start_booking, pattern="^booking$"))
+    application = (
+        builder
+        .concurrent_updates(PerUserUpdateProcessor(config.UPDATE_WORKERS))
+        .rate_limiter(SendGateway(
+            config.TELEGRAM_RATE, config.TELEGRAM_CHAT_RATE, config.TELEGRAM_CHAT_BURST, config.TELEGRAM_GROUP_RATE,
+            max_retries=config.TELEGRAM_MAX_RETRIES, max_interactive_wait=config.TELEGRAM_MAX_RETRY_WAIT,
+        ))
+        .persistence(SQLPersistence())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    if application.persistence.shared:
+        # Несколько процессов: состояние диалога пишется сразу, а не раз в PERSISTENCE_INTERVAL
+        application.update_processor.after_update = functools.partial(
+            application.persistence.save_after_update, application)
 
-    # Обработчики списания баллов
-    application.add_handler(CallbackQueryHandler(redemption_handlers.start_redemption, pattern="^redeem_bonus$"))
-    application.add_handler(CallbackQueryHandler(redemption_handlers.handle_admin_redemption, pattern="^admin_redeem_"))
+    # Защита от флуда: лишние апдейты не доходят ни до одного обработчика
+    application.add_handler(TypeHandler(Update, throttle.check), group=-4)
+    # Отслеживание доступности чатов: до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, delivery.track_incoming), group=-3)
+    application.add_handler(ChatMemberHandler(delivery.track_chat_member, ChatMemberHandler.MY_CHAT_MEMBER), group=-2)
 
-    # Обработчики администратора
+    # Команды
+    application.add_handler(CommandHandler("start", user_handlers.start))
+    application.add_handler(CommandHandler("balance", commands.balance))
+    application.add_handler(CommandHandler("history", commands.history))
     application.add_handler(CommandHandler("admin", admin_handlers.admin_panel))
-    application.add_handler(CallbackQueryHandler(admin_handlers.handle_admin_action, pattern="^admin_"))
+    application.add_handler(CommandHandler("find", admin_handlers.find_member))
+
+    # Кнопки и ввод в диалогах: по одному обработчику, дальше — таблицы маршрутов
+    routes = build_router()
+    application.add_handler(CallbackQueryHandler(routes.dispatch_callback))
+    application.add_handler(MessageHandler(
+        filters.UpdateType.MESSAGE & ~filters.COMMAND
+        & (filters.TEXT | filters.PHOTO | filters.VIDEO | filters.Document.ALL | filters.CONTACT),
+        routes.dispatch_message
+    ))
+
+    # Периодическая сверка балансов с журналом баллов
+    application.job_queue.run_repeating(ledger.reconcile_job, interval=config.LEDGER_RECONCILE_INTERVAL, first=60)
+    # Сверка счетчиков статистики с полными агрегатами
+    application.job_queue.run_repeating(stats.verify_job, interval=config.STATS_VERIFY_INTERVAL, first=120)
+    # Напоминания о ближайших бронях и закрытие прошедших
+    application.job_queue.run_repeating(reminders.reminders_job, interval=config.REMINDER_INTERVAL, first=30)
+
+    # Метрики: после регистрации всех обработчиков
+    metrics.instrument(application)
+
+    return application
 
-    # Обработчики рассылки
-    application.add_handler(CallbackQueryHandler(broadcast_handlers.start_broadcast, pattern="^broadcast$"))
 
-    # Обработка текстовых сообщений
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, user_handlers.handle_all_messages))
+def main():
+    # Инициализация базы данных
+    init_db()
+
+    application = build_application()
 
     # Запуск бота
     print("Бот запущен...")
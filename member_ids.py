@@ -0,0 +1,65 @@
+from sqlalchemy import select, update, delete, exists
+
+import config
+from database import MemberIdCounter, FreeMemberId
+
+
+class MemberIdsExhausted(Exception):
+    pass
+
+
+async def allocate(db):
+    """Выдает короткий номер участника в транзакции сессии `db`.
+
+    Сначала выдается наименьший номер из free-list (пропуски, оставшиеся
+    после переноса старых users.id), иначе атомарно увеличивается счетчик. Оба пути — одно индексированное выражение,
+    без чтения всех занятых номеров; параллельные регистрации не получат
+    одинаковый номер (строки free-list блокируются с SKIP LOCKED, строку
+    счетчика блокирует UPDATE).
+    """
+    free = (
+        select(FreeMemberId.member_id)
+        .order_by(FreeMemberId.member_id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    reused = delete(FreeMemberId).where(FreeMemberId.member_id == free).returning(FreeMemberId.member_id)
+    counter = (
+        update(MemberIdCounter)
+        .where(MemberIdCounter.id == 1, MemberIdCounter.next_id <= config.MEMBER_ID_MAX)
+        .values(next_id=MemberIdCounter.next_id + 1)
+        .returning((MemberIdCounter.next_id - 1).label('member_id'))
+    )
+
+    if db.bind.dialect.name == 'postgresql':
+        # Одно выражение вместо двух обращений к серверу: счетчик растет, только если free-list пуст
+        reused = reused.cte('reused')
+        counter = counter.where(~exists(select(reused.c.member_id))).cte('counter')
+        member_id = await db.scalar(
+            select(reused.c.member_id).union_all(select(counter.c.member_id)).execution_options(prepare=True)
+        )
+    else:
+        member_id = await db.scalar(reused)
+        if member_id is None:
+            member_id = await db.scalar(counter)
+    if member_id is None:
+        raise MemberIdsExhausted(f"Все номера от 1 до {config.MEMBER_ID_MAX} заняты")
+    return member_id
+
+
+async def allocate_range(db, count):
+    """Выдает `count` номеров подряд для массовой загрузки; возвращает первый.
+
+    Одно UPDATE счетчика; номера из free-list при этом не используются —
+    их по-прежнему выдает allocate.
+    """
+    first = await db.scalar(
+        update(MemberIdCounter)
+        .where(MemberIdCounter.id == 1, MemberIdCounter.next_id + count - 1 <= config.MEMBER_ID_MAX)
+        .values(next_id=MemberIdCounter.next_id + count)
+        .returning(MemberIdCounter.next_id - count)
+    )
+    if first is None:
+        raise MemberIdsExhausted(f"Не хватает {count} свободных номеров до {config.MEMBER_ID_MAX}")
+    return first
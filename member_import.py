@@ -0,0 +1,217 @@
+"""Массовая загрузка участников из файла: перенос бумажной или кассовой базы.
+
+Строка файла (CSV, CSV.GZ или XLSX): телефон, имя, фамилия и необязательный
+баланс баллов — в том же порядке, что в выгрузке участников (exports).
+Заголовок допускается. Строки потоком кладутся во временную таблицу
+members_staging: на Postgres — через COPY FROM STDIN, на других базах —
+пакетными INSERT по IMPORT_CHUNK_SIZE строк. Слияние с users — несколько
+INSERT ... SELECT в той же транзакции: повторы телефона в файле и уже
+известные телефоны отбрасываются, новым участникам выдается диапазон номеров
+(member_ids.allocate_range), балансы открываются записями журнала adjustment.
+
+У загруженного участника еще нет Telegram (telegram_id пуст); когда он
+регистрируется в боте и отправляет свой контакт кнопкой с тем же телефоном,
+claim привязывает Telegram к нему. Набранный вручную номер карту не привязывает.
+"""
+import asyncio
+import itertools
+from datetime import datetime
+
+from sqlalchemy import (Table, MetaData, Column, Integer, String, select, insert, delete, exists, func,
+                        literal, text, true, false)
+
+import ledger
+import member_ids
+import outbox
+import receipts
+import stats
+from database import AsyncSessionLocal, User, PointsTransaction, normalize_phone, normalize_name
+
+IMPORT_CHUNK_SIZE = 10000
+ERRORS_KEPT = 1000
+
+# Живет до конца транзакции загрузки; на Postgres удаляется при commit сама
+STAGING = Table(
+    'members_staging', MetaData(),
+    Column('line', Integer, primary_key=True),
+    Column('phone', String(20)),
+    Column('phone_normalized', String(20)),
+    Column('first_name', String(100)),
+    Column('first_name_lower', String(100)),
+    Column('last_name', String(100)),
+    Column('last_name_lower', String(100)),
+    Column('balance', Integer),
+    prefixes=['TEMPORARY'],
+    postgresql_on_commit='DROP',
+)
+COLUMNS = [column.name for column in STAGING.columns]
+
+
+class Result:
+    """Итог загрузки: счетчики строк и первые ERRORS_KEPT ошибок."""
+
+    def __init__(self):
+        self.total = 0        # строк с данными
+        self.duplicates = 0   # телефон повторяется в файле (берется первая строка)
+        self.existing = 0     # телефон уже есть в базе
+        self.created = 0
+        self.points = 0
+        self.first_member_id = None
+        self.errors = []      # (номер строки, описание)
+        self.error_count = 0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < ERRORS_KEPT:
+            self.errors.append((line, message))
+
+
+def _parse(rows, result):
+    """Строки файла -> кортежи members_staging; ошибочные строки — в result."""
+    for line, row in rows:
+        cells = [receipts.cell(value) for value in row[:4]]
+        if not any(cells):
+            continue
+        cells += [''] * (4 - len(cells))
+        phone, first_name, last_name, balance = cells
+        digits = normalize_phone(phone) or ''
+        if len(digits) < 10 and line == 1:
+            continue  # заголовок
+        result.total += 1
+        if len(digits) < 10:
+            result.error(line, f"не похоже на телефон: {phone!r}")
+            continue
+        try:
+            balance = int(balance.replace(' ', '').replace('\xa0', '') or 0)
+        except ValueError:
+            result.error(line, f"баланс не целое число: {balance!r}")
+            continue
+        if balance < 0:
+            result.error(line, f"отрицательный баланс: {balance}")
+            continue
+        yield (line, phone[:20], digits, first_name[:100] or None, normalize_name(first_name[:100]),
+               last_name[:100] or None, normalize_name(last_name[:100]), balance)
+
+
+async def _chunks(parsed):
+    # Разбор — работа процессора: порции читаются в потоке, цикл событий свободен
+    while True:
+        chunk = await asyncio.to_thread(list, itertools.islice(parsed, IMPORT_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _copy_postgres(conn, chunks):
+    raw = (await conn.get_raw_connection()).driver_connection
+    async with raw.cursor() as cursor:
+        async with cursor.copy(f"COPY {STAGING.name} ({', '.join(COLUMNS)}) FROM STDIN") as copy:
+            async for chunk in chunks:
+                for row in chunk:
+                    await copy.write_row(row)
+    # Временные таблицы autovacuum не анализирует: без статистики слияние планируется вслепую
+    await conn.execute(text(f"ANALYZE {STAGING.name}"))
+
+
+async def _merge(db, reference, result):
+    result.duplicates = (await db.execute(delete(STAGING).where(STAGING.c.line.not_in(
+        select(func.min(STAGING.c.line)).group_by(STAGING.c.phone_normalized)
+    )))).rowcount
+    result.existing = (await db.execute(delete(STAGING).where(
+        exists().where(User.phone_normalized == STAGING.c.phone_normalized)
+    ))).rowcount
+    count, points = (await db.execute(
+        select(func.count(), func.coalesce(func.sum(STAGING.c.balance), 0)).select_from(STAGING)
+    )).one()
+    if not count:
+        return
+
+    first = await member_ids.allocate_range(db, count)
+    now = datetime.utcnow()
+    users = User.__table__
+    await db.execute(insert(users).from_select(
+        ['member_id', 'phone', 'phone_normalized', 'first_name', 'first_name_lower', 'last_name',
+         'last_name_lower', 'bonus_balance', 'registration_complete', 'is_reachable', 'created_at'],
+        # Номера по порядку строк файла; чата пока нет — рассылки и уведомления его пропускают
+        select(func.row_number().over(order_by=STAGING.c.line) + (first - 1), STAGING.c.phone,
+               STAGING.c.phone_normalized, STAGING.c.first_name, STAGING.c.first_name_lower,
+               STAGING.c.last_name, STAGING.c.last_name_lower, STAGING.c.balance, true(), false(), literal(now))
+    ))
+    await db.execute(insert(PointsTransaction).from_select(
+        ['user_id', 'kind', 'amount', 'balance_after', 'reference', 'created_at'],
+        select(users.c.id, literal(ledger.ADJUSTMENT), users.c.bonus_balance, users.c.bonus_balance,
+               literal(reference), literal(now))
+        .where(users.c.member_id.between(first, first + count - 1), users.c.bonus_balance > 0)
+    ))
+    stats.add(db, stats.MEMBERS, count)
+    stats.add(db, stats.POINTS, points)
+    stats.add_daily(db, stats.points_daily(ledger.ADJUSTMENT), points)
+    result.created, result.points, result.first_member_id = count, points, first
+
+
+async def load(path, filename, reference):
+    """Загружает участников из файла одной транзакцией и возвращает Result.
+
+    receipts.ReceiptsError — формат файла не поддерживается;
+    member_ids.MemberIdsExhausted — номеров на всех не хватает, ничего не записано.
+    """
+    result = Result()
+    parsed = _parse(receipts.read_rows(path, filename), result)
+    async with AsyncSessionLocal() as db:
+        conn = await db.connection()
+        postgres = conn.dialect.name == 'postgresql'
+        if not postgres:
+            # SQLite создает таблицу вне транзакции: после сбоя она могла остаться на соединении
+            await conn.run_sync(STAGING.drop, checkfirst=True)
+        await conn.run_sync(STAGING.create)
+
+        if postgres:
+            await _copy_postgres(conn, _chunks(parsed))
+        else:
+            async for chunk in _chunks(parsed):
+                await conn.execute(insert(STAGING), [dict(zip(COLUMNS, row)) for row in chunk])
+        await _merge(db, reference, result)
+
+        if not postgres:
+            await conn.run_sync(STAGING.drop)
+        await db.commit()
+    return result
+
+
+async def find_unclaimed(db, phone_normalized, lock=False):
+    """Загруженный участник без Telegram с этим телефоном или None."""
+    if not phone_normalized:
+        return None
+    query = (
+        select(User)
+        .where(User.phone_normalized == phone_normalized, User.telegram_id.is_(None),
+               User.registration_complete == True)
+        .order_by(User.id).limit(1)
+    )
+    if lock:
+        query = query.with_for_update(skip_locked=True)
+    return await db.scalar(query)
+
+
+async def claim(db, user):
+    """Привязывает Telegram регистрирующегося `user` к загруженному участнику с тем же телефоном.
+
+    Телефон `user` должен быть подтвержден Telegram (контакт самого
+    пользователя, а не набранный текст) — это проверяет вызывающий.
+    Вызывается в транзакции регистрации, когда поля `user` уже заполнены.
+    Возвращает участника — с его номером и балансом — или None. Строка `user`,
+    созданная /start, удаляется; администраторы получают уведомление.
+    """
+    member = await find_unclaimed(db, user.phone_normalized, lock=True)
+    if member is None:
+        return None
+
+    telegram_id, first_name, last_name, phone = user.telegram_id, user.first_name, user.last_name, user.phone
+    await db.delete(user)
+    await db.flush()  # освобождаем telegram_id до записи в строку участника
+    member.telegram_id = telegram_id
+    member.first_name, member.last_name, member.phone = first_name, last_name, phone
+    member.is_reachable = True
+    outbox.notify_admins(db, f"Участник №{member.member_id} ({first_name} {last_name}, {phone}) "
+                             f"из загруженной базы привязал Telegram при регистрации.")
+    return member
@@ -0,0 +1,359 @@
+"""Метрики в формате Prometheus: обработчики, запросы к БД и вызовы Bot API.
+
+Счетчики живут в памяти процесса и отдаются маршрутом /metrics (bot.py).
+Запись — пара сложений и bisect на вызов, так что инструментация включена
+всегда. Кроме гистограмм, на каждый апдейт считаются запросы к БД и вызовы
+Bot API (через contextvar); апдейт дольше METRICS_SLOW_UPDATE секунд
+пишется в лог с этой разбивкой.
+"""
+import asyncio
+import bisect
+import contextvars
+import logging
+import math
+import time
+
+from sqlalchemy import event, func, select
+from sqlalchemy.pool import QueuePool
+from telegram.ext import ApplicationHandlerStop
+
+import config
+import delivery
+import throttle
+import user_cache
+from database import AsyncSessionLocal, OutboxMessage, engine, async_engine
+from router import Router
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_registry = []
+_collectors = []  # функции, обновляющие значения перед выдачей (размеры очередей и т.п.)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # кортеж значений меток -> значение
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Для счетчиков, которые уже ведет другой модуль (delivery.stats, кэш)."""
+        self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [количество по корзинам (не накопительно), сумма, количество]
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {total!r}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def collector(function):
+    """Регистрирует функцию (можно async), которая обновляет метрики перед выдачей."""
+    _collectors.append(function)
+    return function
+
+
+async def render():
+    for function in _collectors:
+        try:
+            result = function()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            logger.exception("Ошибка сбора метрики %s", function.__name__)
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Метрики бота
+
+updates_total = Counter('bot_updates_total', 'Обработанные апдейты')
+update_duration = Histogram('bot_update_duration_seconds', 'Время обработки апдейта всеми обработчиками')
+update_db_queries = Histogram('bot_update_db_queries', 'Запросов к БД на один апдейт', buckets=COUNT_BUCKETS)
+update_api_calls = Histogram('bot_update_api_calls', 'Вызовов Bot API на один апдейт', buckets=COUNT_BUCKETS)
+handler_duration = Histogram('bot_handler_duration_seconds', 'Время работы обработчика', ['handler'])
+handler_errors = Counter('bot_handler_errors_total', 'Исключения в обработчиках', ['handler', 'error'])
+db_queries = Counter('bot_db_queries_total', 'Запросы к БД', ['operation'])
+db_query_duration = Histogram('bot_db_query_duration_seconds', 'Время запроса к БД', buckets=QUERY_BUCKETS)
+api_calls = Counter('bot_api_calls_total', 'Вызовы Bot API', ['method', 'status'])
+api_duration = Histogram('bot_api_call_duration_seconds', 'Время вызова Bot API', ['method'])
+delivery_events = Counter('bot_delivery_events_total', 'Недоступные чаты: пропущенные отправки и смена статуса',
+                          ['event'])
+send_events = Counter('bot_send_gateway_total', 'Отправки через SendGateway: sent, delayed, retried, dropped',
+                      ['event'])
+user_cache_lookups = Counter('bot_user_cache_lookups_total', 'Обращения к кэшу пользователей', ['result'])
+queue_depth = Gauge('bot_queue_depth', 'Глубина очередей', ['queue'])
+user_cache_size = Gauge('bot_user_cache_size', 'Записей в кэше пользователей')
+throttle_events = Counter('bot_throttle_total', 'Входящие апдейты: passed, deferred, duplicates, dropped', ['action'])
+throttle_users = Gauge('bot_throttle_users', 'Пользователей с корзиной защиты от флуда')
+db_pool_connections = Gauge('bot_db_pool_connections', 'Соединения пула БД: checked_out, idle, overflow', ['state'])
+db_pool_size = Gauge('bot_db_pool_size', 'Постоянных соединений в пуле БД (DB_POOL_SIZE)')
+db_pool_events = Counter('bot_db_pool_events_total', 'События пула БД: connect, checkout, invalidate, close',
+                         ['event'])
+
+
+class _UpdateStats:
+    __slots__ = ('db_queries', 'db_seconds', 'api_calls', 'api_seconds', 'handlers')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.api_calls = 0
+        self.api_seconds = 0.0
+        self.handlers = []
+
+
+_current = contextvars.ContextVar('metrics_update', default=None)
+
+
+# Обработчики и апдейты
+
+def _handler_name(callback):
+    return f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__name__}"
+
+
+def _timed_handler(callback):
+    name = _handler_name(callback)
+
+    async def wrapper(update, context):
+        began = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception as e:
+            handler_errors.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - began
+            handler_duration.observe(elapsed, handler=name)
+            stats = _current.get()
+            if stats is not None:
+                stats.handlers.append(name)
+
+    wrapper.__name__ = callback.__name__
+    wrapper.__module__ = callback.__module__
+    wrapper.__wrapped__ = callback
+    return wrapper
+
+
+def instrument(application):
+    """Оборачивает уже добавленные обработчики, process_update и HTTP-запросы бота."""
+    routers = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            # Обработчики из таблиц Router считаются отдельно от самой диспетчеризации
+            owner = getattr(handler.callback, '__self__', None)
+            if isinstance(owner, Router):
+                routers.add(owner)
+            handler.callback = _timed_handler(handler.callback)
+    for routes in routers:
+        routes.wrap(_timed_handler)
+
+    process_update = application.process_update
+
+    # Application вызывает self.process_update через атрибут экземпляра
+    async def timed_process_update(update):
+        stats = _UpdateStats()
+        token = _current.set(stats)
+        began = time.perf_counter()
+        try:
+            return await process_update(update)
+        finally:
+            elapsed = time.perf_counter() - began
+            _current.reset(token)
+            updates_total.inc()
+            update_duration.observe(elapsed)
+            update_db_queries.observe(stats.db_queries)
+            update_api_calls.observe(stats.api_calls)
+            if elapsed >= config.METRICS_SLOW_UPDATE:
+                logger.warning(
+                    "Медленный апдейт %s: %.0f ms, обработчики %s, БД %d запросов за %.0f ms, "
+                    "Bot API %d вызовов за %.0f ms",
+                    getattr(update, 'update_id', '?'), elapsed * 1000, ', '.join(stats.handlers) or '-',
+                    stats.db_queries, stats.db_seconds * 1000, stats.api_calls, stats.api_seconds * 1000,
+                )
+
+    application.process_update = timed_process_update
+    _instrument_request(application.bot)
+
+    @collector
+    def _queues():
+        queue_depth.set(application.update_queue.qsize(), queue='updates')
+        queue_depth.set(getattr(application.update_processor, 'pending_keys', 0), queue='users_in_flight')
+        gateway = application.bot.rate_limiter
+        if gateway is not None:
+            queue_depth.set(gateway.queued, queue='send_gateway')
+            for name, value in gateway.stats.items():
+                send_events.set(value, event=name)
+
+
+def _instrument_request(bot):
+    # Все вызовы context.bot.* проходят через do_request объекта запроса (кроме getUpdates)
+    request = bot._request[1]
+    do_request = request.do_request
+
+    async def timed_do_request(url, method, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        began = time.perf_counter()
+        status = 'error'
+        try:
+            code, payload = await do_request(url, method, *args, **kwargs)
+            status = str(code)
+            return code, payload
+        finally:
+            elapsed = time.perf_counter() - began
+            api_calls.inc(method=endpoint, status=status)
+            api_duration.observe(elapsed, method=endpoint)
+            stats = _current.get()
+            if stats is not None:
+                stats.api_calls += 1
+                stats.api_seconds += elapsed
+
+    request.do_request = timed_do_request
+
+
+# Запросы к БД
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_began = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_began
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement else ''
+        db_queries.inc(operation=operation if operation in _OPERATIONS else 'OTHER')
+        db_query_duration.observe(elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += elapsed
+
+
+_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'}
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+
+# Пул соединений бота (на SQLite пула нет — NullPool, метрики остаются пустыми)
+
+def _pool_event(name):
+    def listener(*args):
+        db_pool_events.inc(event=name)
+    return listener
+
+
+for _name in ('connect', 'checkout', 'invalidate', 'close'):
+    event.listen(async_engine.sync_engine.pool, _name, _pool_event(_name))
+
+
+@collector
+def _pool():
+    pool = async_engine.pool
+    if not isinstance(pool, QueuePool):
+        return
+    db_pool_size.set(pool.size())
+    db_pool_connections.set(pool.checkedout(), state='checked_out')
+    db_pool_connections.set(pool.checkedin(), state='idle')
+    db_pool_connections.set(max(pool.overflow(), 0), state='overflow')
+
+
+# Значения, которые уже считают другие модули
+
+@collector
+def _module_counters():
+    for name, value in delivery.stats.items():
+        delivery_events.set(value, event=name)
+    user_cache_lookups.set(user_cache.cache.hits, result='hit')
+    user_cache_lookups.set(user_cache.cache.misses, result='miss')
+    user_cache_size.set(len(user_cache.cache))
+    for name, value in throttle.stats.items():
+        throttle_events.set(value, action=name)
+    throttle_users.set(len(throttle.throttle))
+
+
+@collector
+async def _outbox_depth():
+    async with AsyncSessionLocal() as db:
+        pending = await db.scalar(select(func.count()).select_from(OutboxMessage)
+                                  .where(OutboxMessage.status == 'pending'))
+    queue_depth.set(pending, queue='outbox')
@@ -0,0 +1,251 @@
+"""Транзакционная очередь уведомлений (outbox).
+
+Обработчик вызывает enqueue/notify_admins в своей транзакции: уведомление
+сохраняется тогда и только тогда, когда сохраняется само изменение. Фоновый
+диспетчер забирает готовые строки (SKIP LOCKED на Postgres, так что процессов
+может быть несколько), отправляет их параллельно с общим лимитом частоты,
+повторяет неудачные попытки с растущей паузой, а несколько простых
+уведомлений одному администратору склеивает в один дайджест.
+
+Доставка «хотя бы один раз»: строка забирается арендой (next_attempt_at
+сдвигается на LEASE), и если процесс упал до отметки об отправке, после
+истечения аренды сообщение уйдет повторно.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, update, delete, bindparam, event
+from sqlalchemy.orm import Session
+from telegram import InlineKeyboardMarkup
+from telegram.error import RetryAfter, TelegramError
+
+import config
+import delivery
+from database import AsyncSessionLocal, OutboxMessage
+from ratelimit import RateLimiter, BULK
+
+logger = logging.getLogger(__name__)
+
+USER = 'user'
+ADMIN = 'admin'
+
+LEASE = 60                    # секунд, на которые диспетчер занимает забранные строки
+BACKOFF_MAX = 600             # потолок паузы между попытками, секунд
+COALESCE_DELAY = 0.5          # ждем, пока всплеск уведомлений закончится, прежде чем забирать
+DIGEST_LIMIT = 4000           # длина дайджеста (ограничение Telegram — 4096 символов)
+DIGEST_SEPARATOR = '\n\n— — —\n\n'
+KEEP_SENT = timedelta(days=7)  # сколько хранить отправленные строки
+PURGE_INTERVAL = 3600
+
+_wake = None  # asyncio.Event диспетчера, создается в start()
+_task = None
+
+
+def _markup(reply_markup):
+    return reply_markup.to_dict() if isinstance(reply_markup, InlineKeyboardMarkup) else reply_markup
+
+
+def enqueue(db, chat_id, text, reply_markup=None, kind=USER):
+    """Добавляет уведомление в транзакцию `db`; отправится после ее commit."""
+    db.add(OutboxMessage(chat_id=chat_id, kind=kind, text=text, reply_markup=_markup(reply_markup)))
+    db.info['outbox'] = True
+
+
+async def enqueue_many(db, messages):
+    """Пакетная вставка [(chat_id, text[, reply_markup])] пользовательских уведомлений.
+
+    Например, после начисления по чекам или напоминания о бронях.
+    """
+    if messages:
+        await db.execute(insert(OutboxMessage), [
+            {'chat_id': chat_id, 'kind': USER, 'text': text, 'reply_markup': _markup(markup[0]) if markup else None}
+            for chat_id, text, *markup in messages
+        ])
+        db.info['outbox'] = True
+
+
+def notify_admins(db, text, reply_markup=None):
+    for admin_id in config.ADMIN_IDS:
+        enqueue(db, admin_id, text, reply_markup, kind=ADMIN)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    # Будим диспетчер сразу после commit транзакции с уведомлениями
+    if session.info.pop('outbox', False) and _wake is not None:
+        _wake.set()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('outbox', None)
+
+
+def start(application):
+    global _task, _wake
+    if _task is None:
+        _wake = asyncio.Event()
+        _task = asyncio.create_task(run_dispatcher(application.bot))
+
+
+async def stop(application):
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+
+
+async def run_dispatcher(bot):
+    limiter = RateLimiter(config.OUTBOX_RATE)
+    semaphore = asyncio.Semaphore(config.OUTBOX_CONCURRENCY)
+    last_purge = 0.0
+    loop = asyncio.get_running_loop()
+
+    while True:
+        try:
+            if loop.time() - last_purge >= PURGE_INTERVAL:
+                last_purge = loop.time()
+                await _purge()
+            while await _dispatch_batch(bot, limiter, semaphore):
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ошибка диспетчера уведомлений")
+
+        try:
+            await asyncio.wait_for(_wake.wait(), config.OUTBOX_POLL_INTERVAL)
+            await asyncio.sleep(COALESCE_DELAY)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+
+
+async def _claim():
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        messages = (await db.scalars(
+            select(OutboxMessage)
+            .where(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now)
+            .order_by(OutboxMessage.id)
+            .limit(config.OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+            .execution_options(prepare=True)
+        )).all()
+        if messages:
+            await db.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_([message.id for message in messages]))
+                .values(next_attempt_at=now + timedelta(seconds=LEASE), attempts=OutboxMessage.attempts + 1)
+            )
+            await db.commit()
+    return messages
+
+
+def _digests(messages):
+    """Группы строк на отправку: простые уведомления администратору склеиваются."""
+    groups = []
+    open_digests = {}  # chat_id -> (группа, длина текста)
+    for message in messages:
+        if message.kind != ADMIN or message.reply_markup:
+            groups.append([message])
+            continue
+        group, length = open_digests.get(message.chat_id, (None, 0))
+        length += len(DIGEST_SEPARATOR) + len(message.text)
+        if group is None or length > DIGEST_LIMIT:
+            group, length = [], len(message.text)
+            groups.append(group)
+        group.append(message)
+        open_digests[message.chat_id] = (group, length)
+    return groups
+
+
+def _digest_text(group):
+    if len(group) == 1:
+        return group[0].text
+    return f"📬 Новых уведомлений: {len(group)}\n\n" + DIGEST_SEPARATOR.join(message.text for message in group)
+
+
+async def _dispatch_batch(bot, limiter, semaphore):
+    """Отправляет одну порцию; возвращает False, когда готовых строк больше нет."""
+    messages = await _claim()
+    if not messages:
+        return False
+
+    sent, retry, failed = [], [], []
+
+    async def send(group):
+        head = group[0]
+        if not delivery.is_reachable(head.chat_id):
+            failed.extend((message, 'чат недоступен') for message in group)
+            return
+        async with semaphore:
+            await limiter.acquire()
+            try:
+                await bot.send_message(
+                    chat_id=head.chat_id,
+                    text=_digest_text(group),
+                    reply_markup=InlineKeyboardMarkup.de_json(head.reply_markup, bot) if head.reply_markup else None,
+                    rate_limit_args=BULK,
+                )
+                sent.extend(group)
+            except RetryAfter as e:
+                limiter.pause(e.retry_after)
+                retry.extend((message, e.retry_after, str(e)) for message in group)
+            except TelegramError as e:
+                if await delivery.handle_send_error(head.chat_id, e):
+                    failed.extend((message, str(e)) for message in group)
+                else:
+                    retry.extend((message, None, str(e)) for message in group)
+
+    await asyncio.gather(*(send(group) for group in _digests(messages)))
+    await _save_results(sent, retry, failed)
+    return True
+
+
+def _backoff(attempts):
+    return min(BACKOFF_MAX, 5 * 2 ** (attempts - 1))
+
+
+async def _save_results(sent, retry, failed):
+    now = datetime.utcnow()
+    for message, retry_after, error in retry:
+        if message.attempts + 1 >= config.OUTBOX_MAX_ATTEMPTS:
+            failed.append((message, error))
+            logger.warning("Уведомление #%s в чат %s не отправлено: %s", message.id, message.chat_id, error)
+    retry = [item for item in retry if item[0].attempts + 1 < config.OUTBOX_MAX_ATTEMPTS]
+
+    async with AsyncSessionLocal() as db:
+        if sent:
+            await db.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_([message.id for message in sent]))
+                .values(status='sent', sent_at=now)
+            )
+        table = OutboxMessage.__table__
+        if retry:
+            await db.execute(
+                update(table).where(table.c.id == bindparam('message_id')).values(
+                    next_attempt_at=bindparam('retry_at'), last_error=bindparam('error')),
+                [{'message_id': message.id, 'error': error[:255],
+                  'retry_at': now + timedelta(seconds=retry_after or _backoff(message.attempts + 1))}
+                 for message, retry_after, error in retry],
+            )
+        if failed:
+            await db.execute(
+                update(table).where(table.c.id == bindparam('message_id')).values(
+                    status='failed', last_error=bindparam('error')),
+                [{'message_id': message.id, 'error': error[:255]} for message, error in failed],
+            )
+        await db.commit()
+
+
+async def _purge():
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(OutboxMessage)
+            .where(OutboxMessage.status == 'sent', OutboxMessage.sent_at < datetime.utcnow() - KEEP_SENT)
+        )
+        await db.commit()
@@ -0,0 +1,219 @@
+import asyncio
+import copy
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import select, delete, update
+from telegram import Update
+from sqlalchemy.dialects import postgresql, sqlite
+from telegram.ext import BasePersistence, PersistenceInput
+
+import config
+from database import AsyncSessionLocal, ConversationState, async_engine
+
+logger = logging.getLogger(__name__)
+
+
+class SQLPersistence(BasePersistence):
+    """Хранит context.user_data в таблице conversation_state.
+
+    * Загрузка ленивая: данные пользователя читаются при его первом апдейте,
+      а не все сразу при старте.
+    * Запись отложенная: Application раз в PERSISTENCE_INTERVAL секунд отдает
+      изменившиеся user_data, и они пишутся одной пачкой upsert-ов.
+    * Несколько процессов (PERSISTENCE_SHARED): данные пользователя сверяются с
+      БД на каждом апдейте и перечитываются, если их записал другой процесс, а
+      пишутся сразу после его апдейта (save_after_update), не дожидаясь
+      PERSISTENCE_INTERVAL. Запись условная — только если version в БД та же,
+      что была прочитана; иначе данные перечитываются из БД.
+    """
+
+    def __init__(self, shared=None, update_interval=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval or config.PERSISTENCE_INTERVAL,
+        )
+        self.shared = config.PERSISTENCE_SHARED if shared is None else shared
+        self._versions = {}  # user_id -> последняя известная этому процессу версия
+        self._pending = {}   # user_id -> данные, ожидающие записи
+        self._batch = None
+        self._saved = {}     # PERSISTENCE_SHARED: user_id -> копия последних записанных данных
+
+    async def get_user_data(self):
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if not self.shared:
+            # Несохраненные локальные изменения новее того, что лежит в БД
+            if user_id in self._pending or user_id in self._versions:
+                return
+
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(
+                select(ConversationState.data, ConversationState.version)
+                .where(ConversationState.user_id == user_id)
+                .execution_options(prepare=True)
+            )).first()
+
+        if row is None:
+            self._versions.setdefault(user_id, None)
+        elif self._versions.get(user_id) != row.version:
+            user_data.clear()
+            user_data.update(row.data)
+            self._versions[user_id] = row.version
+            if self.shared:
+                self._saved[user_id] = copy.deepcopy(row.data)
+
+    async def update_user_data(self, user_id, data):
+        if self.shared:
+            # Обычно уже записано save_after_update; здесь — изменения вне апдейтов (задачи)
+            await self.save_user_data(user_id, data)
+            return
+        self._pending[user_id] = data
+        if self._batch is None:
+            self._batch = asyncio.ensure_future(self._write_batch())
+        await asyncio.shield(self._batch)
+
+    async def _write_batch(self):
+        # Даем остальным update_user_data из того же цикла попасть в эту пачку
+        await asyncio.sleep(0)
+        self._batch = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        version = time.time_ns()
+        rows = [{'user_id': user_id, 'data': data, 'version': version, 'updated_at': datetime.utcnow()}
+                for user_id, data in pending.items()]
+        statement = _insert(ConversationState)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ConversationState.user_id],
+            set_={
+                'data': statement.excluded.data,
+                'version': statement.excluded.version,
+                'updated_at': statement.excluded.updated_at,
+            },
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(statement, rows)
+                await db.commit()
+        except Exception:
+            # Вернем данные в очередь, если их не успели заменить более новыми
+            for user_id, data in pending.items():
+                self._pending.setdefault(user_id, data)
+            raise
+        for user_id in pending:
+            self._versions[user_id] = version
+
+    async def save_after_update(self, application, update):
+        """PERSISTENCE_SHARED: записывает данные пользователя, как только его апдейт обработан."""
+        user = update.effective_user if isinstance(update, Update) else None
+        data = application.user_data.get(user.id) if user is not None else None
+        if data is None:
+            return
+        try:
+            await self.save_user_data(user.id, data)
+        except Exception:
+            # Данные не потеряны: их запишет следующий апдейт или update_user_data
+            logger.exception("Не удалось сохранить user_data пользователя %s", user.id)
+
+    async def save_user_data(self, user_id, data):
+        """Условная запись: только поверх версии, которую этот процесс прочитал или записал.
+
+        Если другой процесс успел записать свою версию, локальные изменения
+        отбрасываются и data перечитывается из БД. Возвращает True, если записано.
+        """
+        if self._saved.get(user_id) == data:
+            return True
+        expected = self._versions.get(user_id)
+        version = time.time_ns()
+        now = datetime.utcnow()
+        row = None
+        async with AsyncSessionLocal() as db:
+            if expected is None:
+                statement = _insert(ConversationState).values(
+                    user_id=user_id, data=data, version=version, updated_at=now,
+                ).on_conflict_do_nothing(index_elements=[ConversationState.user_id])
+            else:
+                statement = (
+                    update(ConversationState)
+                    .where(ConversationState.user_id == user_id, ConversationState.version == expected)
+                    .values(data=data, version=version, updated_at=now)
+                )
+            written = (await db.execute(statement)).rowcount > 0
+            if not written:
+                row = (await db.execute(
+                    select(ConversationState.data, ConversationState.version)
+                    .where(ConversationState.user_id == user_id)
+                )).first()
+            await db.commit()
+
+        if written:
+            self._versions[user_id] = version
+            self._saved[user_id] = copy.deepcopy(data)
+            return True
+        logger.warning("user_data пользователя %s изменил другой процесс: перечитываем", user_id)
+        data.clear()
+        if row is not None:
+            data.update(row.data)
+        self._versions[user_id] = row.version if row is not None else None
+        self._saved[user_id] = copy.deepcopy(data)
+        return False
+
+    async def drop_user_data(self, user_id):
+        self._pending.pop(user_id, None)
+        self._versions.pop(user_id, None)
+        self._saved.pop(user_id, None)
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(ConversationState).where(ConversationState.user_id == user_id))
+            await db.commit()
+
+    async def flush(self):
+        if self._batch is not None:
+            await self._batch
+        if self._pending:
+            self._batch = asyncio.ensure_future(self._write_batch())
+            await self._batch
+
+    # Остальные данные бот не хранит
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+def _insert(table):
+    if async_engine.dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
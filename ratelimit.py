@@ -0,0 +1,195 @@
+import asyncio
+import collections
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+
+class RateLimiter:
+    """Глобальный лимит частоты: не более `rate` захватов в секунду.
+
+    `pause()` останавливает всех ожидающих, например на `retry_after` из ответа 429.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # Пауза могла начаться, пока мы ждали своей очереди
+            if self._paused_until <= loop.time():
+                return
+
+    def pause(self, seconds):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+
+
+INTERACTIVE = 'interactive'  # ответы на апдейты: пропускаются первыми
+BULK = 'bulk'                # уведомления и рассылки: rate_limit_args=BULK
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас.
+
+    reserve() списывает токен сразу (баланс может уйти в минус) и возвращает,
+    сколько ждать до его наступления: параллельные отправки в один чат
+    выстраиваются друг за другом без опроса.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class SendGateway(BaseRateLimiter):
+    """Единая точка отправки для всех вызовов бота (ApplicationBuilder.rate_limiter).
+
+    * Отправки и правки сообщений проходят через корзину своего чата (личные чаты
+      и группы — свои лимиты Telegram), затем через общую корзину бота.
+    * Общая корзина выдает токены сначала ответам на апдейты, потом фоновым
+      отправкам (rate_limit_args=BULK от outbox и рассылок).
+    * 429 ставит на паузу все отправки на retry_after. Ответ на апдейт повторяется,
+      если ждать не дольше max_interactive_wait; фоновая отправка получает RetryAfter
+      сразу — у outbox и рассылок свой учет попыток.
+    Остальные методы (answerCallbackQuery, getMe, ...) проходят без ограничений.
+    """
+
+    LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+    CHAT_BUCKETS_MAX = 10000
+
+    def __init__(self, rate, chat_rate, chat_burst, group_rate, max_retries=2, max_interactive_wait=10):
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_interactive_wait = max_interactive_wait
+        self._global = None
+        self._chats = {}  # chat_id -> TokenBucket
+        self._queues = {INTERACTIVE: collections.deque(), BULK: collections.deque()}
+        self._pump_task = None
+        self._paused_until = 0.0
+        self.stats = {'sent': 0, 'delayed': 0, 'retried': 0, 'dropped': 0}
+
+    async def initialize(self):
+        # Общий запас — десятая доля секунды: ровный поток не упирается в окно лимита Telegram
+        self._global = TokenBucket(self.rate, max(1.0, self.rate / 10), asyncio.get_running_loop().time())
+
+    async def shutdown(self):
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            await asyncio.gather(self._pump_task, return_exceptions=True)
+            self._pump_task = None
+
+    @property
+    def queued(self):
+        return len(self._queues[INTERACTIVE]) + len(self._queues[BULK])
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(self.LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        priority = BULK if rate_limit_args == BULK else INTERACTIVE
+        chat_id = data.get('chat_id')
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            began = loop.time()
+            await self._acquire_chat(chat_id, priority, loop)
+            await self._acquire_global(priority, loop)
+            if loop.time() - began > 0.001:
+                self.stats['delayed'] += 1
+            try:
+                result = await callback(*args, **kwargs)
+                self.stats['sent'] += 1
+                return result
+            except RetryAfter as e:
+                retry_after = float(e.retry_after)
+                self._paused_until = max(self._paused_until, loop.time() + retry_after)
+                if priority == BULK or attempt == self.max_retries or retry_after > self.max_interactive_wait:
+                    self.stats['dropped'] += 1
+                    raise
+                self.stats['retried'] += 1
+
+    async def _acquire_chat(self, chat_id, priority, loop):
+        if chat_id is None:
+            return
+        bucket = self._chat_bucket(chat_id, loop.time())
+        if priority == BULK:
+            # Фоновая отправка не бронирует токен заранее: ответы в этот чат идут первыми
+            wait = bucket.wait_time(loop.time())
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = bucket.wait_time(loop.time())
+        delay = bucket.reserve(loop.time())
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.CHAT_BUCKETS_MAX:
+                # Полные корзины ничего не помнят: их можно забыть
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_full(now)}
+            group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, 1 if group else self.chat_burst, now)
+        return bucket
+
+    async def _acquire_global(self, priority, loop):
+        now = loop.time()
+        if not self.queued and now >= self._paused_until and self._global.wait_time(now) == 0:
+            self._global.reserve(now)
+            return
+        future = loop.create_future()
+        self._queues[priority].append(future)
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        # Раздает токены общей корзины ожидающим: сначала INTERACTIVE, затем BULK
+        loop = asyncio.get_running_loop()
+        try:
+            while self.queued:
+                now = loop.time()
+                wait = max(self._global.wait_time(now), self._paused_until - now)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                queue = self._queues[INTERACTIVE] or self._queues[BULK]
+                future = queue.popleft()
+                if not future.done():
+                    self._global.reserve(now)
+                    future.set_result(None)
+        finally:
+            self._pump_task = None
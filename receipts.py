@@ -0,0 +1,185 @@
+"""Пакетное начисление кэшбека по файлу чеков (CSV или XLSX).
+
+Строка файла: номер участника или телефон, сумма чека и необязательные
+дальнейшие колонки (номер чека и т.п.), которые игнорируются. Заголовок
+допускается. Файл читается потоком, суммы копятся по участникам, после чего
+все начисления и уведомления участникам проводятся одной транзакцией
+через ledger.post_many и outbox.
+"""
+import codecs
+import csv
+import gzip
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import select
+
+import ledger
+import outbox
+from database import User, PointsTransaction, normalize_phone
+
+CASHBACK = Decimal('0.05')  # 5% от суммы чека
+LOOKUP_CHUNK_SIZE = 1000
+
+
+class ReceiptsError(Exception):
+    """Файл нельзя обработать целиком: неизвестный формат, нет openpyxl и т.п."""
+
+
+class AlreadyApplied(Exception):
+    pass
+
+
+class Batch:
+    """Разобранный файл: начисления по участникам и ошибки по строкам."""
+
+    def __init__(self):
+        self.total = 0          # строк с данными
+        self.rows = 0           # принятых строк
+        self.by_member_id = {}  # member_id -> [баллы, номера строк]
+        self.by_phone = {}      # phone_normalized -> [баллы, номера строк]
+        self.errors = []        # (номер строки, описание)
+
+    def add(self, line, key, amount):
+        bonus = int(amount * CASHBACK)
+        digits = normalize_phone(key) or ''
+        if len(digits) >= 10:
+            target = self.by_phone.setdefault(digits, [0, []])
+        elif key.isdigit():
+            target = self.by_member_id.setdefault(int(key), [0, []])
+        else:
+            self.errors.append((line, f"не похоже на номер участника или телефон: {key!r}"))
+            return
+        target[0] += bonus
+        target[1].append(line)
+        self.rows += 1
+
+
+def cell(value):
+    # В XLSX номера и суммы приходят числами: 79161234567.0 -> '79161234567'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return '' if value is None else str(value).strip()
+
+
+def _csv_rows(path, opener=open):
+    with opener(path, 'rb') as f:
+        sample = f.read(65536)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        encoding = 'cp1251'  # так сохраняет CSV русский Excel
+
+    with opener(path, 'rt', newline='', encoding=encoding) as f:
+        text = f.read(4096)
+        f.seek(0)
+        delimiter = ';' if text.count(';') >= text.count(',') else ','
+        for line, row in enumerate(csv.reader(f, delimiter=delimiter), 1):
+            yield line, row
+
+
+def _xlsx_rows(path):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ReceiptsError("Для файлов XLSX нужен пакет openpyxl; загрузите CSV или установите его.")
+
+    # read_only читает лист потоком, не загружая его в память целиком
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for line, row in enumerate(workbook.active.iter_rows(values_only=True), 1):
+            yield line, row
+    finally:
+        workbook.close()
+
+
+def _amount(text):
+    try:
+        amount = Decimal(text.replace(' ', '').replace('\xa0', '').replace(',', '.'))
+    except InvalidOperation:
+        return None
+    return amount if amount.is_finite() else None
+
+
+def read_rows(path, filename):
+    """Строки файла потоком: (номер строки, ячейки). Формат — по имени файла."""
+    name = (filename or '').lower()
+    if name.endswith('.xlsx'):
+        return _xlsx_rows(path)
+    if name.endswith('.csv') or name.endswith('.txt'):
+        return _csv_rows(path)
+    if name.endswith('.csv.gz'):
+        # Больше 20 МБ Bot API не скачает: большие выгрузки присылают сжатыми
+        return _csv_rows(path, gzip.open)
+    raise ReceiptsError("Поддерживаются файлы .csv, .csv.gz и .xlsx")
+
+
+def parse_file(path, filename):
+    """Читает файл чеков потоком и возвращает Batch."""
+    rows = read_rows(path, filename)
+    batch = Batch()
+    for line, row in rows:
+        cells = [cell(value) for value in row[:2]]
+        if not any(cells):
+            continue
+        amount = _amount(cells[1]) if len(cells) > 1 else None
+        if amount is None and line == 1:
+            continue  # заголовок
+        batch.total += 1
+        if len(cells) < 2 or not cells[1]:
+            batch.errors.append((line, "нет суммы чека"))
+        elif amount is None:
+            batch.errors.append((line, f"сумма не число: {cells[1]!r}"))
+        elif amount <= 0:
+            batch.errors.append((line, f"сумма должна быть положительной: {cells[1]}"))
+        else:
+            batch.add(line, cells[0], amount)
+    return batch
+
+
+async def _resolve(db, column, keys):
+    found = {}
+    keys = list(keys)
+    for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+        rows = await db.execute(
+            select(column, User.id, User.telegram_id)
+            .where(column.in_(keys[start:start + LOOKUP_CHUNK_SIZE]), User.registration_complete == True)
+        )
+        found.update((key, (user_id, telegram_id)) for key, user_id, telegram_id in rows)
+    return found
+
+
+async def apply(db, batch, reference):
+    """Проводит начисления пакета в транзакции `db` (commit — за вызывающим).
+
+    Возвращает [(telegram_id, баллы, новый баланс)]; строки с неизвестными
+    участниками добавляются в batch.errors. Повторная загрузка того же файла
+    (та же reference в журнале) — AlreadyApplied.
+    """
+    if await db.scalar(select(PointsTransaction.id).where(PointsTransaction.reference == reference).limit(1)):
+        raise AlreadyApplied(reference)
+
+    amounts = {}
+    telegram_ids = {}
+    for column, entries in ((User.member_id, batch.by_member_id), (User.phone_normalized, batch.by_phone)):
+        users = await _resolve(db, column, entries)
+        for key, (bonus, lines) in entries.items():
+            if key not in users:
+                batch.errors.extend((line, f"участник {key} не найден") for line in lines)
+                continue
+            user_id, telegram_id = users[key]
+            amounts[user_id] = amounts.get(user_id, 0) + bonus
+            telegram_ids[user_id] = telegram_id
+
+    # Чеки меньше 20 рублей дают 0 баллов: в журнал их не пишем
+    amounts = {user_id: bonus for user_id, bonus in amounts.items() if bonus > 0}
+    balances = await ledger.post_many(db, ledger.ACCRUAL, amounts, reference=reference)
+    credited = [(telegram_ids[user_id], amounts[user_id], balance) for user_id, balance in balances.items()]
+    # Уведомления уходят из outbox после commit, кассир их не ждет
+    # Загруженные из файла участники без Telegram уведомлений не получают
+    await outbox.enqueue_many(db, [
+        (telegram_id, f"Вам начислено {bonus} бонусных баллов за посещение!\nТекущий баланс: {balance}")
+        for telegram_id, bonus, balance in credited if telegram_id is not None
+    ])
+    batch.errors.sort()
+    return credited
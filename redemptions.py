@@ -0,0 +1,94 @@
+"""Очередь запросов на списание: постраничный просмотр и решение пачкой.
+
+Решение начинается с условного UPDATE ... WHERE status = 'pending' RETURNING:
+он одновременно блокирует строки запросов и забирает только еще не решенные,
+так что повторное нажатие или два администратора не спишут баллы дважды.
+Вся пачка — одна транзакция: статусы, списания в журнале и уведомления
+пользователям сохраняются вместе.
+"""
+from datetime import datetime
+
+from sqlalchemy import select, update, func
+
+import ledger
+import outbox
+import stats
+from database import User, RedemptionRequest
+
+PENDING = 'pending'
+APPROVED = 'approved'
+REJECTED = 'rejected'
+
+PAGE_SIZE = 10
+
+
+async def pending_page(db, after_id=0, limit=PAGE_SIZE):
+    """Ожидающие запросы с id > after_id по возрастанию id, с данными пользователя.
+
+    Возвращает (rows, has_next); строка — (id, amount, created_at, member_id,
+    first_name, last_name, bonus_balance).
+    """
+    rows = (await db.execute(
+        select(RedemptionRequest.id, RedemptionRequest.amount, RedemptionRequest.created_at,
+               User.member_id, User.first_name, User.last_name, User.bonus_balance)
+        .join(User, User.id == RedemptionRequest.user_id)
+        .where(RedemptionRequest.status == PENDING, RedemptionRequest.id > after_id)
+        .order_by(RedemptionRequest.id)
+        .limit(limit + 1)
+    )).all()
+    return rows[:limit], len(rows) > limit
+
+
+async def count_pending(db):
+    return await db.scalar(select(func.count()).select_from(RedemptionRequest)
+                           .where(RedemptionRequest.status == PENDING))
+
+
+async def decide(db, request_ids, approve, admin_id):
+    """Подтверждает или отклоняет запросы в транзакции `db` (commit — за вызывающим).
+
+    Возвращает {'approved': [(request_id, telegram_id, new_balance)],
+    'rejected': [request_id], 'insufficient': [request_id], 'skipped': [request_id]}:
+    skipped — уже решенные или несуществующие, insufficient — отклоненные
+    из-за нехватки баллов на момент подтверждения.
+    """
+    table = RedemptionRequest.__table__
+    now = datetime.utcnow()
+    claimed = (await db.execute(
+        update(table)
+        .where(table.c.id.in_(request_ids), table.c.status == PENDING)
+        .values(status=APPROVED if approve else REJECTED, decided_at=now, decided_by=admin_id)
+        .returning(table.c.id, table.c.user_id, table.c.amount)
+    )).all()
+
+    result = {'approved': [], 'rejected': [], 'insufficient': [],
+              'skipped': sorted(set(request_ids) - {row.id for row in claimed})}
+    stats.add(db, stats.PENDING_REDEMPTIONS, -len(claimed))
+    if not approve:
+        result['rejected'] = sorted(row.id for row in claimed)
+        stats.add_daily(db, stats.REDEMPTIONS_REJECTED, len(claimed))
+        return result
+
+    telegram_ids = dict((await db.execute(
+        select(User.id, User.telegram_id).where(User.id.in_({row.user_id for row in claimed}))
+    )).all())
+
+    # Списываем по пользователям в порядке id: одинаковый порядок блокировок во всех транзакциях
+    for row in sorted(claimed, key=lambda row: (row.user_id, row.id)):
+        try:
+            balance = await ledger.post(db, row.user_id, ledger.REDEMPTION, -row.amount,
+                                        reference=f"redemption:{row.id}")
+        except ledger.InsufficientBalance:
+            result['insufficient'].append(row.id)
+            continue
+        telegram_id = telegram_ids.get(row.user_id)
+        result['approved'].append((row.id, telegram_id, balance))
+        if telegram_id is not None:
+            outbox.enqueue(db, telegram_id, f"С вашего счета списано {row.amount} бонусных баллов.\n"
+                                            f"Новый баланс: {balance}")
+
+    if result['insufficient']:
+        await db.execute(update(table).where(table.c.id.in_(result['insufficient'])).values(status=REJECTED))
+    stats.add_daily(db, stats.REDEMPTIONS_APPROVED, len(result['approved']))
+    stats.add_daily(db, stats.REDEMPTIONS_REJECTED, len(result['insufficient']))
+    return result
@@ -0,0 +1,135 @@
+"""Напоминания о бронях и закрытие прошедших броней.
+
+Вместо задачи JobQueue на каждую бронь — одна периодическая reminders_job
+(раз в REMINDER_INTERVAL секунд): состояние хранится в самих bookings и
+переживает перезапуск, а память не растет вместе с числом броней.
+
+* Напоминание получают брони, которые начинаются в ближайшие
+  REMINDER_BEFORE_MINUTES минут и еще не отмечены reminded_at. Окно
+  выбирается по индексу (booking_date, booking_time) порциями по
+  REMINDER_BATCH_SIZE; отметка и сообщения в outbox пишутся одной
+  транзакцией, отправляет их диспетчер outbox со своим лимитом. Повторный
+  проход (или второй процесс) не напомнит дважды.
+* Из напоминания гость подтверждает бронь или отменяет ее
+  (booking_handlers.reply_to_reminder).
+* После окончания брони (BOOKING_DURATION_MINUTES от начала) подтвержденная
+  становится completed, неподтвержденная после напоминания — no_show. Бронь,
+  гостя которой подтвердить не просили (напоминание не уходило или у
+  участника нет Telegram), неявкой не считается и тоже становится completed.
+  Запрос идет по индексу (status, booking_date, booking_time) и видит только
+  еще активные брони.
+
+Статус брони не меняет счетчики stats: брони и гости считаются по всем
+принятым броням на дату, как и при сверке.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, and_, or_, exists, tuple_
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import availability
+import config
+import outbox
+import router
+from availability import ACTIVE_STATUSES
+from database import AsyncSessionLocal, Booking, User
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+CONFIRMED = 'confirmed'
+CANCELLED = 'cancelled'
+COMPLETED = 'completed'
+NO_SHOW = 'no_show'
+
+
+def _starting_between(start, end):
+    """Брони, начинающиеся в [start, end) по времени заведения; диапазон дат — по индексу."""
+    return and_(
+        Booking.booking_date.between(start.date(), end.date()),
+        or_(Booking.booking_date > start.date(), Booking.booking_time >= start.time()),
+        or_(Booking.booking_date < end.date(), Booking.booking_time < end.time()),
+    )
+
+
+def is_due(day, booking_time, now=None):
+    """Начинается ли бронь в окне напоминаний — например, только что принятая на ближайший час."""
+    now = now or availability.now()
+    start = datetime.combine(day, booking_time)
+    return now <= start < now + timedelta(minutes=config.REMINDER_BEFORE_MINUTES)
+
+
+def reminder_text(booking_date, booking_time, guests):
+    return (
+        f"⏰ Напоминаем о брони сегодня в {booking_time:%H:%M}, гостей: {guests}.\n\n"
+        if booking_date == availability.now().date() else
+        f"⏰ Напоминаем о брони {booking_date:%d.%m.%Y} в {booking_time:%H:%M}, гостей: {guests}.\n\n"
+    ) + "Пожалуйста, подтвердите, что придете, или отмените бронь, если планы изменились."
+
+
+def reminder_keyboard(booking_id):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Приду", callback_data=router.callback_data(router.BOOKING_REPLY, 'yes', booking_id)),
+        InlineKeyboardButton("❌ Отменить",
+                             callback_data=router.callback_data(router.BOOKING_REPLY, 'no', booking_id)),
+    ]])
+
+
+async def send_reminders(now=None):
+    """Ставит в outbox напоминания для броней окна; возвращает число отмеченных броней."""
+    now = now or availability.now()
+    window = _starting_between(now, now + timedelta(minutes=config.REMINDER_BEFORE_MINUTES))
+    marked = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Booking.id, Booking.booking_date, Booking.booking_time, Booking.guests, User.telegram_id)
+                .outerjoin(User, User.id == Booking.user_id)
+                .where(window, Booking.status.in_(ACTIVE_STATUSES), Booking.reminded_at.is_(None))
+                .order_by(Booking.booking_date, Booking.booking_time, Booking.id)
+                .limit(config.REMINDER_BATCH_SIZE)
+                # Второй процесс берет другие брони, а не ждет эти
+                .with_for_update(of=Booking, skip_locked=True)
+            )).all()
+            if not rows:
+                break
+            await db.execute(update(Booking).where(Booking.id.in_([row.id for row in rows]))
+                             .values(reminded_at=datetime.utcnow()))
+            # У загруженного из файла участника Telegram еще нет: бронь отмечается без сообщения
+            await outbox.enqueue_many(db, [
+                (row.telegram_id, reminder_text(row.booking_date, row.booking_time, row.guests),
+                 reminder_keyboard(row.id))
+                for row in rows if row.telegram_id is not None
+            ])
+            await db.commit()
+        marked += len(rows)
+        if len(rows) < config.REMINDER_BATCH_SIZE:
+            break
+    return marked
+
+
+async def close_past(now=None):
+    """Закрывает закончившиеся брони; возвращает {'completed': n, 'no_show': k}."""
+    now = now or availability.now()
+    cutoff = now - timedelta(minutes=config.BOOKING_DURATION_MINUTES)
+    ended = tuple_(Booking.booking_date, Booking.booking_time) <= tuple_(cutoff.date(), cutoff.time())
+    # Гость получил напоминание с кнопкой «Приду» и не ответил
+    asked = and_(Booking.reminded_at.isnot(None),
+                 exists().where(User.id == Booking.user_id, User.telegram_id.isnot(None)))
+    async with AsyncSessionLocal() as db:
+        no_show = (await db.execute(
+            update(Booking).where(Booking.status == PENDING, ended, asked).values(status=NO_SHOW)
+        )).rowcount
+        completed = (await db.execute(
+            update(Booking).where(Booking.status.in_(ACTIVE_STATUSES), ended).values(status=COMPLETED)
+        )).rowcount
+        await db.commit()
+    return {'completed': completed, 'no_show': no_show}
+
+
+async def reminders_job(context):
+    closed = await close_past()
+    marked = await send_reminders()
+    if marked or closed['completed'] or closed['no_show']:
+        logger.info("Брони: напоминаний %d, завершено %d, неявок %d", marked, closed['completed'], closed['no_show'])
@@ -0,0 +1,200 @@
+"""Маршрутизация апдейтов: таблица кнопок и таблица состояний диалога.
+
+Вместо цепочки CallbackQueryHandler с регулярными выражениями и каскада
+if/elif по флагам user_data — по одному обработчику на кнопки и на сообщения,
+которые находят функцию поиском в словаре, сколько бы маршрутов ни было.
+
+callback_data: <версия><код>[:<аргумент>...], например "1bs:20241225:1930:4".
+Версия — цифра, так что новые данные не спутать со старыми ("booking",
+"admin_rq:p:0"): кнопки в уже отправленных сообщениях разбираются через
+LEGACY_CALLBACKS. Аргументы передаются обработчику в context.args.
+
+Состояние диалога — одна запись user_data['flow'] с именем ожидаемого ввода.
+Старые флаги (awaiting_*, admin_action, registration_step) из сохраненных
+user_data переводятся в нее при первом сообщении пользователя.
+"""
+import config
+
+CALLBACK_VERSION = '1'
+CALLBACK_MAX_BYTES = 64  # ограничение Bot API
+
+# Кнопки
+CONFIRM_REGISTRATION = 'rc'
+EDIT_REGISTRATION = 're'
+BALANCE = 'bal'
+BOOKING = 'bk'
+BOOK_SLOT = 'bs'  # :<ГГГГММДД>:<ЧЧММ>:<гости>
+BOOKING_REPLY = 'br'  # :<yes|no>:<id брони> — ответ на напоминание
+REDEEM = 'rd'
+REDEMPTION_DECISION = 'ra'  # :<ok|no>:<id запроса>
+ADMIN_USERS = 'au'  # [:<сортировка>:<n|p>:<ключ>...]
+ADMIN_ADD_BONUS = 'ab'
+ADMIN_BONUS_RECIPIENT = 'ap'  # :<id пользователя>:<сумма чека>:<метка сообщения>
+ADMIN_RECEIPTS = 'ar'
+ADMIN_REDEMPTIONS = 'aq'  # [:<действие>:<курсор>[:<id запроса>]]
+ADMIN_STATS = 'as'
+ADMIN_EXPORT = 'ax'  # [:<users|bookings|redemptions>]
+ADMIN_IMPORT = 'ai'
+BROADCAST = 'bc'
+
+# Состояния диалога
+FLOW_KEY = 'flow'
+FLOW_REGISTRATION = 'registration'
+FLOW_REDEEM_AMOUNT = 'redeem_amount'
+FLOW_BOOKING = 'booking'
+FLOW_ADD_BONUS = 'add_bonus'
+FLOW_RECEIPTS = 'receipts'
+FLOW_MEMBERS_IMPORT = 'members_import'
+FLOW_BROADCAST = 'broadcast'
+
+# Старые callback_data: целиком или часть до первого ':'
+LEGACY_CALLBACKS = {
+    'confirm_registration': CONFIRM_REGISTRATION,
+    'edit_registration': EDIT_REGISTRATION,
+    'balance': BALANCE,
+    'booking': BOOKING,
+    'book': BOOK_SLOT,
+    'redeem_bonus': REDEEM,
+    'admin_users': ADMIN_USERS,
+    'admin_add_bonus': ADMIN_ADD_BONUS,
+    'admin_bonus': ADMIN_BONUS_RECIPIENT,
+    'admin_receipts': ADMIN_RECEIPTS,
+    'admin_redemption_requests': ADMIN_REDEMPTIONS,
+    'admin_rq': ADMIN_REDEMPTIONS,
+    'broadcast': BROADCAST,
+}
+# admin_redeem_<confirm|reject>_<id>
+LEGACY_DECISIONS = {'admin_redeem_confirm': 'ok', 'admin_redeem_reject': 'no'}
+
+# Старые флаги user_data -> состояние, в порядке прежнего каскада
+LEGACY_FLOWS = (
+    ('awaiting_broadcast', FLOW_BROADCAST),
+    ('registration_step', FLOW_REGISTRATION),
+    ('awaiting_redemption_amount', FLOW_REDEEM_AMOUNT),
+    ('awaiting_booking_data', FLOW_BOOKING),
+)
+LEGACY_ADMIN_ACTIONS = {'add_bonus': FLOW_ADD_BONUS, 'receipts': FLOW_RECEIPTS}
+
+MENU_HINT = "Используйте кнопки меню для навигации."
+STALE_BUTTON = "Кнопка устарела, откройте меню заново."
+
+
+def callback_data(code, *args):
+    data = ':'.join((CALLBACK_VERSION + code, *map(str, args)))
+    if len(data.encode()) > CALLBACK_MAX_BYTES:
+        raise ValueError(f"callback_data длиннее {CALLBACK_MAX_BYTES} байт: {data}")
+    return data
+
+
+def parse_callback(data):
+    """callback_data -> (код, аргументы); код None, если кнопку не разобрать."""
+    head, _, rest = data.partition(':')
+    args = rest.split(':') if rest else []
+    if head[:1].isdigit():
+        return (head[1:] if head[0] == CALLBACK_VERSION else None), args
+    code = LEGACY_CALLBACKS.get(head)
+    if code is None:
+        prefix, _, request_id = head.rpartition('_')
+        if prefix in LEGACY_DECISIONS:
+            return REDEMPTION_DECISION, [LEGACY_DECISIONS[prefix], request_id]
+    return code, args
+
+
+def current_flow(user_data):
+    if FLOW_KEY in user_data:
+        return user_data[FLOW_KEY]
+    # user_data, сохраненные до появления flow
+    flow = None
+    for key, name in LEGACY_FLOWS:
+        value = user_data.get(key)
+        if value is not None and value is not False:
+            flow = name
+            break
+    action = user_data.pop('admin_action', None)
+    if flow is None:
+        flow = LEGACY_ADMIN_ACTIONS.get(action)
+    for key in ('awaiting_broadcast', 'awaiting_redemption_amount', 'awaiting_booking_data'):
+        user_data.pop(key, None)
+    user_data[FLOW_KEY] = flow
+    return flow
+
+
+def set_flow(context, name):
+    """Следующее сообщение пользователя уйдет обработчику состояния name."""
+    context.user_data[FLOW_KEY] = name
+
+
+def end_flow(context):
+    context.user_data[FLOW_KEY] = None
+
+
+def _message_kind(message):
+    if message.text is not None:
+        return 'text'
+    if message.photo:
+        return 'photo'
+    if message.video:
+        return 'video'
+    if message.document:
+        return 'document'
+    if message.contact:
+        return 'contact'
+    return None
+
+
+class Router:
+    """Таблицы маршрутов: код кнопки и (состояние, вид сообщения) -> (обработчик, только для администраторов)."""
+
+    def __init__(self):
+        self.callbacks = {}
+        self.flows = {}
+
+    def callback(self, code, handler, admin=False):
+        if code in self.callbacks:
+            raise ValueError(f"Кнопка {code} уже зарегистрирована")
+        self.callbacks[code] = (handler, admin)
+
+    def flow(self, name, handler, admin=False, kinds=('text',)):
+        for kind in kinds:
+            self.flows[(name, kind)] = (handler, admin)
+
+    def handlers(self):
+        return {route[0] for route in (*self.callbacks.values(), *self.flows.values())}
+
+    def wrap(self, wrapper):
+        """Оборачивает все обработчики таблиц (метрики, замеры)."""
+        wrapped = {handler: wrapper(handler) for handler in self.handlers()}
+        for table in (self.callbacks, self.flows):
+            for key, (handler, admin) in table.items():
+                table[key] = (wrapped[handler], admin)
+
+    def resolve_callback(self, data, user_id):
+        code, args = parse_callback(data or '')
+        route = self.callbacks.get(code)
+        if route is None or (route[1] and user_id not in config.ADMIN_IDS):
+            return None, args
+        return route[0], args
+
+    def resolve_message(self, message, user_data, user_id):
+        route = self.flows.get((current_flow(user_data), _message_kind(message)))
+        if route is None or (route[1] and user_id not in config.ADMIN_IDS):
+            return None
+        return route[0]
+
+    async def dispatch_callback(self, update, context):
+        query = update.callback_query
+        handler, args = self.resolve_callback(query.data, query.from_user.id)
+        if handler is None:
+            # Кнопка другой версии формата или чужая кнопка администратора
+            await query.answer(STALE_BUTTON)
+            return
+        context.args = args
+        await handler(update, context)
+
+    async def dispatch_message(self, update, context):
+        message = update.message
+        handler = self.resolve_message(message, context.user_data, update.effective_user.id)
+        if handler is not None:
+            await handler(update, context)
+        elif message.text is not None:
+            await message.reply_text(MENU_HINT)
@@ -0,0 +1,126 @@
+"""Поиск участника для кассира: по номеру участника, телефону или фамилии.
+
+Каждая ступень — отдельный запрос по индексу с LIMIT; результаты идут от точных
+совпадений к приблизительным. Нечеткий поиск по фамилии на Postgres использует
+pg_trgm (см. database._init_search), без него — ранжирование кандидатов с тем же
+началом фамилии; он выполняется, только если точные ступени ничего не нашли.
+"""
+import re
+from difflib import SequenceMatcher
+
+from sqlalchemy import select, and_, func, text
+
+from database import User, normalize_phone, normalize_name
+
+SEARCH_LIMIT = 10
+# Нечеткий поиск без pg_trgm: сколько первых букв фамилии должны совпасть,
+# сколько кандидатов ранжировать и минимальная похожесть
+FUZZY_PREFIX = 2
+FUZZY_CANDIDATES = 500
+FUZZY_MIN_RATIO = 0.75
+
+_trigram = {}  # диалект -> доступен ли pg_trgm
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _starts_with(db, column, prefix):
+    if db.bind.dialect.name == 'postgresql':
+        # Индекс с varchar_pattern_ops обслуживает LIKE 'abc%'
+        return column.like(_escape_like(prefix) + '%', escape='\\')
+    # SQLite использует индекс для LIKE только с NOCASE, а диапазон — всегда
+    return and_(column >= prefix, column < prefix + '\U0010ffff')
+
+
+def _phone_prefix(digits):
+    # Начало номера в том же виде, что и phone_normalized
+    if digits[0] == '8':
+        return '7' + digits[1:]
+    if digits[0] == '9':
+        return '7' + digits
+    return digits
+
+
+async def _has_trigram(db):
+    name = db.bind.dialect.name
+    if name not in _trigram:
+        _trigram[name] = name == 'postgresql' and bool(
+            await db.scalar(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"))
+        )
+    return _trigram[name]
+
+
+def _parse(query):
+    """(цифры, None, None) для номера или телефона, иначе (None, фамилия, начало имени)."""
+    digits = re.sub(r'\D', '', query)
+    if digits and not re.search(r'[^\d\s+()\-]', query):
+        return digits, None, None
+    words = (normalize_name(query) or '').split()
+    return None, words[0] if words else None, words[1] if len(words) > 1 else None
+
+
+def _tiers(db, query, digits, surname, first_name):
+    registered = select(User).where(User.registration_complete == True)
+
+    if digits:
+        if digits == query:
+            yield registered.where(User.member_id == int(digits))
+        yield registered.where(User.phone_normalized == normalize_phone(query))
+        if len(digits) >= 3:
+            yield (registered.where(_starts_with(db, User.phone_normalized, _phone_prefix(digits)))
+                   .order_by(User.phone_normalized))
+        return
+
+    # «Иванов Ив» — фамилия и начало имени
+    name = [_starts_with(db, User.first_name_lower, first_name)] if first_name else []
+    yield registered.where(User.last_name_lower == surname, *name).order_by(User.first_name_lower)
+    yield (registered.where(_starts_with(db, User.last_name_lower, surname), *name)
+           .order_by(User.last_name_lower, User.first_name_lower))
+
+
+async def _fuzzy(db, surname, first_name, limit):
+    registered = select(User).where(User.registration_complete == True)
+    name = [_starts_with(db, User.first_name_lower, first_name)] if first_name else []
+
+    if await _has_trigram(db):
+        return (await db.scalars(
+            registered.where(User.last_name_lower.op('%')(surname), *name)
+            .order_by(func.similarity(User.last_name_lower, surname).desc()).limit(limit)
+        )).all()
+
+    # Без pg_trgm: кандидаты с теми же первыми буквами по индексу, ранжирование в Python
+    candidates = await db.execute(
+        select(User.id, User.last_name_lower)
+        .where(User.registration_complete == True,
+               _starts_with(db, User.last_name_lower, surname[:FUZZY_PREFIX]), *name)
+        .limit(FUZZY_CANDIDATES)
+    )
+    scored = sorted(
+        ((SequenceMatcher(None, surname, last_name).ratio(), user_id) for user_id, last_name in candidates),
+        reverse=True,
+    )
+    ids = [user_id for ratio, user_id in scored[:limit] if ratio >= FUZZY_MIN_RATIO]
+    users = {user.id: user for user in await db.scalars(select(User).where(User.id.in_(ids)))} if ids else {}
+    return [users[user_id] for user_id in ids if user_id in users]
+
+
+async def find_users(db, query, limit=SEARCH_LIMIT):
+    """Зарегистрированные участники по номеру, телефону или фамилии; лучшие совпадения первыми."""
+    query = query.strip()
+    digits, surname, first_name = _parse(query)
+    if not digits and not surname:
+        return []
+
+    found = {}
+    for tier in _tiers(db, query, digits, surname, first_name):
+        for user in await db.scalars(tier.limit(limit)):
+            found.setdefault(user.id, user)
+        if len(found) >= limit:
+            break
+
+    # Нечеткий поиск по фамилии — только если точные и префиксные ступени ничего не дали
+    if not found and surname:
+        return await _fuzzy(db, surname, first_name, limit)
+    return list(found.values())[:limit]
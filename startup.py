@@ -0,0 +1,41 @@
+"""Разбивка времени запуска: из чего складывается холодный старт.
+
+Модуль импортируется первым, так что отсчет идет почти от старта процесса
+(без запуска самого интерпретатора). Шаги, выполняемые параллельно,
+считаются каждый отдельно, итог — по настенным часам.
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    def __init__(self):
+        self.began = time.perf_counter()
+        self._last = self.began
+        self.steps = []  # [(название, секунды)]
+
+    def lap(self, name):
+        """Отмечает шаг, закончившийся сейчас и начавшийся в конце предыдущего."""
+        now = time.perf_counter()
+        self.steps.append((name, now - self._last))
+        self._last = now
+
+    async def measure(self, name, awaitable):
+        began = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.steps.append((name, time.perf_counter() - began))
+            self._last = max(self._last, time.perf_counter())
+
+    def elapsed(self):
+        return time.perf_counter() - self.began
+
+    def report(self):
+        logger.info("Запуск за %.0f ms: %s", self.elapsed() * 1000,
+                    ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in self.steps))
+
+
+timer = StartupTimer()
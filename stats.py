@@ -0,0 +1,234 @@
+"""Сводная статистика для админки: счетчики, которые ведут сами пути записи.
+
+Регистрация, начисления и списания (ledger), запросы на списание и брони
+вызывают add/add_daily в своей транзакции; накопленные приращения пишутся
+одним-двумя UPSERT перед ее commit (событие before_commit), так что счетчик
+меняется тогда и только тогда, когда сохраняется само изменение. Каждая
+транзакция пишет в случайный из STATS_SLOTS слотов, и параллельные записи
+не выстраиваются в очередь за одной строкой.
+
+Экран статистики читает только суммы по слотам — число строк не зависит
+от размера users, bookings и redemption_requests. Периодическая verify_job
+сверяет счетчики с полными агрегатами и доводит расхождения поправкой.
+"""
+import logging
+import random
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select, func, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import config
+from database import AsyncSessionLocal, StatsTotal, StatsDaily, User, Booking, RedemptionRequest, PointsTransaction
+
+logger = logging.getLogger(__name__)
+
+# Итоги
+MEMBERS = 'members'
+POINTS = 'points'  # баллов на счетах
+PENDING_REDEMPTIONS = 'redemptions_pending'
+
+# За день (день по времени заведения; для броней — дата брони)
+REGISTRATIONS = 'registrations'
+BOOKINGS = 'bookings'
+GUESTS = 'guests'
+REDEMPTION_REQUESTS = 'redemption_requests'
+REDEMPTIONS_APPROVED = 'redemptions_approved'
+REDEMPTIONS_REJECTED = 'redemptions_rejected'
+POINTS_PREFIX = 'points_'  # points_<вид операции журнала>: сумма amount со знаком
+
+CORRECTIONS_LOGGED = 20
+
+
+def points_daily(kind):
+    return POINTS_PREFIX + kind
+
+
+def today():
+    return datetime.now(ZoneInfo(config.TIMEZONE)).date()
+
+
+def _utc_bounds(day):
+    """Границы дня заведения в UTC без tzinfo, как created_at в таблицах."""
+    zone = ZoneInfo(config.TIMEZONE)
+    start, end = (datetime.combine(d, time()).replace(tzinfo=zone).astimezone(timezone.utc).replace(tzinfo=None)
+                  for d in (day, day + timedelta(days=1)))
+    return start, end
+
+
+# Запись
+
+def _pending(db):
+    pending = db.info.get('stats')
+    if pending is None:
+        pending = db.info['stats'] = (defaultdict(int), defaultdict(int))
+    return pending
+
+
+def add(db, name, amount=1):
+    """Меняет итоговый счетчик в транзакции `db`."""
+    if amount:
+        _pending(db)[0][name] += amount
+
+
+def add_daily(db, name, amount=1, day=None):
+    """Меняет счетчик дня (по умолчанию — сегодняшнего) в транзакции `db`."""
+    if amount:
+        _pending(db)[1][(day or today(), name)] += amount
+
+
+def _upsert(session, table, rows, keys):
+    dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(table).values(rows)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=keys, set_={'value': table.c.value + statement.excluded.value}
+    ))
+
+
+@event.listens_for(Session, 'before_commit')
+def _before_commit(session):
+    pending = session.info.pop('stats', None)
+    if pending is None:
+        return
+    totals, daily = pending
+    slot = random.randrange(config.STATS_SLOTS)
+    # Строки по порядку ключей: одинаковый порядок блокировок во всех транзакциях
+    rows = [{'name': name, 'slot': slot, 'value': value} for name, value in sorted(totals.items()) if value]
+    if rows:
+        _upsert(session, StatsTotal.__table__, rows, ['name', 'slot'])
+    rows = [{'day': day, 'name': name, 'slot': slot, 'value': value}
+            for (day, name), value in sorted(daily.items()) if value]
+    if rows:
+        _upsert(session, StatsDaily.__table__, rows, ['day', 'name', 'slot'])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('stats', None)
+
+
+# Чтение
+
+async def _counted(db, first, last):
+    totals = dict((await db.execute(
+        select(StatsTotal.name, func.sum(StatsTotal.value)).group_by(StatsTotal.name)
+    )).all())
+    daily = defaultdict(dict)
+    rows = await db.execute(
+        select(StatsDaily.day, StatsDaily.name, func.sum(StatsDaily.value))
+        .where(StatsDaily.day.between(first, last))
+        .group_by(StatsDaily.day, StatsDaily.name)
+    )
+    for day, name, value in rows:
+        daily[day][name] = value
+    return totals, daily
+
+
+async def snapshot(db, days=7):
+    """Итоги и дневные счетчики за последние `days` дней: ({имя: значение}, {день: {имя: значение}})."""
+    last = today()
+    return await _counted(db, last - timedelta(days=days - 1), last)
+
+
+# Сверка
+
+async def _actual(db, days):
+    """Те же числа полными агрегатами по таблицам."""
+    totals = {
+        MEMBERS: await db.scalar(select(func.count()).select_from(User).where(User.registration_complete == True)),
+        POINTS: await db.scalar(select(func.coalesce(func.sum(User.bonus_balance), 0))),
+        PENDING_REDEMPTIONS: await db.scalar(select(func.count()).select_from(RedemptionRequest)
+                                             .where(RedemptionRequest.status == 'pending')),
+    }
+    daily = defaultdict(dict)
+    for day in days:
+        start, end = _utc_bounds(day)
+        entries = await db.execute(
+            select(PointsTransaction.kind, func.count(), func.sum(PointsTransaction.amount))
+            .where(PointsTransaction.created_at >= start, PointsTransaction.created_at < end)
+            .group_by(PointsTransaction.kind)
+        )
+        for kind, count, amount in entries:
+            daily[day][points_daily(kind)] = amount
+            if kind == 'welcome':
+                daily[day][REGISTRATIONS] = count
+        daily[day][REDEMPTION_REQUESTS] = await db.scalar(
+            select(func.count()).select_from(RedemptionRequest)
+            .where(RedemptionRequest.created_at >= start, RedemptionRequest.created_at < end)
+        )
+        decided = await db.execute(
+            select(RedemptionRequest.status, func.count())
+            .where(RedemptionRequest.decided_at >= start, RedemptionRequest.decided_at < end)
+            .group_by(RedemptionRequest.status)
+        )
+        for status, count in decided:
+            daily[day][REDEMPTIONS_APPROVED if status == 'approved' else REDEMPTIONS_REJECTED] = count
+
+    # Брони считаются по дате брони: вместе с прошедшими сверяем уже принятые на будущее
+    last = days[0] + timedelta(days=config.BOOKING_DAYS_AHEAD)
+    bookings = await db.execute(
+        select(Booking.booking_date, func.count(), func.coalesce(func.sum(Booking.guests), 0))
+        .where(Booking.booking_date.between(days[-1], last))
+        .group_by(Booking.booking_date)
+    )
+    for day, count, guests in bookings:
+        daily[day][BOOKINGS] = count
+        daily[day][GUESTS] = guests
+    return totals, daily, last
+
+
+async def verify(days=None):
+    """Сверяет счетчики с полными агрегатами и записывает поправки на разницу.
+
+    Поправка — обычное приращение, поэтому изменения, закоммиченные во время
+    сверки, не теряются. На Postgres счетчики и агрегаты читаются в одном
+    снимке (REPEATABLE READ). Возвращает {'checked': n, 'corrected': k}.
+    """
+    days = days or config.STATS_VERIFY_DAYS
+    window = [today() - timedelta(days=i) for i in range(days)]
+    async with AsyncSessionLocal() as db:
+        if db.bind.dialect.name == 'postgresql':
+            await db.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+        actual_totals, actual_daily, last = await _actual(db, window)
+        counted_totals, counted_daily = await _counted(db, window[-1], last)
+        await db.rollback()
+
+    corrections = []
+    for name, value in actual_totals.items():
+        delta = (value or 0) - (counted_totals.get(name) or 0)
+        if delta:
+            corrections.append((None, name, delta))
+    for day in set(actual_daily) | set(counted_daily):
+        actual, counted = actual_daily.get(day, {}), counted_daily.get(day, {})
+        for name in set(actual) | set(counted):
+            if day > window[0] and name not in (BOOKINGS, GUESTS):
+                continue
+            delta = (actual.get(name) or 0) - (counted.get(name) or 0)
+            if delta:
+                corrections.append((day, name, delta))
+
+    if corrections:
+        async with AsyncSessionLocal() as db:
+            for day, name, delta in corrections:
+                if day is None:
+                    add(db, name, delta)
+                else:
+                    add_daily(db, name, delta, day)
+            await db.commit()
+    if corrections:
+        # При первом запуске поправок много: одна строка с первыми из них
+        shown = ', '.join(f"{name}{f' за {day:%d.%m.%Y}' if day else ''} {delta:+d}"
+                          for day, name, delta in corrections[:CORRECTIONS_LOGGED])
+        logger.warning("Счетчики статистики расходились с данными, исправлено %d: %s%s",
+                       len(corrections), shown, ", ..." if len(corrections) > CORRECTIONS_LOGGED else "")
+    return {'checked': len(actual_totals) + sum(len(values) for values in actual_daily.values()),
+            'corrected': len(corrections)}
+
+
+async def verify_job(context):
+    result = await verify()
+    if result['corrected']:
+        logger.info("Сверка статистики: %s", result)
@@ -0,0 +1,147 @@
+"""Защита от флуда: входящие апдейты пользователя до обработчиков и БД.
+
+Обработчик стоит в самой ранней группе (main.py) и для каждого пользователя
+держит корзину токенов ratelimit.TokenBucket: THROTTLE_RATE апдейтов в
+секунду с запасом THROTTLE_BURST. Корзины живут в LRU на THROTTLE_USERS
+пользователей — вытесненный пользователь просто начинает с полной корзиной.
+
+* Повтор той же команды или нажатие той же кнопки в том же сообщении в
+  течение THROTTLE_DUPLICATE_WINDOW секунд отбрасывается: первый апдейт уже
+  обработан или обрабатывается.
+* Апдейт сверх лимита отбрасывается, а ввод в начатом диалоге (текст, фото,
+  документ для router.flow) откладывается до токена, если ждать не дольше
+  THROTTLE_MAX_DELAY и предыдущий апдейт не откладывался.
+  О сброшенных апдейтах пользователь узнает одним сообщением на серию.
+Отброшенное нажатие кнопки все равно получает ответ (answerCallbackQuery),
+иначе кнопка крутит индикатор загрузки, пока Telegram не сдастся: повтор —
+молча, сверх лимита — с THROTTLED_TEXT во всплывающем уведомлении.
+Отброшенный апдейт останавливает обработку (ApplicationHandlerStop): ни
+запросов к БД, ни ответов. Администраторы и служебные апдейты
+(my_chat_member) не ограничиваются.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop
+
+import config
+import router
+from ratelimit import TokenBucket
+
+THROTTLED_TEXT = "Слишком много запросов. Подождите несколько секунд и повторите."
+
+stats = {
+    'passed': 0,
+    'deferred': 0,
+    'duplicates': 0,
+    'dropped': 0,
+}
+
+
+class _Client(TokenBucket):
+    """Корзина пользователя и его последний командный апдейт."""
+
+    __slots__ = ('last_key', 'last_at', 'warned', 'deferred')
+
+    def __init__(self, rate, burst, now):
+        super().__init__(rate, burst, now)
+        self.last_key = None
+        self.last_at = 0.0
+        self.warned = False
+        self.deferred = False  # предыдущий апдейт ждал токена
+
+
+class Throttle:
+    def __init__(self, rate, burst, maxsize, duplicate_window, max_delay):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.duplicate_window = duplicate_window
+        self.max_delay = max_delay
+        self._clients = OrderedDict()  # telegram_id -> _Client
+
+    def __len__(self):
+        return len(self._clients)
+
+    def client(self, telegram_id, now):
+        client = self._clients.get(telegram_id)
+        if client is None:
+            client = self._clients[telegram_id] = _Client(self.rate, self.burst, now)
+            if len(self._clients) > self.maxsize:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(telegram_id)
+        return client
+
+
+throttle = Throttle(config.THROTTLE_RATE, config.THROTTLE_BURST, config.THROTTLE_USERS,
+                    config.THROTTLE_DUPLICATE_WINDOW, config.THROTTLE_MAX_DELAY)
+
+
+def duplicate_key(update):
+    """Ключ для склейки повторов: команда или кнопка в конкретном сообщении; для ввода — None."""
+    query = update.callback_query
+    if query is not None:
+        return ('callback', query.message.message_id if query.message else None, query.data)
+    message = update.message
+    if message is not None and message.text and message.text.startswith('/'):
+        return ('command', message.text.strip())
+    return None
+
+
+async def _answer(update, text=None):
+    query = update.callback_query
+    if query is None:
+        return
+    try:
+        await query.answer(text)
+    except TelegramError:
+        pass  # устаревший запрос: апдейт отбрасывается в любом случае
+
+
+async def check(update, context):
+    user = update.effective_user
+    if (throttle.rate <= 0 or user is None or update.my_chat_member is not None
+            or user.id in config.ADMIN_IDS):
+        return
+
+    now = time.monotonic()
+    client = throttle.client(user.id, now)
+    key = duplicate_key(update)
+    if key is not None and key == client.last_key and now - client.last_at < throttle.duplicate_window:
+        stats['duplicates'] += 1
+        await _answer(update)
+        raise ApplicationHandlerStop
+
+    wait = client.wait_time(now)
+    # Ждать токена может только ввод в начатом диалоге (команду или кнопку пользователь повторит)
+    # и не два раза подряд: иначе поток текста занимал бы слот обработки бесконечно
+    deferrable = (key is None and not client.deferred and wait <= throttle.max_delay
+                  and router.current_flow(context.user_data) is not None)
+    if wait > 0 and not deferrable:
+        stats['dropped'] += 1
+        if update.callback_query is not None:
+            await _answer(update, THROTTLED_TEXT)
+        elif not client.warned:
+            chat = update.effective_chat
+            if chat is not None:
+                try:
+                    await context.bot.send_message(chat.id, THROTTLED_TEXT)
+                except TelegramError:
+                    pass  # апдейт отбрасывается в любом случае
+        client.warned = True
+        raise ApplicationHandlerStop
+    if wait > 0:
+        # Ввод в диалоге не теряем: апдейты пользователя и так идут по одному
+        stats['deferred'] += 1
+        await asyncio.sleep(wait)
+        now = time.monotonic()
+
+    client.reserve(now)
+    client.warned = False
+    client.deferred = wait > 0
+    if key is not None:
+        client.last_key, client.last_at = key, now
+    stats['passed'] += 1
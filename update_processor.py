@@ -0,0 +1,70 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def ordering_key(update):
+    """Ключ очереди: апдейты с одним ключом обрабатываются строго по порядку."""
+    if isinstance(update, Update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов разных пользователей с порядком внутри пользователя.
+
+    Состояние диалогов (flow и данные диалога в user_data) меняется
+    последовательно, поэтому апдейт пользователя ждет завершения его предыдущего
+    апдейта. Ожидающие апдейты не занимают слоты семафора, так что поток сообщений
+    одного пользователя не мешает остальным.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # ключ -> future последнего принятого апдейта; записи удаляются, когда очередь пуста
+        self._tails = {}
+        # Вызывается после обработки апдейта, до следующего апдейта того же пользователя
+        self.after_update = None
+
+    # BaseUpdateProcessor.process_update помечен @final, но порядок нужно зафиксировать
+    # до захвата семафора: Application вызывает этот метод в порядке поступления апдейтов.
+    async def process_update(self, update, coroutine):
+        key = ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        try:
+            if previous is not None:
+                await previous
+            await super().process_update(update, coroutine)
+        except asyncio.CancelledError:
+            if asyncio.iscoroutine(coroutine):
+                coroutine.close()
+            raise
+        finally:
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+        if self.after_update is not None:
+            await self.after_update(update)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def pending_keys(self):
+        return len(self._tails)
@@ -0,0 +1,109 @@
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import select
+
+import config
+from database import AsyncSessionLocal, User
+
+# Компактный неизменяемый снимок профиля: атрибуты совпадают с User,
+# поэтому обработчики работают со снимком так же, как с ORM-объектом
+UserSnapshot = namedtuple(
+    'UserSnapshot',
+    'id member_id telegram_id first_name last_name phone bonus_balance registration_complete',
+)
+
+
+def snapshot(user):
+    return UserSnapshot(
+        user.id, user.member_id, user.telegram_id, user.first_name, user.last_name, user.phone,
+        user.bonus_balance, user.registration_complete,
+    )
+
+
+class UserCache:
+    """LRU-кэш снимков пользователей по telegram_id с TTL и индексом по User.id."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # telegram_id -> (expires_at, UserSnapshot)
+        self._by_id = {}               # User.id -> telegram_id
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, telegram_id):
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.invalidate(telegram_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[1]
+
+    def get_by_id(self, user_id):
+        telegram_id = self._by_id.get(user_id)
+        if telegram_id is None:
+            self.misses += 1
+            return None
+        return self.get(telegram_id)
+
+    def put(self, user):
+        if user is None:
+            return None
+        user = user if isinstance(user, UserSnapshot) else snapshot(user)
+        old = self._entries.pop(user.telegram_id, None)
+        if old is not None and old[1].id != user.id:
+            self._by_id.pop(old[1].id, None)
+        self._entries[user.telegram_id] = (time.monotonic() + self.ttl, user)
+        self._by_id[user.id] = user.telegram_id
+        while len(self._entries) > self.maxsize:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._by_id.pop(evicted.id, None)
+        return user
+
+    def update_balance(self, telegram_id, balance):
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            self._entries[telegram_id] = (entry[0], entry[1]._replace(bonus_balance=balance))
+
+    def invalidate(self, telegram_id):
+        entry = self._entries.pop(telegram_id, None)
+        if entry is not None:
+            self._by_id.pop(entry[1].id, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+cache = UserCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+
+
+async def get_user(telegram_id):
+    """Снимок пользователя из кэша или из БД (с заполнением кэша); None, если его нет."""
+    user = cache.get(telegram_id)
+    if user is None:
+        async with AsyncSessionLocal() as db:
+            user = cache.put(await db.scalar(
+                select(User).where(User.telegram_id == telegram_id).execution_options(prepare=True)
+            ))
+    return user
+
+
+async def get_user_by_id(user_id):
+    user = cache.get_by_id(user_id)
+    if user is None:
+        async with AsyncSessionLocal() as db:
+            user = cache.put(await db.get(User, user_id, execution_options={'prepare': True}))
+    return user